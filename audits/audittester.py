@@ -36,6 +36,7 @@ from umit.pm.gui.plugins.tree import *
 from umit.pm.gui.plugins.engine import *
 from umit.pm.manager.auditmanager import *
 from umit.pm.core.netconst import IL_TYPE_ETH
+from umit.pm.core.messages import StreamSink, JSONLinesSink
 from umit.pm.core.atoms import generate_traceback
 
 class Tester(object):
@@ -49,7 +50,18 @@ class Tester(object):
         else:
             datalink = options.datalink
 
-        tester = AuditTester(args[0], datalink)
+        tester = AuditTester(args[0], datalink,
+                             fastdecode=options.fast or options.parity,
+                             workers=options.jobs or 1)
+
+        if options.parity:
+            from umit.pm.backend import check_headers
+
+            def check_parity(mpkt):
+                for err in check_headers(mpkt):
+                    print "parity %s" % err
+
+            AuditManager().add_to_hook_point('pm::received', check_parity)
 
         modules = []
         filters = []
@@ -114,6 +126,17 @@ class Tester(object):
                 sys.path.remove(os.path.abspath(path))
                 del sys.modules['main']
 
+        # Print every message as soon as it is sent. The rate limit could be
+        # enabled again with -sglobal.msg_rate=N
+        bus = AuditManager().msgbus
+        bus.synchronous = True
+        bus.add_sink(StreamSink())
+
+        if options.json:
+            bus.add_sink(JSONLinesSink(options.json, 'w'))
+
+        AuditManager().global_conf['msg_rate'] = 0
+
         if options.setexp:
             for exp in options.setexp.split(','):
                 try:
@@ -147,11 +170,18 @@ class Tester(object):
                 print "Error while starting plugin"
                 print generate_traceback()
 
-        AuditManager().global_conf['debug'] = True
+        if options.stats:
+            AuditManager().set_profiling(True)
 
         tester.start()
         tester.join()
 
+        # Summaries of the suppressed messages
+        bus.flush()
+
+        if options.stats:
+            AuditManager().dump_stats()
+
 if __name__ == "__main__":
     parser = optparse.OptionParser(usage='%s [options] FILE' % sys.argv[0])
 
@@ -167,6 +197,18 @@ if __name__ == "__main__":
                       help='Option to set. Ex: -sdecoder.ip.checksum_check=1')
     parser.add_option('-p', '--profile', action='store_true', dest='profile',
                       help='Profile the code')
+    parser.add_option('-x', '--fast', action='store_true', dest='fast',
+                      help='Decode the common headers with the fast decoder')
+    parser.add_option('-c', '--parity', action='store_true', dest='parity',
+                      help='Like -x but check the decoded headers against '
+                           'the backend')
+    parser.add_option('-S', '--stats', action='store_true', dest='stats',
+                      help='Print the time spent by every decoder and hook')
+    parser.add_option('-J', '--json', action='store', dest='json',
+                      help='Also write the messages to FILE as JSON lines')
+    parser.add_option('-j', '--jobs', action='store', dest='jobs',
+                      type='int', help='Number of processes running the '
+                                       'audits (sharded by flow)')
 
     options, args = parser.parse_args()
 
@@ -20,6 +20,12 @@
 
 """
 Ethernet protocol decoder
+
+The fast header decoder checked against the backend on IPv6 frames with
+extension headers and fragments (no output means no mismatch):
+
+>>> from umit.pm.core.auditutils import audit_unittest
+>>> audit_unittest('-c -f ethernet', 'ipv6-ext-headers.pcap')
 """
 
 from umit.pm.core.logger import log
@@ -24,6 +24,10 @@ FTP protocol dissector (Passive audit)
 >>> from umit.pm.core.auditutils import audit_unittest
 >>> audit_unittest('-f ethernet,ip,tcp,ftp', 'ftp-login.pcap')
 dissector.ftp.info FTP : 127.0.0.1:21 -> USER: anonymous PASS: guest@example.com
+>>> audit_unittest('-j2 -f ethernet,ip,tcp,ftp', 'ftp-login.pcap')
+dissector.ftp.info FTP : 127.0.0.1:21 -> USER: anonymous PASS: guest@example.com
+>>> audit_unittest('-c -f ethernet,ip,tcp,ftp', 'ftp-login.pcap')
+dissector.ftp.info FTP : 127.0.0.1:21 -> USER: anonymous PASS: guest@example.com
 """
 
 from umit.pm.core.logger import log
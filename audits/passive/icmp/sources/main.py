@@ -25,6 +25,9 @@ ICMP decoder
 >>> audit_unittest('-f ethernet,ip,icmp', 'wrong-checksum-icmp.pcap')
 decoder.icmp.notice Invalid ICMP packet from 127.0.0.1 to 127.0.0.1 : wrong checksum 0x29a instead of 0xfde3
 decoder.icmp.notice Invalid ICMP packet from 127.0.0.1 to 127.0.0.1 : wrong checksum 0x7a69 instead of 0x5e4
+>>> audit_unittest('-c -f ethernet,ip,icmp', 'wrong-checksum-icmp.pcap')
+decoder.icmp.notice Invalid ICMP packet from 127.0.0.1 to 127.0.0.1 : wrong checksum 0x29a instead of 0xfde3
+decoder.icmp.notice Invalid ICMP packet from 127.0.0.1 to 127.0.0.1 : wrong checksum 0x7a69 instead of 0x5e4
 """
 
 from struct import unpack
@@ -27,6 +27,11 @@ These are only doctest strings:
 >>> audit_unittest('-f ethernet,ip', 'wrong-checksum.pcap')
 decoder.ip.notice Invalid IP packet from 127.0.0.1 to 127.0.0.1 : wrong checksum 0xdead instead of 0x7bce
 
+The same with the fast header decoder checked against the backend.
+
+>>> audit_unittest('-c -f ethernet,ip', 'wrong-checksum.pcap')
+decoder.ip.notice Invalid IP packet from 127.0.0.1 to 127.0.0.1 : wrong checksum 0xdead instead of 0x7bce
+
 Fragmentation tests.
 
 >>> audit_unittest('-f ethernet,ip -sdecoder.ip.reassemble_max_fragments=1', 'fragmented-ping.pcap')
@@ -43,6 +48,19 @@ decoder.ip.debug Dropping out the sequence with ID: 14300 due reassemble_max_fra
 decoder.ip.debug Dropping out the sequence with ID: 14301 due reassemble_max_fragments
 decoder.ip.debug Dropping out the sequence with ID: 14302 due reassemble_max_fragments
 decoder.ip.debug Dropping out the sequence with ID: 14303 due reassemble_max_fragments
+>>> audit_unittest('-c -f ethernet,ip -sdecoder.ip.reassemble_max_fragments=2', 'fragmented-ping.pcap')
+decoder.ip.debug Dropping out the sequence with ID: 14300 due reassemble_max_fragments
+decoder.ip.debug Dropping out the sequence with ID: 14301 due reassemble_max_fragments
+decoder.ip.debug Dropping out the sequence with ID: 14302 due reassemble_max_fragments
+decoder.ip.debug Dropping out the sequence with ID: 14303 due reassemble_max_fragments
+
+The fragments of a datagram are audited by the same worker process.
+
+>>> audit_unittest('-j2 -f ethernet,ip -sdecoder.ip.reassemble_max_fragments=2', 'fragmented-ping.pcap')
+decoder.ip.debug Dropping out the sequence with ID: 14300 due reassemble_max_fragments
+decoder.ip.debug Dropping out the sequence with ID: 14301 due reassemble_max_fragments
+decoder.ip.debug Dropping out the sequence with ID: 14302 due reassemble_max_fragments
+decoder.ip.debug Dropping out the sequence with ID: 14303 due reassemble_max_fragments
 """
 
 import time
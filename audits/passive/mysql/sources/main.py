@@ -32,6 +32,26 @@ decoder.tcp.notice Invalid TCP packet from 10.10.3.60 to 10.10.3.109 : wrong che
 decoder.tcp.notice Invalid TCP packet from 10.10.3.60 to 10.10.3.109 : wrong checksum 0x1b9b instead of 0xe53e
 decoder.tcp.notice Invalid TCP packet from 10.10.3.60 to 10.10.3.109 : wrong checksum 0x1b19 instead of 0x6374
 decoder.tcp.notice Invalid TCP packet from 10.10.3.60 to 10.10.3.109 : wrong checksum 0x1ba6 instead of 0xddd0
+>>> audit_unittest('-j2 -f ethernet,ip,tcp,mysql', 'mysql.pcap')
+decoder.tcp.notice Invalid TCP packet from 10.10.3.60 to 10.10.3.109 : wrong checksum 0x1b1b instead of 0xb328
+dissector.mysql.info MYSQL : 10.10.3.60:3306 -> USER: admin HASH: 5f28eeab88bfc739938db314591ff3f9501e8cd5:2e7d4e4f7e4f5126685a6c30465247503a6e4032
+decoder.tcp.notice Invalid TCP packet from 10.10.3.60 to 10.10.3.109 : wrong checksum 0x1ae8 instead of 0x56c6
+decoder.tcp.notice Invalid TCP packet from 10.10.3.60 to 10.10.3.109 : wrong checksum 0x1aee instead of 0x4eaa
+decoder.tcp.notice Invalid TCP packet from 10.10.3.60 to 10.10.3.109 : wrong checksum 0x1b4f instead of 0x9f92
+decoder.tcp.notice Invalid TCP packet from 10.10.3.60 to 10.10.3.109 : wrong checksum 0x1b2d instead of 0x3011
+decoder.tcp.notice Invalid TCP packet from 10.10.3.60 to 10.10.3.109 : wrong checksum 0x1b9b instead of 0xe53e
+decoder.tcp.notice Invalid TCP packet from 10.10.3.60 to 10.10.3.109 : wrong checksum 0x1b19 instead of 0x6374
+decoder.tcp.notice Invalid TCP packet from 10.10.3.60 to 10.10.3.109 : wrong checksum 0x1ba6 instead of 0xddd0
+>>> audit_unittest('-c -f ethernet,ip,tcp,mysql', 'mysql.pcap')
+decoder.tcp.notice Invalid TCP packet from 10.10.3.60 to 10.10.3.109 : wrong checksum 0x1b1b instead of 0xb328
+dissector.mysql.info MYSQL : 10.10.3.60:3306 -> USER: admin HASH: 5f28eeab88bfc739938db314591ff3f9501e8cd5:2e7d4e4f7e4f5126685a6c30465247503a6e4032
+decoder.tcp.notice Invalid TCP packet from 10.10.3.60 to 10.10.3.109 : wrong checksum 0x1ae8 instead of 0x56c6
+decoder.tcp.notice Invalid TCP packet from 10.10.3.60 to 10.10.3.109 : wrong checksum 0x1aee instead of 0x4eaa
+decoder.tcp.notice Invalid TCP packet from 10.10.3.60 to 10.10.3.109 : wrong checksum 0x1b4f instead of 0x9f92
+decoder.tcp.notice Invalid TCP packet from 10.10.3.60 to 10.10.3.109 : wrong checksum 0x1b2d instead of 0x3011
+decoder.tcp.notice Invalid TCP packet from 10.10.3.60 to 10.10.3.109 : wrong checksum 0x1b9b instead of 0xe53e
+decoder.tcp.notice Invalid TCP packet from 10.10.3.60 to 10.10.3.109 : wrong checksum 0x1b19 instead of 0x6374
+decoder.tcp.notice Invalid TCP packet from 10.10.3.60 to 10.10.3.109 : wrong checksum 0x1ba6 instead of 0xddd0
 """
 
 from umit.pm.core.logger import log
@@ -141,6 +141,8 @@ class Profiler(Plugin, PassiveAudit):
 
     @unbind_function('pm.hostlist', ('get', 'info', 'populate', 'get_target'))
     def stop(self):
+        AuditManager().release_serial(self)
+
         try:
             manager.add_decoder_hook(PROTO_LAYER, NL_TYPE_TCP,
                                      self._parse_tcp, 1)
@@ -231,6 +233,9 @@ class Profiler(Plugin, PassiveAudit):
     def register_hooks(self):
         manager = AuditManager()
 
+        # The profiles are read by the pm.hostlist service in this process
+        manager.require_serial(self)
+
         # TODO: also handle UDP when UDP dissectors will be ready.
         manager.add_decoder_hook(PROTO_LAYER, NL_TYPE_TCP,
                                  self._parse_tcp, 1)
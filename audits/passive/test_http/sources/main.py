@@ -515,6 +515,11 @@ dissector.http.is_request False
 dissector.http.is_response True
 dissector.http.response 74da406ca3055d0e56080b796c670ee3
 ---
+
+The fast header decoder checked against the backend (no output means no
+mismatch):
+
+>>> audit_unittest('-c -f ethernet', 'http_with_jpegs.pcap')
 """
 
 import hashlib
@@ -24,6 +24,8 @@ UDP protocol decoder.
 >>> from umit.pm.core.auditutils import audit_unittest
 >>> audit_unittest('-f ethernet,ip,udp', 'wrong-checksum-udp.pcap')
 decoder.udp.notice Invalid UDP packet from 127.0.0.1 to 127.0.0.1 : wrong checksum 0x29a instead of 0x172
+>>> audit_unittest('-c -f ethernet,ip,udp', 'wrong-checksum-udp.pcap')
+decoder.udp.notice Invalid UDP packet from 127.0.0.1 to 127.0.0.1 : wrong checksum 0x29a instead of 0x172
 """
 
 from time import time
@@ -24,6 +24,8 @@ VNC protocol dissector (Passive audit)
 >>> from umit.pm.core.auditutils import audit_unittest
 >>> audit_unittest('-f ethernet,ip,tcp,vnc -sdecoder.tcp.checksum_check=0', 'vnc-session.pcap')
 dissector.vnc.info VNC : 172.27.17.2:5900 -> 985878519f9f7ecd7fb97aedaa912b10:ad909a41fb0309fec3772f2860d946c3
+>>> audit_unittest('-c -f ethernet,ip,tcp,vnc -sdecoder.tcp.checksum_check=0', 'vnc-session.pcap')
+dissector.vnc.info VNC : 172.27.17.2:5900 -> 985878519f9f7ecd7fb97aedaa912b10:ad909a41fb0309fec3772f2860d946c3
 """
 
 from umit.pm.core.logger import log
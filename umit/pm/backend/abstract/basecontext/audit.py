@@ -38,8 +38,8 @@ class BaseAuditContext(TimedContext):
         @param bpf_filter pcap filter to apply to the inputs interfaces
         @param skip_forwarded Skip forwarded packets. Don't execute decode phase
         @param unoffensive Don't forward any packets while unified sniffing
-        @param capmethod use 0 for standard capture, 1 for tcpdump and 2 for
-                         dumpcap helper
+        @param capmethod use 0 for standard capture, 1 for tcpdump, 2 for
+                         dumpcap helper and 3 for PACKET_MMAP ring
         @return a BaseAuditContext
         """
 
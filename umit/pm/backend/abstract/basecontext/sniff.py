@@ -32,12 +32,16 @@ class BaseSniffContext(TimedContext):
                  scount=0, stime=0, ssize=0, real=True, scroll=True, \
                  resmac=True, resname=False, restransport=True, promisc=True, \
                  background=False, capmethod=0, audits=True, \
-                 callback=None, udata=None):
+                 callback=None, udata=None, ringcount=0, ringsize=0, \
+                 spillsize=0, spilltime=0, spillfiles=0, workers=0, \
+                 prefilter=None, record=False):
 
         """
         Create a BaseSniffContext object
 
-        @param iface the interface to sniff from
+        @param iface the interface to sniff from or a list of interfaces to
+                     capture concurrently. The packets of the interfaces
+                     are merged in timestamp order.
         @param filter the BPF filter to apply
         @param minsize the min size for every packet (0 no filter)
         @param maxsize the max size for every packet (0 no filter)
@@ -54,16 +58,41 @@ class BaseSniffContext(TimedContext):
         @param background if the sniff context should be runned in background
         @param capmethod the method to use (0 for standard, 1 for virtual
                          interface trough file, 2 for tcpdump helper, 3 for
-                         dumpcap helper)
+                         dumpcap helper, 4 for PACKET_MMAP ring)
         @param audits a bool to indicate if auditdispatcher should be feeded
                        with captured packets.
         @param callback a function to call at every packet sniffed
         @param udata the user data to pass to callback
+        @param ringcount keep only the last ringcount packets in memory and
+                         spill the older ones to pcap files (0 no limit)
+        @param ringsize keep only the last ringsize bytes of packets in memory
+                        and spill the older ones to pcap files (0 no limit)
+        @param spillsize rotate the spill file after spillsize bytes
+                         (0 no rotation)
+        @param spilltime rotate the spill file after spilltime seconds
+                         (0 no rotation)
+        @param spillfiles max number of spill files to keep. The oldest are
+                          deleted (0 keep all the spill files)
+        @param workers spread the capture over workers processes joined in a
+                       PACKET_FANOUT group (0 or 1 to disable). Only for
+                       native capture methods.
+        @param prefilter a comma separated list of offset:size[&mask]=value
+                         predicates applied on the raw bytes of the frames
+                         before decoding them (None to disable)
+        @param record record only mode: the raw frames are written to capfile
+                      without decoding them and only the counters are kept.
+                      Only for native capture methods.
         """
 
         TimedContext.__init__(self)
 
-        self.iface = iface
+        if isinstance(iface, (list, tuple)):
+            self.ifaces = list(iface)
+            self.iface = ', '.join(self.ifaces)
+        else:
+            self.ifaces = iface and [iface] or []
+            self.iface = iface
+
         self.filter = filter
         self.min_packet_size = minsize
         self.max_packet_size = maxsize
@@ -87,6 +116,16 @@ class BaseSniffContext(TimedContext):
         self.callback = callback
         self.udata = udata
 
+        self.ring_count = ringcount
+        self.ring_size = ringsize
+        self.spill_size = spillsize
+        self.spill_time = spilltime
+        self.spill_files = spillfiles
+
+        self.workers = workers
+        self.raw_filter = prefilter
+        self.record = record
+
         self.tot_size = 0
         self.tot_time = 0
         self.tot_count = 0
@@ -20,6 +20,7 @@
 
 from static import StaticContext
 
+from umit.pm.core.i18n import _
 from umit.pm.core.logger import log
 from umit.pm.backend.abstract.context import register_timed_context
 
@@ -146,6 +147,61 @@ class BaseTimedContext(StaticContext):
     def get_all_data(self):
         return self._data
 
+    def get_statistics(self):
+        """
+        Override this to report the live statistics of the context.
+
+        @return a dict with some of these keys:
+          - kernel_received/kernel_dropped: packets received and dropped by
+            the kernel (PACKET_STATISTICS)
+          - filtered: packets discarded by the raw prefilter
+          - decode_queue: raw packets waiting to be decoded
+          - display_queue: decoded packets not yet picked by get_data
+          - decode_drops: packets dropped because the decode queue was full
+          - dispatch_drops: packets dropped because of audit dispatch errors
+          - pps/bps: packets and bytes per second over a sliding window
+        """
+        return {}
+
+    def format_statistics(self, stats=None):
+        """
+        @param stats a dict returned by get_statistics or None
+        @return a string describing the statistics or an empty string
+        """
+
+        if stats is None:
+            stats = self.get_statistics()
+
+        if not stats:
+            return ''
+
+        ret = []
+
+        if 'pps' in stats:
+            bps = stats.get('bps', 0)
+
+            if bps >= 1024 ** 2:
+                rate = _('%.1f MB/s') % (bps / (1024.0 ** 2))
+            else:
+                rate = _('%.1f KB/s') % (bps / 1024.0)
+
+            ret.append(_('%d pkt/s') % stats['pps'])
+            ret.append(rate)
+
+        if stats.get('kernel_received', None) is not None:
+            ret.append(_('kernel: %d recv/%d drop') % \
+                       (stats['kernel_received'], stats['kernel_dropped']))
+
+        for key, label in (('filtered', _('filtered')),
+                           ('decode_queue', _('decode queue')),
+                           ('display_queue', _('display queue')),
+                           ('decode_drops', _('decode drops')),
+                           ('dispatch_drops', _('dispatch drops'))):
+            if stats.get(key, 0):
+                ret.append('%s: %d' % (label, stats[key]))
+
+        return ', '.join(ret)
+
     state = property(get_state, set_state, \
             doc="The TimedContext state (NOT_RUNNING/RUNNING/PAUSED)")
 
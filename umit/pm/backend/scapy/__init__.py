@@ -21,6 +21,7 @@
 from umit.pm.backend.scapy.packet import *
 from umit.pm.backend.scapy.wrapper import *
 from umit.pm.backend.scapy.utils import *
+from umit.pm.backend.scapy.headers import decode_headers, check_headers
 from umit.pm.backend.scapy.doc import apply_doc
 
 apply_doc()
@@ -0,0 +1,1049 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2009 Adriano Monteiro Marques
+#
+# Author: Francesco Piccinno <stack.box@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+"""
+Capture sockets used by the native capture methods.
+
+The L2MmapListenSocket class uses a PACKET_MMAP (TPACKET_V3) ring shared
+with the kernel. Frames are read a whole block at a time, without a syscall
+for every packet. The socket has the same interface of the conf.L2listen
+sockets (recv, fileno, close, LL) so it could be used as drop-in replacement.
+
+The FanoutCapture class spreads the capture over several worker processes
+joined in a PACKET_FANOUT group. Every worker decodes and audits its share
+of flows and sends the results back to the parent process.
+
+The StreamMerger class merges the packets captured on several interfaces
+in a single list ordered by timestamp.
+"""
+
+import os
+import mmap
+import time
+import signal
+import socket
+import struct
+import select
+import ctypes
+import heapq
+import cPickle
+import itertools
+
+from collections import deque
+
+from umit.pm.core.logger import log
+from umit.pm.core.atoms import generate_traceback
+from umit.pm.backend.scapy.wrapper import *
+from umit.pm.backend.scapy.packet import MetaPacket
+
+SOL_PACKET = 263
+PACKET_ADD_MEMBERSHIP = 1
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+PACKET_FANOUT = 18
+PACKET_MR_PROMISC = 1
+
+PACKET_FANOUT_HASH = 0
+
+TPACKET_V3 = 2
+
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+
+# struct tpacket_block_desc / tpacket_hdr_v1
+BLOCK_STATUS_OFFSET = 8
+BLOCK_HDR_FMT = "III"       # block_status, num_pkts, offset_to_first_pkt
+
+# struct tpacket3_hdr (tp_next_offset, tp_sec, tp_nsec, tp_snaplen, tp_len,
+#                      tp_status, tp_mac, tp_net)
+PKT_HDR_FMT = "IIIIIIHH"
+
+ETH_P_ALL_PROTO = 0x0003
+
+MSG_DONTWAIT = 0x40
+
+SO_TIMESTAMPNS = 35
+SCM_TIMESTAMPNS = SO_TIMESTAMPNS
+
+# struct sockaddr_ll (sll_family, sll_protocol, sll_ifindex, sll_hatype,
+#                     sll_pkttype, sll_halen, sll_addr)
+SOCKADDR_LL_FMT = struct.Struct("HHiHBB8s")
+
+# struct cmsghdr (cmsg_len, cmsg_level, cmsg_type) and struct timespec
+CMSG_HDR_FMT = struct.Struct("@Lii")
+TIMESPEC_FMT = struct.Struct("@ll")
+
+# Max number of frames read at every wakeup by recv_batch
+RECV_BATCH = 64
+
+class L2MmapListenSocket(object):
+    """
+    A listen socket reading frames from a TPACKET_V3 memory mapped ring.
+    """
+
+    desc = "read packets at layer 2 using a PACKET_MMAP ring"
+
+    def __init__(self, iface=None, filter=None, promisc=None, \
+                 block_size=1 << 20, block_nr=32, frame_size=2048, \
+                 timeout=60):
+        """
+        @param iface the interface to listen on
+        @param filter a BPF filter string
+        @param promisc True to set the interface in promisc mode (None to use
+                       conf.sniff_promisc)
+        @param block_size the size of a ring block (multiple of PAGESIZE)
+        @param block_nr the number of blocks in the ring
+        @param frame_size the frame size hint for the kernel
+        @param timeout retire a block after timeout msecs even if not full
+        @raise socket.error or EnvironmentError if the ring is not supported
+        """
+
+        if not getattr(socket, 'AF_PACKET', None):
+            raise socket.error(-1, 'PACKET_MMAP is not supported here')
+
+        self.iface = iface or conf.iface
+        self.block_size = block_size
+        self.block_nr = block_nr
+
+        self.ring = None
+        self.block_idx = 0
+        self.pending = []
+
+        self.ins = socket.socket(socket.AF_PACKET, socket.SOCK_RAW,
+                                 socket.htons(ETH_P_ALL_PROTO))
+
+        try:
+            self.ins.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+
+            req = struct.pack("IIIIIII", block_size, block_nr, frame_size,
+                              (block_size * block_nr) / frame_size,
+                              timeout, 0, 0)
+
+            self.ins.setsockopt(SOL_PACKET, PACKET_RX_RING, req)
+
+            self.ring = mmap.mmap(self.ins.fileno(), block_size * block_nr,
+                                  mmap.MAP_SHARED,
+                                  mmap.PROT_READ | mmap.PROT_WRITE)
+
+            if filter:
+                attach_filter(self.ins, filter)
+
+            self.ins.bind((self.iface, ETH_P_ALL_PROTO))
+
+            if promisc is None:
+                promisc = conf.sniff_promisc
+
+            if promisc:
+                self.__set_promisc()
+        except:
+            self.close()
+            raise
+
+        try:
+            self.LL = conf.l2types[get_if_raw_hwaddr(self.iface)[0]]
+        except Exception:
+            log.debug('Unable to guess the datalink. Using Ether')
+            self.LL = Ether
+
+        log.debug('PACKET_MMAP ring of %d bytes ready on %s' % \
+                  (block_size * block_nr, self.iface))
+
+    def __set_promisc(self):
+        ifindex = struct.unpack("I", get_if(self.iface, SIOCGIFINDEX)[16:20])[0]
+        mreq = struct.pack("IHH8s", ifindex, PACKET_MR_PROMISC, 0, "")
+        self.ins.setsockopt(SOL_PACKET, PACKET_ADD_MEMBERSHIP, mreq)
+
+    def fileno(self):
+        return self.ins.fileno()
+
+    def close(self):
+        if self.ring:
+            self.ring.close()
+            self.ring = None
+
+        if self.ins:
+            self.ins.close()
+
+    def recv_block(self):
+        """
+        Read all the frames contained in the current block and give it back
+        to the kernel.
+
+        @return a list of (raw bytes, timestamp) tuples (empty if the block
+                is still owned by the kernel)
+        """
+
+        ring = self.ring
+        offset = self.block_idx * self.block_size
+
+        status, num_pkts, pkt_offset = \
+              struct.unpack_from(BLOCK_HDR_FMT, ring,
+                                 offset + BLOCK_STATUS_OFFSET)
+
+        if not status & TP_STATUS_USER:
+            return []
+
+        frames = []
+        pkt_offset += offset
+
+        for idx in xrange(num_pkts):
+            next_offset, sec, nsec, snaplen, wirelen, pkt_status, mac, net = \
+                      struct.unpack_from(PKT_HDR_FMT, ring, pkt_offset)
+
+            # Slicing the mmap copies the frame, so it is safe to release
+            # the block to the kernel once the loop is completed.
+            start = pkt_offset + mac
+            frames.append((ring[start:start + snaplen],
+                           sec + 0.000000001 * nsec))
+
+            pkt_offset += next_offset
+
+        struct.pack_into("I", ring, offset + BLOCK_STATUS_OFFSET,
+                         TP_STATUS_KERNEL)
+
+        self.block_idx = (self.block_idx + 1) % self.block_nr
+
+        return frames
+
+    def recv_raw(self, x=MTU):
+        """
+        @return a (raw bytes, timestamp) tuple or None if nothing is ready
+        """
+
+        if not self.pending:
+            self.pending = self.recv_block()
+            self.pending.reverse()
+
+            if not self.pending:
+                return None
+
+        return self.pending.pop()
+
+    def recv(self, x=MTU):
+        """
+        @return a dissected packet or None if nothing is ready
+        """
+
+        ret = self.recv_raw(x)
+
+        if ret is None:
+            return None
+
+        raw, ts = ret
+
+        try:
+            pkt = self.LL(raw)
+        except:
+            if conf.debug_dissector:
+                raise
+
+            pkt = Raw(raw)
+
+        pkt.time = ts
+        return pkt
+
+def mmap_listen(iface=None, filter=None):
+    """
+    Create a L2MmapListenSocket falling back to conf.L2listen if the
+    PACKET_MMAP ring is not available.
+
+    @param iface the interface to listen on
+    @param filter a BPF filter string
+    @return a listen socket
+    """
+
+    try:
+        return L2MmapListenSocket(iface=iface, filter=filter)
+    except Exception, err:
+        log.warning('PACKET_MMAP ring not available (%s). Falling back '
+                    'to the standard listen socket' % str(err))
+
+        return conf.L2listen(type=ETH_P_ALL, iface=iface, filter=filter)
+
+###############################################################################
+# Batched receive
+###############################################################################
+
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+class msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint),
+                ('msg_iov', ctypes.POINTER(iovec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', msghdr),
+                ('msg_len', ctypes.c_uint)]
+
+try:
+    _recvmmsg = ctypes.CDLL(None, use_errno=True).recvmmsg
+    _recvmmsg.restype = ctypes.c_int
+except (AttributeError, OSError, TypeError):
+    _recvmmsg = None
+
+class MmsgReceiver(object):
+    """
+    Preallocated buffers to read up to count frames with a single
+    recvmmsg() call. The sockaddr_ll of every frame is read to get its
+    link type and the kernel timestamp comes from a SCM_TIMESTAMPNS
+    control message (if SO_TIMESTAMPNS is enabled on the socket).
+    """
+
+    CONTROL_SIZE = 64
+
+    def __init__(self, count=RECV_BATCH, snaplen=MTU):
+        self.count = count
+
+        self.bufs = [ctypes.create_string_buffer(snaplen) \
+                     for idx in xrange(count)]
+        self.names = [ctypes.create_string_buffer(SOCKADDR_LL_FMT.size) \
+                      for idx in xrange(count)]
+        self.controls = [ctypes.create_string_buffer(self.CONTROL_SIZE) \
+                         for idx in xrange(count)]
+        self.iovs = (iovec * count)()
+        self.msgs = (mmsghdr * count)()
+
+        for idx in xrange(count):
+            self.iovs[idx].iov_base = ctypes.cast(self.bufs[idx],
+                                                  ctypes.c_void_p)
+            self.iovs[idx].iov_len = snaplen
+
+            hdr = self.msgs[idx].msg_hdr
+            hdr.msg_iov = ctypes.pointer(self.iovs[idx])
+            hdr.msg_iovlen = 1
+            hdr.msg_name = ctypes.cast(self.names[idx], ctypes.c_void_p)
+            hdr.msg_control = ctypes.cast(self.controls[idx],
+                                          ctypes.c_void_p)
+
+    @staticmethod
+    def enable_timestamps(sock):
+        """
+        Ask the kernel for the timestamp of every frame.
+        @return False if SO_TIMESTAMPNS is not supported
+        """
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+            return True
+        except socket.error:
+            return False
+
+    def recv(self, fd):
+        """
+        @return a list of (raw frame, timestamp, hatype, protocol) tuples
+                (empty if nothing is ready). The timestamp is the time of
+                the call if the kernel didn't send one
+        """
+
+        # The kernel overwrites the lengths with the ones actually used
+        for idx in xrange(self.count):
+            hdr = self.msgs[idx].msg_hdr
+            hdr.msg_namelen = SOCKADDR_LL_FMT.size
+            hdr.msg_controllen = self.CONTROL_SIZE
+
+        ret = _recvmmsg(fd, self.msgs, self.count, MSG_DONTWAIT, None)
+
+        if ret <= 0:
+            return []
+
+        now = time.time()
+        frames = []
+
+        for idx in xrange(ret):
+            msg = self.msgs[idx]
+            hatype, proto = None, None
+
+            if msg.msg_hdr.msg_namelen >= 12:
+                family, proto, ifindex, hatype = \
+                      SOCKADDR_LL_FMT.unpack(self.names[idx].raw)[:4]
+                proto = socket.ntohs(proto)
+
+            ts = self.__get_timestamp(self.controls[idx].raw,
+                                      msg.msg_hdr.msg_controllen) or now
+
+            frames.append((self.bufs[idx].raw[:msg.msg_len], ts,
+                           hatype, proto))
+
+        return frames
+
+    def __get_timestamp(self, control, length):
+        align = ctypes.sizeof(ctypes.c_long)
+        hdrlen = (CMSG_HDR_FMT.size + align - 1) & ~(align - 1)
+        offset = 0
+
+        while offset + hdrlen <= length:
+            cmsg_len, level, type = CMSG_HDR_FMT.unpack_from(control, offset)
+
+            if cmsg_len < hdrlen:
+                break
+
+            if level == socket.SOL_SOCKET and type == SCM_TIMESTAMPNS and \
+               cmsg_len >= hdrlen + TIMESPEC_FMT.size:
+                sec, nsec = TIMESPEC_FMT.unpack_from(control, offset + hdrlen)
+                return sec + 0.000000001 * nsec
+
+            offset += (cmsg_len + align - 1) & ~(align - 1)
+
+        return None
+
+def get_ll_class(hatype, proto, default=Ether):
+    """
+    @return the scapy class of a frame read from an AF_PACKET socket. Like
+            the scapy L2ListenSocket it's chosen from the sll_hatype and the
+            sll_protocol of its sockaddr_ll
+    """
+
+    if hatype in conf.l2types:
+        return conf.l2types[hatype]
+
+    if proto in conf.l3types:
+        return conf.l3types[proto]
+
+    return default
+
+def dissect(cls, raw, ts):
+    "@return a packet of class cls dissected from raw with ts as time"
+    try:
+        pkt = cls(raw)
+    except:
+        pkt = Raw(raw)
+
+    pkt.time = ts
+    return pkt
+
+def has_raw_recv(sock):
+    """
+    @return True if recv_batch could return the raw frames of sock without
+            dissecting them
+    """
+
+    if isinstance(sock, L2MmapListenSocket):
+        return True
+
+    ins = getattr(sock, 'ins', None)
+
+    return bool(_recvmmsg and getattr(socket, 'AF_PACKET', None) and \
+                isinstance(ins, socket.socket) and \
+                ins.family == socket.AF_PACKET)
+
+def recv_batch(sock, count=RECV_BATCH, prefilter=None, raw=False):
+    """
+    Drain up to count frames from a listen socket. It should be called
+    when the socket is readable (or has pending frames).
+
+    PACKET_MMAP sockets are drained block by block, AF_PACKET sockets with
+    recvmmsg() when available. Otherwise a non-blocking drain loop with
+    recv() is used. Both the ring and recvmmsg() give the kernel timestamp
+    of every frame.
+
+    @param sock a listen socket
+    @param count max number of frames to return
+    @param prefilter a RawPrefilter applied on the raw frames before the
+                     dissection (only the standard listen sockets already
+                     return dissected packets)
+    @param raw True to skip the dissection
+    @return a list of dissected packets or (raw bytes, timestamp) tuples if
+            raw is True
+    """
+
+    ret = []
+
+    if isinstance(sock, L2MmapListenSocket):
+        cls = sock.LL
+
+        while len(ret) < count:
+            r = sock.recv_raw()
+
+            if r is None:
+                break
+
+            if prefilter and not prefilter(r[0]):
+                continue
+
+            if raw:
+                ret.append(r)
+            else:
+                ret.append(dissect(cls, r[0], r[1]))
+
+        return ret
+
+    if has_raw_recv(sock):
+        ins = sock.ins
+        receiver = getattr(sock, '_pm_receiver', None)
+
+        if not receiver or receiver.count != count:
+            if not receiver:
+                MmsgReceiver.enable_timestamps(ins)
+
+            receiver = MmsgReceiver(count)
+            sock._pm_receiver = receiver
+
+        default = getattr(sock, 'LL', None) or Ether
+
+        for frame, ts, hatype, proto in receiver.recv(ins.fileno()):
+            if prefilter and not prefilter(frame):
+                continue
+
+            if raw:
+                ret.append((frame, ts))
+            else:
+                ret.append(dissect(get_ll_class(hatype, proto, default),
+                                   frame, ts))
+
+        return ret
+
+    r = sock.recv(MTU)
+
+    while r is not None:
+        if not prefilter or prefilter(str(r)):
+            if raw:
+                ret.append((str(r), r.time))
+            else:
+                ret.append(r)
+
+        if len(ret) >= count:
+            break
+
+        inp, out, err = select.select([sock], [], [], 0)
+
+        if not inp:
+            break
+
+        r = sock.recv(MTU)
+
+    return ret
+
+###############################################################################
+# Multiple interfaces
+###############################################################################
+
+class StreamMerger(object):
+    """
+    Incremental k-way merge of n streams of packets on their timestamps.
+    The packets of every stream must be already ordered.
+
+    A packet is released when all the streams have a pending packet (so
+    nothing older could arrive), when it is older than delay seconds (an
+    idle stream should not block the others) or when more than maxpending
+    packets are waiting. In this way the memory used is bounded.
+
+    >>> merger = StreamMerger(2, delay=1, key=lambda x: x[0])
+    >>> merger.push(0, [(1.0, 'a'), (3.0, 'c')])
+    >>> merger.pop(now=1.5)
+    []
+    >>> merger.push(1, [(2.0, 'b')])
+    >>> merger.pop(now=1.5)
+    [(1.0, 'a'), (2.0, 'b')]
+    >>> merger.pop(now=4.5)
+    [(3.0, 'c')]
+    >>> merger.push(1, [(5.0, 'e')])
+    >>> merger.push(0, [(4.0, 'd')])
+    >>> merger.flush()
+    [(4.0, 'd'), (5.0, 'e')]
+    """
+
+    def __init__(self, streams, delay=0.5, maxpending=4096, key=None):
+        """
+        @param streams the number of streams
+        @param delay max seconds a packet waits for the other streams
+        @param maxpending max number of packets waiting to be merged
+        @param key a function returning the timestamp of a packet (None to
+                   use the time attribute)
+        """
+
+        self.queues = [deque() for idx in xrange(streams)]
+        self.delay = delay
+        self.maxpending = maxpending
+        self.key = key or (lambda pkt: pkt.time)
+
+        # A (timestamp, stream) entry for the head of every stream
+        self.heads = []
+        self.pending = 0
+
+    def push(self, idx, packets):
+        """
+        Add the packets captured on the stream idx
+        @param idx the stream index
+        @param packets a list of packets
+        """
+
+        queue = self.queues[idx]
+
+        if packets and not queue:
+            heapq.heappush(self.heads, (self.key(packets[0]), idx))
+
+        queue.extend(packets)
+        self.pending += len(packets)
+
+    def pop(self, now=None):
+        """
+        @param now the current time or None to use time.time()
+        @return a list of merged packets ready to be processed
+        """
+
+        if now is None:
+            now = time.time()
+
+        ret = []
+        limit = now - self.delay
+
+        while self.heads:
+            ts, idx = self.heads[0]
+
+            if len(self.heads) < len(self.queues) and ts > limit and \
+               self.pending <= self.maxpending:
+                break
+
+            heapq.heappop(self.heads)
+
+            queue = self.queues[idx]
+            ret.append(queue.popleft())
+            self.pending -= 1
+
+            if queue:
+                heapq.heappush(self.heads, (self.key(queue[0]), idx))
+
+        return ret
+
+    def flush(self):
+        "@return all the pending packets merged"
+        return self.pop(float('inf'))
+
+###############################################################################
+# Raw prefilter
+###############################################################################
+
+PREFILTER_FMTS = {1 : '!B', 2 : '!H', 4 : '!I'}
+
+class RawPrefilter(object):
+    """
+    A cheap filter working on the raw bytes of a frame before any scapy
+    object is created.
+
+    The predicates are expressed as a comma separated list of
+    offset:size[&mask]=value items (size is 1, 2 or 4 bytes, numbers could
+    be in hex with the 0x prefix). All the items must match. Alternatives
+    could be joined with |. For example to select the TCP packets to or
+    from port 80 on ethernet:
+
+    >>> f = RawPrefilter(predicates='12:2=0x0800,23:1=6,34:2=80|36:2=80')
+    >>> ip = '\\x08\\x00' + '\\x00' * 9 + '\\x06'
+    >>> f('\\x00' * 12 + ip + '\\x00' * 12 + '\\x00\\x50')
+    True
+    >>> f('\\x00' * 12 + '\\x86\\xdd' + '\\x00' * 40)
+    False
+    >>> f.dropped
+    1
+    >>> f = RawPrefilter(minsize=60, maxsize=100)
+    >>> f('\\x00' * 59), f('\\x00' * 60), f('\\x00' * 101)
+    (False, True, False)
+    """
+
+    def __init__(self, minsize=0, maxsize=0, predicates=None):
+        """
+        @param minsize drop frames shorter than minsize bytes (0 to disable)
+        @param maxsize drop frames longer than maxsize bytes (0 to disable)
+        @param predicates a predicates string (see class documentation)
+        @raise ValueError if predicates is not well formed
+        """
+
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.predicates = predicates
+        self.groups = []
+        self.dropped = 0
+
+        if predicates:
+            for group in predicates.split(','):
+                self.groups.append([self.__compile(item) \
+                                    for item in group.split('|')])
+
+    def __compile(self, item):
+        try:
+            where, value = item.strip().split('=', 1)
+            offset, size = where.split(':', 1)
+
+            if '&' in size:
+                size, mask = size.split('&', 1)
+                mask = int(mask, 0)
+            else:
+                mask = None
+
+            offset, size, value = int(offset, 0), int(size, 0), int(value, 0)
+
+            return (offset, offset + size, PREFILTER_FMTS[size], mask, value)
+        except (ValueError, KeyError):
+            raise ValueError('Invalid prefilter predicate %s' % repr(item))
+
+    def __nonzero__(self):
+        return bool(self.minsize or self.maxsize or self.groups)
+
+    def __call__(self, raw):
+        """
+        @param raw the frame bytes
+        @return True if the frame should be kept
+        """
+
+        size = len(raw)
+
+        if self.minsize and size < self.minsize or \
+           self.maxsize and size > self.maxsize:
+            self.dropped += 1
+            return False
+
+        for group in self.groups:
+            for offset, end, fmt, mask, value in group:
+                if end > size:
+                    continue
+
+                field = struct.unpack_from(fmt, raw, offset)[0]
+
+                if mask is not None:
+                    field &= mask
+
+                if field == value:
+                    break
+            else:
+                self.dropped += 1
+                return False
+
+        return True
+
+def join_fanout(sock, group, mode=PACKET_FANOUT_HASH):
+    """
+    Add a listen socket to a PACKET_FANOUT group.
+
+    @param sock a listen socket (with ins attribute) or a socket object
+    @param group the group id (16 bits)
+    @param mode the distribution mode (PACKET_FANOUT_HASH for flow hash)
+    """
+    sock = getattr(sock, 'ins', sock)
+    sock.setsockopt(SOL_PACKET, PACKET_FANOUT,
+                    (group & 0xffff) | (mode << 16))
+
+def get_kernel_stats(sock):
+    """
+    Read the kernel counters of a listen socket with PACKET_STATISTICS.
+    Note that the kernel resets the counters on every read so the caller
+    has to accumulate them.
+
+    @param sock a listen socket (with ins attribute) or a socket object
+    @return a tuple (received, dropped) or None if not supported
+    """
+
+    sock = getattr(sock, 'ins', sock)
+
+    if not getattr(socket, 'AF_PACKET', None) or \
+       not isinstance(sock, socket.socket) or \
+       sock.family != socket.AF_PACKET:
+        return None
+
+    try:
+        # tpacket_stats_v3 has a further tp_freeze_q_cnt field
+        raw = sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 12)
+        return struct.unpack("II", raw[:8])
+    except (socket.error, struct.error):
+        return None
+
+###############################################################################
+# Fanout workers
+###############################################################################
+
+# MetaPacket attributes filled by the decoders sent back to the parent
+FANOUT_STATE = ('l2_proto', 'l2_src', 'l2_dst', 'l2_len', 'l3_src',
+                'l3_dst', 'l3_proto', 'l3_len', 'l4_src', 'l4_dst', 'l4_ack',
+                'l4_seq', 'l4_flags', 'l4_proto', 'l4_len', 'payload_len',
+                'data', 'data_len')
+
+FANOUT_CFIELD_TYPES = (basestring, int, long, float, bool, tuple)
+
+# Used to give a different fanout group to every FanoutCapture
+_fanout_ids = itertools.count()
+
+def get_fanout_state(mpkt):
+    """
+    @return a picklable tuple (flags, state, cfields) describing mpkt. state
+            is None if mpkt has not been audited.
+    """
+    cfields = {}
+    values = None
+
+    for key, value in mpkt.cfields.items():
+        if isinstance(value, FANOUT_CFIELD_TYPES):
+            cfields[key] = value
+
+    if mpkt.has_audit_state():
+        values = [getattr(mpkt, attr) for attr in FANOUT_STATE]
+
+    return mpkt.flags, values, cfields
+
+def set_fanout_state(mpkt, state):
+    "Restore in mpkt a state created with get_fanout_state"
+    mpkt.flags, values, cfields = state
+
+    if values is not None:
+        for attr, value in zip(FANOUT_STATE, values):
+            setattr(mpkt, attr, value)
+
+    if cfields:
+        mpkt.cfields.update(cfields)
+
+class FanoutCapture(object):
+    """
+    Capture on an interface with n worker processes joined in the same
+    PACKET_FANOUT group using flow hash distribution. In this way every
+    worker sees all the packets of a flow and the session state (TCP
+    reassembly, SessionManager) could be kept local to the worker.
+
+    Results are returned by read() as a list of messages:
+     - ('pkt', raw, timestamp, linktype, state) for every packet
+     - ('msg', msg, severity, facility) for every AuditManager.user_msg
+       and when a worker exits
+     - ('stats', received, dropped, filtered, errors) with the counters
+       (kernel, prefilter and packets making a decoder fail) accumulated by
+       a worker since the previous stats message
+    """
+
+    def __init__(self, iface, filter=None, workers=2, use_mmap=False, \
+                 audits=True, prefilter=None):
+        """
+        @param iface the interface to capture on
+        @param filter a BPF filter string
+        @param workers the number of worker processes
+        @param use_mmap True to use PACKET_MMAP ring in the workers
+        @param audits True to run the passive audits in the workers
+        @param prefilter a RawPrefilter to apply in the workers or None
+        """
+
+        if not getattr(socket, 'AF_PACKET', None):
+            raise socket.error(-1, 'PACKET_FANOUT is not supported here')
+
+        self.iface = iface
+        self.filter = filter
+        self.workers = workers
+        self.use_mmap = use_mmap
+        self.audits = audits
+        self.prefilter = prefilter
+
+        self.group = (os.getpid() + _fanout_ids.next()) & 0xffff
+
+        # A list of (pid, file object) tuples
+        self.procs = []
+
+    def start(self):
+        """
+        Open the sockets, join the fanout group and fork the worker
+        processes. Errors are raised here, before any fork.
+        """
+
+        socks = []
+
+        try:
+            for idx in xrange(self.workers):
+                if self.use_mmap:
+                    sock = mmap_listen(self.iface, self.filter)
+                else:
+                    sock = conf.L2listen(type=ETH_P_ALL, iface=self.iface,
+                                         filter=self.filter)
+
+                socks.append(sock)
+                join_fanout(sock, self.group)
+        except:
+            for sock in socks:
+                sock.close()
+
+            raise
+
+        for idx, sock in enumerate(socks):
+            rd, wr = os.pipe()
+            pid = os.fork()
+
+            if pid == 0:
+                os.close(rd)
+
+                for opid, fobj in self.procs:
+                    fobj.close()
+
+                for other in socks:
+                    if other is not sock:
+                        other.close()
+
+                try:
+                    self.__worker(sock, os.fdopen(wr, 'wb'))
+                except:
+                    log.error('Fanout worker %d crashed' % os.getpid())
+                    log.error(generate_traceback())
+                    os._exit(1)
+
+                os._exit(0)
+
+            os.close(wr)
+
+            # Unbuffered or select() would miss the data already read ahead
+            self.procs.append((pid, os.fdopen(rd, 'rb', 0)))
+
+            log.debug('Fanout worker %d spawned with pid %d' % (idx, pid))
+
+        # Now owned by the workers
+        for sock in socks:
+            sock.close()
+
+    def stop(self):
+        "Kill the worker processes"
+
+        for pid, fobj in self.procs:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+
+            fobj.close()
+
+        self.procs = []
+
+    def read(self, timeout=0.5):
+        """
+        @param timeout max seconds to wait for results
+        @return a list of messages (see class documentation)
+        """
+
+        fds = [fobj for pid, fobj in self.procs if not fobj.closed]
+
+        if not fds:
+            return None
+
+        ret = []
+        inp, out, err = select.select(fds, [], [], timeout)
+
+        for fobj in inp:
+            try:
+                ret.extend(cPickle.load(fobj))
+            except (EOFError, cPickle.UnpicklingError):
+                fobj.close()
+                ret.append(self.__reap(fobj))
+
+        return ret
+
+    def __reap(self, fobj):
+        """
+        Wait for the worker writing to fobj. It's removed from procs so it
+        is not killed again by stop().
+
+        @return a 'msg' message reporting the exit of the worker
+        """
+
+        for idx, (pid, pfobj) in enumerate(self.procs):
+            if pfobj is fobj:
+                del self.procs[idx]
+                break
+        else:
+            return ('msg', 'A capture worker exited', 3, 'capture')
+
+        try:
+            status = os.waitpid(pid, 0)[1]
+        except OSError:
+            status = 0
+
+        if os.WIFSIGNALED(status):
+            msg = 'Capture worker %d killed by signal %d' % \
+                  (pid, os.WTERMSIG(status))
+        else:
+            msg = 'Capture worker %d exited with status %d' % \
+                  (pid, os.WEXITSTATUS(status))
+
+        log.error(msg)
+        return ('msg', msg, 3, 'capture')
+
+    def __worker(self, sock, out):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        LLcls = getattr(sock, 'LL', None) or Ether
+        linktype = conf.l2types.layer2num.get(LLcls, 1)
+        pending = []
+        dispatcher = None
+
+        if self.audits:
+            from umit.pm.manager.auditmanager import AuditManager, \
+                                                    AuditDispatcher
+
+            def user_msg(msg, severity=5, facility=None):
+                pending.append(('msg', msg, severity, facility))
+
+            # The GUI lives in the parent process
+            AuditManager().user_msg = user_msg
+            dispatcher = AuditDispatcher(linktype)
+
+        last = lastst = time.time()
+        filtered = errors = 0
+
+        while True:
+            batch = []
+
+            if getattr(sock, 'pending', None):
+                batch = recv_batch(sock, prefilter=self.prefilter, raw=True)
+            else:
+                inp, o, e = select.select([sock], [], [], 0.1)
+
+                if inp:
+                    batch = recv_batch(sock, prefilter=self.prefilter,
+                                       raw=True)
+
+            for raw, ts in batch:
+                # Dissected only if the audits need it
+                mpkt = MetaPacket.new_from_raw(raw, ts, LLcls)
+
+                if dispatcher:
+                    try:
+                        dispatcher.feed(mpkt)
+                    except Exception:
+                        errors += 1
+                        log.error(generate_traceback())
+
+                pending.append(('pkt', raw, ts, linktype,
+                                get_fanout_state(mpkt)))
+
+            if time.time() - lastst >= 1.0:
+                kstats = get_kernel_stats(sock) or (0, 0)
+                dropped = self.prefilter and self.prefilter.dropped or 0
+
+                pending.append(('stats', kstats[0], kstats[1],
+                                dropped - filtered, errors))
+
+                filtered = dropped
+                errors = 0
+                lastst = time.time()
+
+            if pending and (len(pending) >= 64 or time.time() - last >= 0.1):
+                cPickle.dump(pending, out, cPickle.HIGHEST_PROTOCOL)
+                out.flush()
+
+                del pending[:]
+                last = time.time()
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -28,9 +28,10 @@ from threading import Thread
 from umit.pm.core.i18n import _
 from umit.pm.core.netconst import *
 from umit.pm.core.logger import log
-from umit.pm.core.atoms import ThreadPool, defaultdict
+from umit.pm.core.atoms import ThreadPool, RateMeter, defaultdict
 from umit.pm.manager.auditmanager import AuditDispatcher, AuditManager, \
                                          IL_TYPE_ETH
+from umit.pm.manager.preferencemanager import Prefs
 from umit.pm.backend.scapy import *
 
 import select
@@ -143,6 +144,12 @@ def register_audit_context(BaseAuditContext):
 
             self.thread_pool = ThreadPool()
             self.audit_dispatcher = None
+            self.fastdecode = Prefs()['backend.system.audit.fastdecode'].value
+
+            # Statistics
+            self.rate = RateMeter()
+            self.kernel_stats = None
+            self.dispatch_drops = 0
 
             self.ans_dict = defaultdict(list)
             self.receivers = [] # A list of callable
@@ -185,15 +192,19 @@ def register_audit_context(BaseAuditContext):
                     self.set_forwardable = self.__set_forwardable_single
                     self.forward = self.__forward_single
 
-                if capmethod == 0:
+                if capmethod == 0 or capmethod == 3:
                     log.debug('Creating listen sockets')
 
-                    self._listen_dev1 = conf.L2listen(iface=dev1,
-                                                      filter=bpf_filter)
+                    if capmethod == 3:
+                        listen = mmap_listen
+                    else:
+                        listen = conf.L2listen
+
+                    self._listen_dev1 = listen(iface=dev1, filter=bpf_filter)
 
                     if dev2:
-                        self._listen_dev2 = conf.L2listen(iface=dev2,
-                                                          filter=bpf_filter)
+                        self._listen_dev2 = listen(iface=dev2,
+                                                   filter=bpf_filter)
 
                     # Get datalink
                     try:
@@ -233,7 +244,8 @@ def register_audit_context(BaseAuditContext):
                         self._listen_dev2 = run_helper(self.capmethod - 1, dev2,
                                                        bpf_filter)
 
-                self.audit_dispatcher = AuditDispatcher(self.linktype, self)
+                self.audit_dispatcher = AuditDispatcher(self.linktype, self,
+                                                        self.fastdecode)
 
             except socket.error, (errno, err):
                 self.summary = self.title + ' (' + str(err) +')'
@@ -244,6 +256,29 @@ def register_audit_context(BaseAuditContext):
                 self.summary = self.title + ' (' + str(err) +')'
                 log.error(generate_traceback())
 
+        def get_statistics(self):
+            for sock in (self._listen_dev1, self._listen_dev2):
+                # Helper methods store a (process, outfile) tuple here
+                ret = sock and get_kernel_stats(sock) or None
+
+                if ret is None:
+                    continue
+
+                if self.kernel_stats is None:
+                    self.kernel_stats = [0, 0]
+
+                self.kernel_stats[0] += ret[0]
+                self.kernel_stats[1] += ret[1]
+
+            stats = {'dispatch_drops' : self.dispatch_drops}
+            stats['pps'], stats['bps'] = self.rate.get_rates()
+
+            if self.kernel_stats:
+                stats['kernel_received'], stats['kernel_dropped'] = \
+                                        self.kernel_stats
+
+            return stats
+
         def get_datalink(self):
             return self.linktype
 
@@ -408,7 +443,7 @@ def register_audit_context(BaseAuditContext):
 
             log.debug('Spawning capture threads')
 
-            func = (self.capmethod == 0 and \
+            func = ((self.capmethod == 0 or self.capmethod == 3) and \
                     self.__sniff_thread or \
                     self.__helper_thread)
 
@@ -447,7 +482,8 @@ def register_audit_context(BaseAuditContext):
                 self.internal = False
                 log.error(generate_traceback())
 
-            self.audit_dispatcher = AuditDispatcher(reader.linktype, self)
+            self.audit_dispatcher = AuditDispatcher(reader.linktype, self,
+                                                    self.fastdecode)
 
             log.debug('Entering in the helper mainloop')
 
@@ -455,7 +491,22 @@ def register_audit_context(BaseAuditContext):
             mflags = (obj is self._listen_dev1) and \
                    MPKT_FROMIFACE and MPKT_FROMBRIDGE
 
-            while self.internal:
+            # The helper is streaming the packets over its stdout
+            streaming = (obj[1] is None)
+
+            while self.internal and streaming:
+                # Use a timeout to periodically check the internal flag
+                r = reader.read_packet(1.0)
+
+                if not r:
+                    if reader.eof:
+                        break
+
+                    continue
+
+                self.__manage_mpkt(obj, MetaPacket(r, flags=mflags))
+
+            while self.internal and not streaming:
                 report_idx = get_n_packets(obj[0])
 
                 if report_idx < reported_packets:
@@ -494,17 +545,24 @@ def register_audit_context(BaseAuditContext):
                             r = obj.recv(MTU)
                         except PcapTimeoutElapsed:
                             continue
+
+                        if r is not None:
+                            r = [r]
+                    elif getattr(obj, 'pending', None):
+                        # Frames of an already read PACKET_MMAP block
+                        r = recv_batch(obj)
                     else:
                         inmask = [obj]
                         inp, out, err = select.select(inmask, inmask, inmask, None)
 
                         if obj in inp:
-                            r = obj.recv(MTU)
+                            r = recv_batch(obj)
 
-                    if r is None:
+                    if not r:
                         continue
 
-                    self.__manage_mpkt(obj, MetaPacket(r, flags=mflags))
+                    for pkt in r:
+                        self.__manage_mpkt(obj, MetaPacket(pkt, flags=mflags))
 
                 except Exception, err:
                     if self.internal:
@@ -523,6 +581,8 @@ def register_audit_context(BaseAuditContext):
             found = False
             layer = 2
 
+            self.rate.update(1, mpkt.get_size())
+
             while not found and layer <= 3:
                 if layer == 2:
                     cpkt = mpkt.root
@@ -574,6 +634,7 @@ def register_audit_context(BaseAuditContext):
                 try:
                     self.audit_dispatcher.feed(mpkt)
                 except Exception, exc:
+                    self.dispatch_drops += 1
                     log.error(_('Error while feeding audit dispatcher'))
                     log.error(generate_traceback())
 
@@ -18,6 +18,8 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
 
+import Queue
+
 from datetime import datetime
 from threading import Thread, Lock
 
@@ -25,9 +27,10 @@ import gobject
 
 from umit.pm.core.i18n import _
 from umit.pm.core.logger import log
-from umit.pm.core.atoms import with_decorator
+from umit.pm.core.atoms import with_decorator, generate_traceback, RateMeter
 from umit.pm.manager.preferencemanager import Prefs
-from umit.pm.manager.auditmanager import AuditDispatcher
+from umit.pm.manager.auditmanager import AuditManager, new_audit_dispatcher
+from umit.pm.manager.sessionmanager import ConnectionManager
 
 from umit.pm.backend.scapy import *
 
@@ -48,16 +51,56 @@ def register_sniff_context(BaseSniffContext):
             self.lock = Lock()
             self.prevtime = None
             self.socket = None
+            self.sockets = []
             self.internal = True
             self.process = None
 
             self.title = _('%s capture') % self.iface
             self.summary = _('Sniffing on %s') % self.iface
             self.thread = None
-            self.priv = []
+
+            # Raw packets are decoded in a separate thread
+            self.decode_queue = None
+            self.decode_thread = None
+            self.decode_drops = 0
+
+            # Packets decoded but not yet passed to the callback (see notify)
+            self.notify_queue = []
+            self.notify_lock = Lock()
 
             self.audit_dispatcher = None
 
+            self.fanout = None
+            self.fanout_conns = None
+            self.prefilter = None
+
+            # Used in record only mode
+            self.recorder = None
+
+            # Lazy dissection (see MetaPacket.new_from_raw). raw_recv is True
+            # if the capture thread reads raw frames from the sockets.
+            self.lazy = Prefs()['backend.system.sniff.lazy'].value
+            self.raw_recv = False
+            self.link_types = []
+
+            # Compute the packet list strings before showing the packets
+            self.precompute = Prefs()['backend.system.sniff.precompute'].value
+
+            # Use the struct based header decoder for the audits
+            self.fastdecode = Prefs()['backend.system.audit.fastdecode'].value
+
+            # Processes running the audits (see ShardedAuditDispatcher)
+            self.audit_workers = Prefs()['backend.system.audit.workers'].value
+
+            # Columnar metadata of self.data (not used in ring buffer mode)
+            self.table = None
+
+            # Statistics
+            self.rate = RateMeter()
+            self.kernel_stats = None
+            self.fanout_filtered = 0
+            self.dispatch_drops = 0
+
         @with_decorator
         def get_all_data(self):
             return BaseSniffContext.get_all_data(self)
@@ -82,16 +125,143 @@ def register_sniff_context(BaseSniffContext):
                 else:
                     return None
 
+        def get_statistics(self):
+            self.poll_kernel_stats()
+
+            stats = {
+                'pps' : 0,
+                'bps' : 0,
+                'decode_drops' : self.decode_drops,
+                'dispatch_drops' : self.dispatch_drops,
+                'display_queue' : max(0, len(self.data) - self._last),
+                'decode_queue' : 0,
+                'filtered' : 0,
+            }
+
+            stats['pps'], stats['bps'] = self.rate.get_rates()
+
+            if self.kernel_stats:
+                stats['kernel_received'], stats['kernel_dropped'] = \
+                                        self.kernel_stats
+
+            if self.decode_queue:
+                # Every item of the queue is a batch of packets
+                stats['decode_queue'] = self.decode_queue.qsize()
+
+            if self.prefilter:
+                stats['filtered'] = self.prefilter.dropped
+
+            if self.fanout:
+                stats['filtered'] += self.fanout_filtered
+
+            return stats
+
+        def poll_kernel_stats(self):
+            """
+            Accumulate the kernel counters of the listen socket. The kernel
+            resets them on every read.
+            """
+
+            for sock in self.sockets:
+                ret = get_kernel_stats(sock)
+
+                if ret is None:
+                    continue
+
+                if self.kernel_stats is None:
+                    self.kernel_stats = [0, 0]
+
+                self.kernel_stats[0] += ret[0]
+                self.kernel_stats[1] += ret[1]
+
+        def get_connection_manager(self):
+            "@return the ConnectionManager tracking the sniffed connections"
+            if self.fanout_conns is not None:
+                return self.fanout_conns
+            if self.audit_dispatcher:
+                return self.audit_dispatcher.get_connection_manager()
+
         def _start(self):
             self.prevtime = datetime.now()
+            self.fanout = None
+            self.fanout_conns = None
+
+            self.rate.reset()
+            self.kernel_stats = None
+            self.fanout_filtered = 0
+            self.dispatch_drops = 0
+
+            if len(self.ifaces) > 1 and \
+               (WINDOWS or (self.capmethod != 0 and self.capmethod != 4)):
+                self.summary = _('Capturing on multiple interfaces requires '
+                                 'a native capture method')
+                return False
+
+            if self.record and \
+               (not self.cap_file or \
+                (self.capmethod != 0 and self.capmethod != 4)):
+                self.summary = _('Record only mode requires a capture file '
+                                 'and a native capture method')
+                return False
+
+            # Length bounds and raw predicates are checked before decoding
+            try:
+                self.prefilter = RawPrefilter(self.min_packet_size,
+                                              self.max_packet_size,
+                                              self.raw_filter) or None
+            except ValueError, err:
+                self.summary = str(err)
+                return False
 
-            if self.iface and self.capmethod == 0:
+            if len(self.ifaces) == 1 and self.workers > 1 and \
+               not self.record and \
+               (self.capmethod == 0 or self.capmethod == 4):
                 try:
-                    self.socket = conf.L2listen(type=ETH_P_ALL,
-                                                iface=self.iface,
-                                                filter=self.filter)
+                    self.fanout = FanoutCapture(self.iface, self.filter,
+                                                self.workers,
+                                                self.capmethod == 4,
+                                                self.audits,
+                                                self.prefilter)
+                    self.fanout.start()
+
+                    log.debug('Capturing with %d fanout workers' % \
+                              self.workers)
 
                     if self.audits:
+                        self.fanout_conns = ConnectionManager()
+
+                except Exception, err:
+                    log.warning('Unable to use fanout workers (%s). Falling '
+                                'back to a single capture thread' % str(err))
+
+                    if self.fanout:
+                        self.fanout.stop()
+
+                    self.fanout = None
+
+            if self.iface and not self.fanout and \
+               (self.capmethod == 0 or self.capmethod == 4):
+                try:
+                    self.sockets = []
+
+                    for iface in self.ifaces:
+                        if self.capmethod == 4:
+                            sock = mmap_listen(iface, self.filter)
+                        else:
+                            sock = conf.L2listen(type=ETH_P_ALL, iface=iface,
+                                                 filter=self.filter)
+
+                        self.sockets.append(sock)
+
+                    self.socket = self.sockets[0]
+                    self.link_types = [getattr(s, 'LL', None) or Ether \
+                                       for s in self.sockets]
+
+                    self.raw_recv = self.record or \
+                        (self.lazy and \
+                         not [s for s in self.sockets if not has_raw_recv(s)])
+
+                    if self.audits or self.record:
                         try:
                             if self.socket.LL in conf.l2types.layer2num:
                                 linktype = \
@@ -110,26 +280,78 @@ def register_sniff_context(BaseSniffContext):
                                           ' socket. Using IL_TYPE_ETH as DL')
                                 linktype = IL_TYPE_ETH
 
-                        self.audit_dispatcher = AuditDispatcher(linktype)
+                    if self.record:
+                        # No dissection at all so no audits here
+                        self.recorder = PcapRecorder(self.cap_file, linktype)
+
+                        log.debug('Recording raw frames to %s' % \
+                                  self.cap_file)
+                    elif self.audits:
+                        self.audit_dispatcher = new_audit_dispatcher(
+                            linktype, self.fastdecode, self.audit_workers)
+                        self.audit_dispatcher.start()
 
                 except socket.error, (errno, err):
                     self.summary = str(err)
+                    self.close_sockets()
                     return False
                 except Exception, err:
                     self.summary = str(err)
+                    self.close_sockets()
                     return False
 
             self.state = self.RUNNING
             self.internal = True
-            self.data = []
 
-            if self.capmethod == 0:
+            if isinstance(self.data, PacketRing):
+                self.data.close()
+
+            if self.ring_count or self.ring_size:
+                log.debug('Using ring buffer mode (%d packets, %d bytes)' % \
+                          (self.ring_count, self.ring_size))
+
+                self.data = PacketRing(self.ring_count, self.ring_size,
+                                       self.spill_size, self.spill_time,
+                                       self.spill_files)
+                self.table = None
+            else:
+                self.data = []
+                self.table = PacketTable()
+
+            self.decode_drops = 0
+
+            if self.recorder:
+                # Frames are written directly by the capture thread
+                pass
+
+            elif self.fanout or self.capmethod == 0 or self.capmethod == 4:
+                self.decode_queue = Queue.Queue(
+                    Prefs()['backend.system.sniff.decodequeue'].value)
+
+                self.decode_thread = Thread(target=self.run_decode)
+                self.decode_thread.setDaemon(True)
+                self.decode_thread.start()
+
+            if self.fanout:
+                self.thread = Thread(target=self.run_fanout)
+
+            elif len(self.sockets) > 1:
+                self.thread = Thread(target=self.run_multi)
+
+            elif self.capmethod == 0 or self.capmethod == 4:
                 self.thread = Thread(target=self.run)
 
             elif self.capmethod == 1 or \
                  self.capmethod == 2 or \
                  self.capmethod == 3:
 
+                # The audit workers must be forked before any thread. The
+                # datalink is set by run_helper once the file is opened.
+                if self.audits:
+                    self.audit_dispatcher = new_audit_dispatcher(
+                        IL_TYPE_ETH, self.fastdecode, self.audit_workers)
+                    self.audit_dispatcher.start()
+
                 self.thread = Thread(target=self.run_helper)
 
             self.thread.setDaemon(True)
@@ -141,8 +363,8 @@ def register_sniff_context(BaseSniffContext):
             if self.internal:
                 self.internal = False
 
-                if self.socket:
-                    self.socket.close()
+                if self.sockets:
+                    self.close_sockets(False)
 
                 # We have to kill the process directly from here because the
                 # select function is blocking to avoid CPU burning.
@@ -155,6 +377,26 @@ def register_sniff_context(BaseSniffContext):
             else:
                 return False
 
+        def close_sockets(self, forget=True):
+            """
+            Close the listen sockets
+            @param forget False to keep the sockets list (the capture thread
+                          has to notice the closed sockets)
+            """
+
+            # Last chance to read the kernel counters
+            self.poll_kernel_stats()
+
+            for sock in self.sockets:
+                try:
+                    sock.close()
+                except Exception:
+                    pass
+
+            if forget:
+                self.sockets = []
+                self.socket = None
+
         def _restart(self):
             if self.thread and self.thread.isAlive():
                 return False
@@ -174,6 +416,7 @@ def register_sniff_context(BaseSniffContext):
             """
 
             errstr = reader = None
+            streaming = False
 
             try:
                 if self.capmethod == 1:
@@ -188,6 +431,10 @@ def register_sniff_context(BaseSniffContext):
                                                        self.stop_time,
                                                        self.stop_size)
 
+                    # In streaming mode the packets are read from a pipe as
+                    # soon as they arrive so we don't need get_n_packets
+                    streaming = (outfile is None)
+
                 for reader in bind_reader(self.process, outfile):
                     if not self.internal:
                         break
@@ -195,6 +442,9 @@ def register_sniff_context(BaseSniffContext):
                     if reader:
                         reader, outfile_size, position = reader
 
+                if streaming:
+                    reader.prefilter = self.prefilter
+
             except OSError, err:
                 errstr = err.strerror
                 self.internal = False
@@ -206,22 +456,26 @@ def register_sniff_context(BaseSniffContext):
 
             log.debug("Entering in the main loop")
 
-            if self.audits:
-                self.audit_dispatcher = AuditDispatcher(reader.linktype)
+            if self.audit_dispatcher and reader:
+                self.audit_dispatcher.datalink = reader.linktype
 
             while self.internal:
 
-                if self.capmethod != 1:
+                if self.capmethod != 1 and not streaming:
                     report_idx = get_n_packets(self.process)
 
                     if report_idx < reported_packets:
                         continue
 
-                while self.capmethod == 1 or reported_packets < report_idx:
+                while self.capmethod == 1 or (streaming and self.internal) or \
+                      reported_packets < report_idx:
 
                     pkt = reader.read_packet()
 
                     if not pkt:
+                        if streaming and reader.eof:
+                            self.internal = False
+
                         break
 
                     pkt = MetaPacket(pkt)
@@ -252,11 +506,18 @@ def register_sniff_context(BaseSniffContext):
                     if delta == abs(delta):
                         self.tot_time += delta.seconds
 
+                    if self.precompute:
+                        pkt.get_display()
+
+                    if self.table is not None:
+                        self.table.append(pkt)
+
                     self.data.append(pkt)
+                    self.rate.update(1, packet_size)
                     reported_packets += 1
 
                     if self.audit_dispatcher:
-                        self.audit_dispatcher.feed(pkt)
+                        self.dispatch(pkt)
 
                     if self.callback:
                         self.callback(pkt, self.udata)
@@ -311,14 +572,29 @@ def register_sniff_context(BaseSniffContext):
                             r = self.socket.recv(MTU)
                         except PcapTimeoutElapsed:
                             continue
+
+                        if r is not None and \
+                           (not self.prefilter or self.prefilter(str(r))):
+                            r = [r]
+                        else:
+                            r = None
+                    elif getattr(self.socket, 'pending', None):
+                        # Frames of an already read PACKET_MMAP block
+                        r = recv_batch(self.socket, prefilter=self.prefilter,
+                                       raw=self.raw_recv)
                     else:
                         inp, out, err = select.select(inmask, inmask, inmask, None)
                         if self.socket in inp:
-                            r = self.socket.recv(MTU)
-                    if r is None:
+                            r = recv_batch(self.socket,
+                                           prefilter=self.prefilter,
+                                           raw=self.raw_recv)
+                    if not r:
                         continue
 
-                    self.priv.append(r)
+                    if self.recorder:
+                        self.record_batch(r)
+                    else:
+                        self.queue_batch(r)
                 except Exception, err:
                     # Ok probably this is an exception raised when the select
                     # is runned on already closed socket (see also _stop)
@@ -328,15 +604,161 @@ def register_sniff_context(BaseSniffContext):
                         errstr = str(err)
 
                     self.internal = False
-                    self.socket = None
                     break
 
+            self.close_sockets()
+            self.exit_from_thread(errstr)
+
+        def run_multi(self):
+            """
+            The thread procedure used to capture on several interfaces. The
+            packets are tagged with the interface and merged in timestamp
+            order before being queued for the decode thread.
+            """
+
+            errstr = None
+
+            if self.raw_recv:
+                # (raw bytes, timestamp) tuples
+                merger = StreamMerger(len(self.sockets), key=lambda r: r[1])
+            else:
+                merger = StreamMerger(len(self.sockets))
+
+            try:
+                while self.internal:
+                    # Frames of already read PACKET_MMAP blocks first
+                    ready = [s for s in self.sockets \
+                             if getattr(s, 'pending', None)]
+
+                    if not ready:
+                        # Wake up to release the packets of idle interfaces
+                        ready, out, err = select.select(self.sockets, [], [],
+                                                        0.1)
+
+                    for idx, sock in enumerate(self.sockets):
+                        if sock not in ready:
+                            continue
+
+                        batch = recv_batch(sock, prefilter=self.prefilter,
+                                           raw=self.raw_recv)
+
+                        if self.record:
+                            pass
+                        elif self.raw_recv:
+                            # The socket index is needed by decode_packet
+                            batch = [r + (idx, ) for r in batch]
+                        else:
+                            for pkt in batch:
+                                pkt.sniffed_on = self.ifaces[idx]
+
+                        merger.push(idx, batch)
+
+                    batch = merger.pop()
+
+                    if batch and self.recorder:
+                        self.record_batch(batch)
+                    elif batch:
+                        self.queue_batch(batch)
+            except Exception, err:
+                # See also run()
+                if self.internal:
+                    errstr = str(err)
+
+            self.internal = False
+
+            batch = merger.flush()
+
+            if batch and self.recorder:
+                self.record_batch(batch)
+            elif batch:
+                self.queue_batch(batch)
+
+            self.close_sockets()
             self.exit_from_thread(errstr)
 
+        def run_fanout(self):
+            errstr = None
+
+            try:
+                while self.internal:
+                    msgs = self.fanout.read()
+
+                    if msgs is None:
+                        errstr = _('All the capture workers exited')
+                        break
+
+                    if msgs:
+                        self.queue_batch(msgs)
+            except Exception, err:
+                errstr = str(err)
+
+            self.internal = False
+            self.fanout.stop()
+
+            self.exit_from_thread(errstr)
+
+        def __merge_fanout(self, msg):
+            """
+            Merge a message sent by a fanout worker.
+            @return a MetaPacket or None
+            """
+
+            if msg[0] == 'msg':
+                AuditManager().user_msg(*msg[1:])
+                return None
+
+            if msg[0] == 'stats':
+                if self.kernel_stats is None:
+                    self.kernel_stats = [0, 0]
+
+                self.kernel_stats[0] += msg[1]
+                self.kernel_stats[1] += msg[2]
+                self.fanout_filtered += msg[3]
+                self.dispatch_drops += msg[4]
+                return None
+
+            kind, raw, ts, linktype, state = msg
+
+            try:
+                LLcls = conf.l2types[linktype]
+            except KeyError:
+                LLcls = Raw
+
+            if self.lazy:
+                packet = MetaPacket.new_from_raw(raw, ts, LLcls)
+            else:
+                try:
+                    proto = LLcls(raw)
+                except:
+                    proto = Raw(raw)
+
+                proto.time = ts
+                packet = MetaPacket(proto)
+
+            packet.iface = self.iface
+            set_fanout_state(packet, state)
+
+            if self.fanout_conns is not None:
+                self.fanout_conns.parse(packet)
+
+            return packet
+
         def exit_from_thread(self, errstr=None):
             log.debug("Exiting from thread")
 
-            self.priv = []
+            # The callback is called from the GUI main loop if the packets
+            # were decoded by the decode thread
+            deferred = self.decode_thread is not None
+            self.join_decode()
+
+            if self.audit_dispatcher:
+                self.audit_dispatcher.stop()
+
+            if self.recorder:
+                try:
+                    self.recorder.close()
+                except IOError, err:
+                    errstr = errstr or str(err)
 
             self.state = self.NOT_RUNNING
             self.percentage = 100.0
@@ -360,81 +782,217 @@ def register_sniff_context(BaseSniffContext):
 
             if errstr:
                 self.summary = _('Error: %s (%s)') % (errstr, status)
+            elif self.recorder:
+                self.summary = _('Finished recording on %s to %s (%s)') % \
+                               (self.iface, self.cap_file, status)
             else:
                 self.summary = _('Finished sniffing on %s (%s)') % (self.iface,
                                                                     status)
 
-            if self.callback:
+            self.recorder = None
+
+            if self.callback and deferred:
+                self.notify(None)
+            elif self.callback:
                 self.callback(None, self.udata)
 
         def check_finished(self):
-            if self.capmethod != 0:
-                return
+            """
+            Kept for compatibility. The native capture methods decode the
+            packets in the decode thread (see run_decode) so the GUI only
+            has to pick up the ready packets with get_data.
+            """
+            pass
+
+        def notify(self, packet):
+            """
+            Pass packet to the callback from the GUI main loop. The packets
+            queued in the meantime are delivered by the same idle handler.
+            """
 
-            priv = self.priv
-            self.priv = []
+            self.notify_lock.acquire()
 
-            for r in priv:
-                # This code should not be in the thread and called in the
-                # main thread of the GUI so we can avoid packet loss.
-                # It's better to have a temporary list object to store raw
-                # packets captured from socket.recv(MTU) function and then joins
-                # everything in self.data
+            try:
+                self.notify_queue.append(packet)
+                schedule = len(self.notify_queue) == 1
+            finally:
+                self.notify_lock.release()
 
-                packet = MetaPacket(r)
-                packet_size = packet.get_size()
+            if schedule:
+                gobject.idle_add(self.__on_notify)
 
-                if self.max_packet_size and \
-                   packet_size - self.max_packet_size > 0:
+        def __on_notify(self):
+            self.notify_lock.acquire()
 
-                    log.debug("Skipping current packet (max_packet_size)")
-                    continue
+            try:
+                packets = self.notify_queue
+                self.notify_queue = []
+            finally:
+                self.notify_lock.release()
 
-                if self.min_packet_size and \
-                   packet_size - self.min_packet_size < 0:
+            for packet in packets:
+                self.callback(packet, self.udata)
+
+            return False
+
+        def queue_batch(self, batch):
+            """
+            Queue a batch of raw packets (or fanout messages) for the decode
+            thread. If the queue is full the capture thread is blocked for a
+            while (backpressure) and then the batch is dropped.
+            """
+
+            try:
+                self.decode_queue.put(batch, True, 0.1)
+            except Queue.Full:
+                self.decode_drops += len(batch)
 
-                    log.debug("Skipping current packet (min_packet_size)")
+        def join_decode(self):
+            "Wait for the decode thread to process the queued packets"
+
+            if self.decode_thread:
+                self.decode_queue.put(None)
+                self.decode_thread.join()
+                self.decode_thread = None
+
+        def run_decode(self):
+            """
+            The decode thread procedure. It builds the MetaPackets from the
+            raw packets queued by the capture thread and feeds the audit
+            dispatcher.
+            """
+
+            limit = False
+
+            while True:
+                batch = self.decode_queue.get()
+
+                if batch is None:
+                    break
+
+                if limit:
                     continue
 
-                self.tot_count += 1
-                self.tot_size += packet.get_size()
+                for r in batch:
+                    if not self.decode_packet(r):
+                        limit = True
+                        break
+
+        def dispatch(self, packet):
+            """
+            Feed the audit dispatcher with packet. A packet that makes a
+            decoder fail is accounted in dispatch_drops.
+            """
+
+            try:
+                self.audit_dispatcher.feed(packet)
+            except Exception:
+                self.dispatch_drops += 1
+                log.error(generate_traceback())
+
+        def decode_packet(self, r):
+            """
+            Decode a raw packet captured by the native methods.
+            @return False if a stop limit has been reached
+            """
+
+            if self.fanout:
+                # Already decoded and audited by a worker
+                packet = self.__merge_fanout(r)
+
+                if not packet:
+                    return True
+            elif isinstance(r, tuple):
+                # Raw frame: (raw bytes, timestamp[, socket index])
+                idx = len(r) > 2 and r[2] or 0
 
-                now = datetime.now()
-                delta = now - self.prevtime
-                self.prevtime = now
+                packet = MetaPacket.new_from_raw(r[0], r[1],
+                                                 self.link_types[idx])
+                packet.iface = self.ifaces[idx]
+            else:
+                packet = MetaPacket(r)
+                packet.iface = getattr(r, 'sniffed_on', None) or self.iface
 
-                if delta == abs(delta):
-                    self.tot_time += delta.seconds
+            # Size bounds are already checked by the prefilter on raw bytes
+            packet_size = packet.get_size()
 
-                self.data.append(packet)
+            # Ready to be shown without dissecting in the GUI thread
+            if self.precompute:
+                packet.get_display()
 
-                if self.audit_dispatcher:
-                    self.audit_dispatcher.feed(packet)
+            if self.table is not None:
+                self.table.append(packet)
 
-                # FIXME: This probably should be moved inside the run() function
-                if self.callback:
-                    self.callback(packet, self.udata)
+            self.data.append(packet)
 
-                lst = []
+            if self.audit_dispatcher and not self.fanout:
+                self.dispatch(packet)
 
-                if self.stop_count:
-                    lst.append(float(float(self.tot_count) /
-                                     float(self.stop_count)))
-                if self.stop_time:
-                    lst.append(float(float(self.tot_time) /
-                                     float(self.stop_time)))
-                if self.stop_size:
-                    lst.append(float(float(self.tot_size) /
-                                     float(self.stop_size)))
+            if self.callback:
+                self.notify(packet)
 
-                if lst:
-                    self.percentage = float(float(sum(lst)) /
-                                            float(len(lst))) * 100.0
+            return self.update_counters(1, packet_size)
 
-                    if self.percentage >= 100:
-                        self.internal = False
-                else:
-                    # ((goject.G_MAXINT / 4) % gobject.G_MAXINT)
-                    self.percentage = (self.percentage + 536870911) % 2147483647
+        def record_batch(self, batch):
+            """
+            Write a batch of (raw bytes, timestamp) tuples in record only
+            mode. Only the counters are updated.
+            """
+
+            size = 0
+
+            for r in batch:
+                if not isinstance(r, tuple):
+                    # WINDOWS path returns dissected packets
+                    r = (str(r), r.time)
+
+                self.recorder.write(r[0], r[1])
+                size += len(r[0])
+
+            if not self.update_counters(len(batch), size):
+                self.internal = False
+
+        def update_counters(self, count, size):
+            """
+            Account count packets of size bytes and update the percentage
+            @return False if a stop limit has been reached
+            """
+
+            self.tot_count += count
+            self.tot_size += size
+
+            now = datetime.now()
+            delta = now - self.prevtime
+            self.prevtime = now
+
+            if delta == abs(delta):
+                self.tot_time += delta.seconds
+
+            self.rate.update(count, size)
+
+            lst = []
+
+            if self.stop_count:
+                lst.append(float(float(self.tot_count) /
+                                 float(self.stop_count)))
+            if self.stop_time:
+                lst.append(float(float(self.tot_time) /
+                                 float(self.stop_time)))
+            if self.stop_size:
+                lst.append(float(float(self.tot_size) /
+                                 float(self.stop_size)))
+
+            if lst:
+                self.percentage = float(float(sum(lst)) /
+                                        float(len(lst))) * 100.0
+
+                if self.percentage >= 100:
+                    self.internal = False
+                    return False
+            else:
+                # ((goject.G_MAXINT / 4) % gobject.G_MAXINT)
+                self.percentage = (self.percentage + 536870911) % 2147483647
+
+            return True
 
     return SniffContext
@@ -20,15 +20,27 @@
 
 import os
 import os.path
+import tempfile
+import threading
 
 from umit.pm.backend.scapy.packet import MetaPacket
 from umit.pm.backend.scapy.wrapper import PcapWriter, PcapReader, wrpcap, PacketList
-from umit.pm.manager.auditmanager import AuditDispatcher, IL_TYPE_ETH
+from umit.pm.backend.scapy.utils import LazyPcap, PcapRecorder, \
+                                        PacketTable, write_metapacket, \
+                                        bulk_decode
+from umit.pm.manager.auditmanager import new_audit_dispatcher, IL_TYPE_ETH
+from umit.pm.manager.preferencemanager import Prefs
 
 from umit.pm.core.i18n import _
+from umit.pm.core.logger import log
+
+# Smaller files are loaded by a single process
+BULK_DECODE_SIZE = 32 * 1024 ** 2
 
 class CustomPcapWriter(PcapWriter):
     def __init__(self, operation, plen, filename, *args, **kargs):
+        # The name shown in the summary when filename is a temporary file
+        self.name = kargs.pop('name', filename)
         self.operation = operation
 
         self.packet_len = plen
@@ -36,8 +48,16 @@ class CustomPcapWriter(PcapWriter):
 
         PcapWriter.__init__(self, filename, *args, **kargs)
 
+    def write_metapackets(self, mpkts):
+        for mpkt in mpkts:
+            self._write_packet(mpkt)
+
     def _write_packet(self, packet):
-        PcapWriter._write_packet(self, packet)
+        if isinstance(packet, MetaPacket):
+            # Saves a build of the packet if the bytes are already known
+            write_metapacket(self, packet)
+        else:
+            PcapWriter._write_packet(self, packet)
 
         self.packet_idx += 1
 
@@ -56,7 +76,7 @@ class CustomPcapWriter(PcapWriter):
 
         if self.operation:
             self.operation.summary = _('Writing %s - %d packets (%s)') % \
-                                      (self.filename, self.packet_idx, fsize)
+                                      (self.name, self.packet_idx, fsize)
 
             self.operation.percentage = (float(self.packet_idx) /
                                          float(self.packet_len)) * 100.0
@@ -68,20 +88,76 @@ def register_static_context(BaseStaticContext):
             BaseStaticContext.__init__(self, title, fname, audits)
 
             self.audit_dispatcher = None
+            self.table = None
+            self.fastdecode = Prefs()['backend.system.audit.fastdecode'].value
+            self.audit_workers = Prefs()['backend.system.audit.workers'].value
+
+        def load(self, operation=None, dispatcher=None):
+            """
+            Load the packets of cap_file
+            @param operation the Operation to update with the progress
+            @param dispatcher an audit dispatcher already started or None.
+                   Used when load() runs in a thread since the audit workers
+                   can be forked only by the main thread.
+            """
 
-        def load(self, operation=None):
+            self.audit_dispatcher = dispatcher
+
+            try:
+                return self.__load(operation)
+            finally:
+                if self.audit_dispatcher:
+                    self.audit_dispatcher.stop()
+
+        def __load(self, operation):
             if not self.cap_file:
                 return False
 
             self.data = []
+            self.table = None
+
+            # Files written in record only mode have a sparse index so we
+            # could avoid reading them now. The audits are skipped here
+            # because they need a complete pass over the file.
+            if os.path.exists(self.cap_file + PcapRecorder.INDEX_SUFFIX):
+                try:
+                    self.data = LazyPcap(self.cap_file)
+
+                    if self.audits:
+                        log.info('Not auditing %s (opened lazily)' % \
+                                 self.cap_file)
+                except IOError, err:
+                    log.warning('Unable to open %s lazily (%s)' % \
+                                (self.cap_file, str(err)))
+                else:
+                    if operation:
+                        operation.summary = _('Opened %s - %d packets') % \
+                                             (self.cap_file, len(self.data))
+                        operation.percentage = 100.0
+
+                    self.status = self.SAVED
+                    self.title = self.cap_file
+
+                    if self.audits:
+                        self.summary = _('%d packets indexed (audits '
+                                         'skipped).') % len(self.data)
+                    else:
+                        self.summary = _('%d packets indexed.') % \
+                                       len(self.data)
+                    return True
 
             try:
                 pktcount = 0
                 reader = PcapReader(self.cap_file)
+                self.table = PacketTable()
                 size = os.stat(self.cap_file).st_size
 
-                if self.audits:
-                    self.audit_dispatcher = AuditDispatcher(reader.linktype)
+                if self.audits and self.audit_dispatcher:
+                    self.audit_dispatcher.datalink = reader.linktype
+                elif self.audits:
+                    self.audit_dispatcher = new_audit_dispatcher(
+                        reader.linktype, self.fastdecode, self.audit_workers)
+                    self.audit_dispatcher.start()
 
                 if size >= 1024 ** 3:
                     fsize = "%.1f GB" % (size / (1024.0 ** 3))
@@ -90,39 +166,56 @@ def register_static_context(BaseStaticContext):
                 else:
                     fsize = "%.1f KB" % (size / 1024.0)
 
-                while True:
-                    p = reader.read_packet()
-
-                    if p is None:
-                        break
-                    else:
-                        pktcount += 1
-
-                        if pktcount % 10 == 0 and operation:
-                            operation.summary = \
-                                _('Loading %s - %d packets (%s)') % \
-                                 (self.cap_file, pktcount, fsize)
-
-                            # FIXME: we are accessing to a private field (f)
-
-                            if getattr(reader.f, 'fileobj', None):
-                                # If fileobj is present we are gzip file and we
-                                # need to get the absolute position not the
-                                # relative to the gzip file.
-                                pos = reader.f.fileobj.tell()
-                            else:
-                                pos = reader.f.tell()
+                workers = Prefs()['backend.system.static.workers'].value
 
-                            operation.percentage = \
-                                (pos / float(size)) * 100.0
+                # The decoding pool is forked so it could not be created by
+                # the FileOperation thread: in that case use the serial path.
+                if workers != 1 and size >= BULK_DECODE_SIZE and \
+                   threading.currentThread().getName() != 'MainThread':
+                    log.info('Not forking the decoding workers from a thread')
+                    workers = 1
 
-                        lst = PacketList([p], os.path.basename(self.cap_file))
-                        mpkt = MetaPacket(lst[0])
-                        self.data.append(mpkt)
-
-                        # TODO: overhead
-                        if self.audit_dispatcher:
-                            self.audit_dispatcher.feed(mpkt)
+                if workers != 1 and size >= BULK_DECODE_SIZE:
+                    reader.close()
+                    pktcount = self.__bulk_load(operation, workers or None,
+                                                fsize)
+                else:
+                    while True:
+                        p = reader.read_packet()
+
+                        if p is None:
+                            break
+                        else:
+                            pktcount += 1
+
+                            if pktcount % 10 == 0 and operation:
+                                operation.summary = \
+                                    _('Loading %s - %d packets (%s)') % \
+                                     (self.cap_file, pktcount, fsize)
+
+                                # FIXME: we are accessing to a private field (f)
+
+                                if getattr(reader.f, 'fileobj', None):
+                                    # If fileobj is present we are gzip file
+                                    # and we need to get the absolute
+                                    # position not the relative to the gzip
+                                    # file.
+                                    pos = reader.f.fileobj.tell()
+                                else:
+                                    pos = reader.f.tell()
+
+                                operation.percentage = \
+                                    (pos / float(size)) * 100.0
+
+                            lst = PacketList([p],
+                                        os.path.basename(self.cap_file))
+                            mpkt = MetaPacket(lst[0])
+                            self.data.append(mpkt)
+                            self.table.append(mpkt)
+
+                            # TODO: overhead
+                            if self.audit_dispatcher:
+                                self.audit_dispatcher.feed(mpkt)
 
                 if operation:
                     operation.summary = _('Loaded %s - %d packets (%s)') % \
@@ -143,6 +236,35 @@ def register_static_context(BaseStaticContext):
             self.summary = _('%d packets loaded.') % len(self.data)
             return True
 
+        def __bulk_load(self, operation, workers, fsize):
+            """
+            Dissect the file with bulk_decode. The audits are fed here in
+            order once all the packets are back from the workers.
+
+            @return the number of packets loaded
+            """
+
+            def update(decoded, total):
+                if operation:
+                    operation.summary = \
+                        _('Loading %s - %d of %d packets (%s)') % \
+                         (self.cap_file, decoded, total, fsize)
+                    operation.percentage = (decoded / float(total)) * 100.0
+
+            self.data, linktype = bulk_decode(self.cap_file, workers,
+                                              callback=update)
+            self.table.extend(self.data)
+
+            if self.audit_dispatcher:
+                if operation:
+                    operation.summary = _('Auditing %s - %d packets (%s)') % \
+                                         (self.cap_file, len(self.data), fsize)
+
+                for mpkt in self.data:
+                    self.audit_dispatcher.feed(mpkt)
+
+            return len(self.data)
+
         def save(self, operation=None):
             if getattr(self, 'get_all_data', False):
                 data = self.get_all_data()
@@ -152,21 +274,37 @@ def register_static_context(BaseStaticContext):
             if not self.cap_file:
                 return False
 
-            data = [packet.root for packet in data]
-
             if not data:
                 self.summary = _('No packets to save')
                 return False
 
-            try:
-                writer = CustomPcapWriter(operation, len(data), self.cap_file, \
-                                          gz=('gz' in self.cap_file) and 1 or 0)
-                writer.write(data)
-                writer.close()
-
-                writer.update_operation()
+            # data could be a LazyPcap reading cap_file so the packets are
+            # written to a temporary file that replaces cap_file at the end
+            dirname, basename = os.path.split(os.path.abspath(self.cap_file))
+            tmpfile = tempfile.mktemp('.tmp', '.%s-' % basename, dirname)
 
-            except IOError, (errno, err):
+            try:
+                try:
+                    writer = CustomPcapWriter(operation, len(data), tmpfile, \
+                                          gz=('gz' in self.cap_file) and 1 or 0,
+                                          name=self.cap_file)
+                    writer.write_metapackets(data)
+                    writer.close()
+
+                    writer.update_operation()
+
+                    os.rename(tmpfile, self.cap_file)
+                finally:
+                    if os.path.exists(tmpfile):
+                        os.remove(tmpfile)
+
+                # A previous sparse index is not valid anymore
+                try:
+                    os.remove(self.cap_file + PcapRecorder.INDEX_SUFFIX)
+                except OSError:
+                    pass
+
+            except (IOError, OSError), (errno, err):
                 self.summary = str(err)
 
                 if operation:
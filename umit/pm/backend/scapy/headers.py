@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2008, 2009 Adriano Monteiro Marques
+#
+# Author: Francesco Piccinno <stack.box@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+"""
+Fast path header decoder.
+
+decode_headers() parses the fixed part of the Ethernet, ARP, IPv4, IPv6,
+TCP, UDP and ICMP headers straight from the raw frame with precompiled
+struct formats. The result is a dict { scapy layer class : (raw, fields) }
+used by MetaPacket.get_field and get_fields before touching the scapy
+object graph.
+
+Everything not present in the dict (options, uncommon protocols, the
+layers above L4) is still read from the scapy packet. raw is the string
+returned by get_field('proto') and it is set only when str() of the scapy
+layer would give back the very same bytes (no options and a payload
+dissected as Raw), otherwise it is None.
+"""
+
+import struct
+
+from socket import inet_ntoa, inet_ntop, AF_INET6
+
+from umit.pm.core.netconst import IL_TYPE_ETH, LL_TYPE_IP, LL_TYPE_IP6, \
+                                  LL_TYPE_ARP, NL_TYPE_ICMP, NL_TYPE_TCP, \
+                                  NL_TYPE_UDP
+
+from umit.pm.backend.scapy.wrapper import *
+
+IPv6 = globals().get('IPv6', None)
+
+ETH_HDR  = struct.Struct('!6s6sH')
+ARP_HDR  = struct.Struct('!HHBBH6s4s6s4s')
+IP_HDR   = struct.Struct('!BBHHHBBH4s4s')
+IP6_HDR  = struct.Struct('!IHBB16s16s')
+TCP_HDR  = struct.Struct('!HHIIBBHHH')
+UDP_HDR  = struct.Struct('!HHHH')
+ICMP_HDR = struct.Struct('!BBH')
+
+# ICMP types carrying the offending IP header (dissected as IPerror)
+ICMP_ERRORS = (3, 4, 5, 11, 12)
+
+def get_tcp_flags_size():
+    for field in TCP.fields_desc:
+        if field.name == 'flags':
+            return getattr(field, 'size', 8)
+    return 8
+
+# Recent scapy versions put the NS bit in flags (9 bits instead of 8)
+TCP_FLAGS_SIZE = get_tcp_flags_size()
+
+# cls -> (len(cls.payload_guess), set of bound values or None)
+_bindings = {}
+
+def get_bound_values(cls, keys):
+    """
+    @param cls a scapy layer class
+    @param keys the names of the fields used to bind the upper layers
+    @return a set with the values of keys bound to an upper layer or None
+            if some binding doesn't depend on keys at all
+    """
+    guess = cls.payload_guess
+
+    try:
+        count, values = _bindings[cls]
+
+        if count == len(guess):
+            return values
+    except KeyError:
+        pass
+
+    values = set()
+
+    for fval, pcls in guess:
+        bound = [fval[key] for key in keys if key in fval]
+
+        if not bound:
+            values = None
+            break
+
+        values.update(bound)
+
+    _bindings[cls] = (len(guess), values)
+    return values
+
+def is_raw_payload(cls, keys, *values):
+    """
+    @return True if the payload of a cls layer with the given keys values
+            is going to be dissected as Raw by scapy
+    """
+    bound = get_bound_values(cls, keys)
+
+    if bound is None:
+        return False
+
+    for value in values:
+        if value in bound:
+            return False
+
+    return True
+
+def str2mac(raw):
+    return '%02x:%02x:%02x:%02x:%02x:%02x' % tuple(map(ord, raw))
+
+def decode_l4(raw, off, proto, plen, headers, state):
+    """
+    @param plen the L4 length according to the IP header
+    @return True if str() of the L4 scapy layer equals raw[off:]
+    """
+
+    if proto == NL_TYPE_TCP:
+        if len(raw) < off + 20:
+            return False
+
+        sport, dport, seq, ack, offres, flags, window, chksum, urgptr = \
+             TCP_HDR.unpack_from(raw, off)
+
+        dataofs = offres >> 4
+
+        if dataofs < 5:
+            return False
+
+        if TCP_FLAGS_SIZE == 9:
+            flags |= (offres & 1) << 8
+
+        headers[TCP] = (None, {
+            'sport' : sport, 'dport' : dport, 'seq' : seq, 'ack' : ack,
+            'dataofs' : dataofs, 'flags' : flags, 'window' : window,
+            'chksum' : chksum, 'urgptr' : urgptr,
+        })
+
+        if state is not None:
+            state.l4_src, state.l4_dst = sport, dport
+            state.l4_ack, state.l4_seq = ack, seq
+            state.l4_flags = flags
+            state.l4_len = dataofs * 4
+
+        if dataofs != 5:
+            return False
+
+        if plen <= 20 or is_raw_payload(TCP, ('sport', 'dport'),
+                                        sport, dport):
+            headers[TCP] = (raw[off:], headers[TCP][1])
+            return True
+
+    elif proto == NL_TYPE_UDP:
+        if len(raw) < off + 8:
+            return False
+
+        sport, dport, length, chksum = UDP_HDR.unpack_from(raw, off)
+
+        headers[UDP] = (None, {
+            'sport' : sport, 'dport' : dport,
+            'len' : length, 'chksum' : chksum,
+        })
+
+        if state is not None:
+            state.l4_src, state.l4_dst = sport, dport
+            state.l4_len = 8
+
+        if plen <= 8 or is_raw_payload(UDP, ('sport', 'dport'),
+                                       sport, dport):
+            headers[UDP] = (raw[off:], headers[UDP][1])
+            return True
+
+    elif proto == NL_TYPE_ICMP:
+        if len(raw) < off + 4:
+            return False
+
+        type, code, chksum = ICMP_HDR.unpack_from(raw, off)
+
+        headers[ICMP] = (None, {
+            'type' : type, 'code' : code, 'chksum' : chksum,
+        })
+
+        # Other fields depend on the type and the scapy version
+        if type not in ICMP_ERRORS and \
+           is_raw_payload(ICMP, ('type', 'code'), type, code):
+            headers[ICMP] = (raw[off:], headers[ICMP][1])
+            return True
+
+    return False
+
+def decode_ip(raw, off, headers, state):
+    if len(raw) < off + 20:
+        return False
+
+    verihl, tos, length, id, flagfrag, ttl, proto, chksum, src, dst = \
+          IP_HDR.unpack_from(raw, off)
+
+    version, ihl = verihl >> 4, verihl & 0x0f
+
+    if version != 4 or ihl < 5 or len(raw) < off + ihl * 4:
+        return False
+
+    src, dst = inet_ntoa(src), inet_ntoa(dst)
+    flags, frag = flagfrag >> 13, flagfrag & 0x1fff
+
+    headers[IP] = (None, {
+        'version' : version, 'ihl' : ihl, 'tos' : tos, 'len' : length,
+        'id' : id, 'flags' : flags, 'frag' : frag, 'ttl' : ttl,
+        'proto' : proto, 'chksum' : chksum, 'src' : src, 'dst' : dst,
+    })
+
+    if state is not None:
+        state.l3_src, state.l3_dst = src, dst
+        state.l4_proto = proto
+        state.l3_len = ihl * 4
+        state.payload_len = length - state.l3_len
+
+    # Fragments are left to scapy
+    if frag:
+        return False
+
+    exact = decode_l4(raw, off + ihl * 4, proto, length - ihl * 4,
+                      headers, state)
+
+    if exact and ihl == 5:
+        headers[IP] = (raw[off:], headers[IP][1])
+        return True
+
+    return False
+
+def decode_ip6(raw, off, headers):
+    if IPv6 is None or len(raw) < off + 40:
+        return False
+
+    vtcfl, plen, nh, hlim, src, dst = IP6_HDR.unpack_from(raw, off)
+
+    if vtcfl >> 28 != 6:
+        return False
+
+    headers[IPv6] = (None, {
+        'version' : 6, 'tc' : (vtcfl >> 20) & 0xff, 'fl' : vtcfl & 0xfffff,
+        'plen' : plen, 'nh' : nh, 'hlim' : hlim,
+        'src' : inet_ntop(AF_INET6, src), 'dst' : inet_ntop(AF_INET6, dst),
+    })
+
+    # Extension headers and ICMPv6 are left to scapy
+    if nh not in (NL_TYPE_TCP, NL_TYPE_UDP):
+        return False
+
+    if decode_l4(raw, off + 40, nh, plen, headers, None):
+        headers[IPv6] = (raw[off:], headers[IPv6][1])
+        return True
+
+    return False
+
+def decode_headers(raw, state=None):
+    """
+    Decode the headers of an ethernet frame.
+
+    @param raw the raw bytes of the frame
+    @param state an AuditState to fill with the l2/l3/l4 attributes like the
+                 ethernet, ip, tcp and udp decoders do, or None
+    @return a dict { layer class : (raw or None, fields dict) } or None if
+            the frame could not be decoded
+    """
+
+    if len(raw) < 14:
+        return None
+
+    dst, src, type = ETH_HDR.unpack_from(raw)
+
+    # Handled by scapy as Dot3
+    if type <= 1500:
+        return None
+
+    src, dst = str2mac(src), str2mac(dst)
+    headers = {Ether : (None, {'dst' : dst, 'src' : src, 'type' : type})}
+
+    if state is not None:
+        state.l2_proto = IL_TYPE_ETH
+        state.l2_len = 14
+        state.l2_src, state.l2_dst = src, dst
+        state.l3_proto = type
+
+    exact = False
+
+    if type == LL_TYPE_IP:
+        exact = decode_ip(raw, 14, headers, state)
+
+    elif type == LL_TYPE_IP6:
+        exact = decode_ip6(raw, 14, headers)
+
+    elif type == LL_TYPE_ARP and len(raw) >= 42:
+        hwtype, ptype, hwlen, plen, op, hwsrc, psrc, hwdst, pdst = \
+              ARP_HDR.unpack_from(raw, 14)
+
+        if hwlen == 6 and plen == 4:
+            psrc, pdst = inet_ntoa(psrc), inet_ntoa(pdst)
+
+            headers[ARP] = (raw[14:], {
+                'hwtype' : hwtype, 'ptype' : ptype, 'hwlen' : hwlen,
+                'plen' : plen, 'op' : op,
+                'hwsrc' : str2mac(hwsrc), 'psrc' : psrc,
+                'hwdst' : str2mac(hwdst), 'pdst' : pdst,
+            })
+
+            if state is not None:
+                state.l3_src, state.l3_dst = psrc, pdst
+
+            exact = True
+
+    if exact:
+        headers[Ether] = (raw, headers[Ether][1])
+
+    return headers
+
+def check_headers(mpkt):
+    """
+    Compare the headers decoded from the raw bytes of mpkt with the fields
+    of the scapy packet.
+
+    @param mpkt a MetaPacket
+    @return a list of strings describing the mismatches
+    """
+
+    errors = []
+    raw = mpkt.get_raw()
+
+    if not issubclass(mpkt.root.__class__, Ether):
+        return errors
+
+    for cls, (layer_raw, fields) in (decode_headers(raw) or {}).items():
+        layer = mpkt.root.getlayer(cls)
+
+        if layer is None:
+            errors.append('%s: missing in scapy' % cls.__name__)
+            continue
+
+        if layer_raw is not None and layer_raw != str(layer):
+            errors.append('%s: raw bytes differ' % cls.__name__)
+
+        for name, value in fields.items():
+            expected = getattr(layer, name)
+
+            if value != expected:
+                errors.append('%s.%s: %r instead of %r' % \
+                              (cls.__name__, name, value, expected))
+
+    return errors
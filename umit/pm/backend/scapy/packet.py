@@ -18,6 +18,9 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
 
+import sys
+import time
+
 from datetime import datetime
 
 from umit.pm.core.logger import log
@@ -28,50 +31,295 @@ from umit.pm.core.netconst import IL_TYPE_ETH, IL_TYPE_TR, IL_TYPE_FDDI, \
                              NL_TYPE_TCP, NL_TYPE_UDP
 
 from umit.pm.backend.scapy.translator import global_trans
+from umit.pm.backend.scapy.headers import decode_headers
 from umit.pm.backend.scapy.wrapper import *
 
+# The network layers identifying a flow (see MetaPacket.get_flow)
+FLOW_LAYERS = tuple([cls for cls in (IP, globals().get('IPv6', None)) \
+                     if cls is not None])
+
+# The attributes filled by the decoders with their default values
+AUDIT_ATTRIBUTES = (
+    ('l2_proto', None), ('l2_src', None), ('l2_dst', None), ('l2_len', 0),
+    ('l3_src', None), ('l3_dst', None), ('l3_proto', None), ('l3_len', 0),
+    ('l4_src', None), ('l4_dst', None), ('l4_ack', 0), ('l4_seq', 0),
+    ('l4_flags', 0), ('l4_proto', 0), ('l4_len', 0),
+    ('payload_len', 0),
+    ('inject', ''), ('inject_len', 0), ('inj_delta', 0),
+    ('data', ''), ('data_len', 0),
+    ('session', None), ('context', None),
+    # Set by the dispatcher when the fast header decoder is enabled
+    ('headers', None),
+)
+
+class AuditState(object):
+    """
+    The scratch state used by the decoders. It is allocated only for the
+    packets passing through an AuditDispatcher.
+    """
+
+    __slots__ = tuple(name for name, default in AUDIT_ATTRIBUTES)
+
+    def __init__(self):
+        for name, default in AUDIT_ATTRIBUTES:
+            setattr(self, name, default)
+
+    def copy(self):
+        state = AuditState()
+
+        for name in self.__slots__:
+            setattr(state, name, getattr(self, name))
+
+        return state
+
+def audit_attribute(name, default):
+    """
+    @return a property for the name attribute of the AuditState. Reading
+            the attribute of a packet without state returns default.
+    """
+
+    def getter(self):
+        state = self._audit
+
+        if state is None:
+            return default
+
+        return getattr(state, name)
+
+    def setter(self, value):
+        state = self._audit
+
+        if state is None:
+            state = self._audit = AuditState()
+
+        setattr(state, name, value)
+
+    return property(getter, setter)
+
+###############################################################################
+# Field paths
+###############################################################################
+
+class FieldPath(object):
+    """
+    A field path like 'tcp.sport' resolved once to the layer class and to the
+    attribute names to walk into that layer.
+    """
+    __slots__ = ('path', 'layer', 'names')
+
+    def __init__(self, path):
+        """
+        @param path a dotted path like 'ip', 'ip.src' or 'dns.qd.qname'
+        @raise KeyError if the protocol is not in global_trans
+        """
+        ret = path.split('.')
+
+        self.path = path
+        self.layer = global_trans[ret[0]][0]
+        self.names = tuple(ret[1:])
+
+    def __repr__(self):
+        return '<FieldPath %s>' % self.path
+
+# path -> FieldPath. Only valid paths end up here
+FIELD_PATHS = {}
+
+def compile_field(path):
+    """
+    Return the cached FieldPath for path, compiling it on the first use.
+    Plugins could call this at registration time to pay the cost upfront.
+    @param path a dotted field path or an already compiled FieldPath
+    @return a FieldPath instance
+
+    >>> compile_field('tcp.sport') is compile_field('tcp.sport')
+    True
+    >>> compile_field('ip').names
+    ()
+    """
+    if isinstance(path, FieldPath):
+        return path
+
+    try:
+        return FIELD_PATHS[path]
+    except KeyError:
+        fpath = FieldPath(path)
+        FIELD_PATHS[path] = fpath
+        return fpath
 
 class MetaPacket(object):
+    # A fixed and small per packet overhead: no __dict__ here
+    __slots__ = ('_root', '_raw', '_rawcls', '_rawtime', '_bytes', \
+                 '_display', '_cow', '_cfields', '_audit', 'flags', 'iface')
+
     def __init__(self, proto=None, cfields=None, flags=0):
-        self.root = proto
-        self.cfields = cfields or {}
+        self._root = proto
+
+        # Used in lazy mode (see new_from_raw)
+        self._raw = None
+        self._rawcls = None
+        self._rawtime = None
+
+        # The serialized packet and the strings shown in the packet list
+        # (see get_raw, get_display and invalidate)
+        self._bytes = None
+        self._display = None
+
+        # A [count] list shared by the copies of the same scapy packet
+        # (see copy and __unshare)
+        self._cow = None
+
+        # Allocated on demand (see get_cfields and init_audit_state)
+        self._cfields = cfields or None
+        self._audit = None
+
         self.flags = flags
 
-        self.l2_proto = None
-        self.l2_src = None
-        self.l2_dst = None
-        self.l2_len = 0
+        # The interface the packet was captured on (if known)
+        self.iface = None
+
+    def get_cfields(self):
+        if self._cfields is None:
+            self._cfields = {}
+
+        return self._cfields
+
+    def set_cfields(self, value):
+        self._cfields = value
+
+    cfields = property(get_cfields, set_cfields,
+                       doc="A dict of custom fields set by the audits")
+
+    def init_audit_state(self, fast=False):
+        """
+        Allocate the state used by the decoders (l2_src, l3_src, session,
+        etc.). Called by AuditDispatcher.
+
+        @param fast if True and the packet is not yet dissected the common
+                    headers are decoded from the raw bytes (see headers.py)
+                    and the l2/l3/l4 attributes are filled in advance
+        """
+
+        if self._audit is None:
+            self._audit = AuditState()
+
+        if fast and self._raw is not None and issubclass(self._rawcls, Ether):
+            self._audit.headers = decode_headers(self._raw, self._audit)
+
+    def invalidate(self):
+        """
+        Forget the cached bytes and the decoded headers. Called by the methods
+        modifying the packet. Call it after changing the scapy layers directly.
+
+        >>> mpkt = MetaPacket(Ether() / IP())
+        >>> mpkt.get_raw() is mpkt.get_raw()
+        True
+        >>> mpkt.set_field('ip.ttl', 1)
+        >>> ord(mpkt.get_raw()[22])
+        1
+        >>> lazy = MetaPacket.new_from_raw(str(Ether() / IP()), 0)
+        >>> lazy.set_field('ip.ttl', 1)
+        >>> ord(lazy.get_raw()[22]), lazy.get_size()
+        (1, 34)
+        """
+
+        # The mutator accessing root right after would dissect the packet
+        # and cache the original bytes again
+        if self._raw is not None:
+            self.__dissect()
+
+        self._bytes = None
+        self._display = None
+
+        if self._audit is not None:
+            self._audit.headers = None
+
+    def has_audit_state(self):
+        return self._audit is not None
 
-        self.l3_src = None
-        self.l3_dst = None
-        self.l3_proto = None
-        self.l3_len = 0
+    @classmethod
+    def new_from_raw(cls, raw, ts, LLcls=Ether, cfields=None, flags=0,
+                     display=None):
+        """
+        Create a lazy MetaPacket. Only the raw bytes are kept and the scapy
+        packet is built on the first access to root. get_size, get_raw and
+        the time accessors don't need the dissection.
+
+        @param raw the raw bytes of the frame
+        @param ts the timestamp of the frame
+        @param LLcls the scapy class of the datalink layer
+        @param display the tuple returned by get_display() if already known
+        """
+
+        mpkt = cls(None, cfields, flags)
+        mpkt._raw = raw
+        mpkt._rawcls = LLcls
+        mpkt._rawtime = ts
+        mpkt._display = display
+
+        return mpkt
+
+    def is_dissected(self):
+        "@return False if the packet is still waiting to be dissected"
+        return self._raw is None
+
+    def __dissect(self):
+        raw = self._raw
+
+        try:
+            root = self._rawcls(raw)
+        except:
+            root = Raw(raw)
+
+        root.time = self._rawtime
+
+        # The bytes are still valid until the packet is modified
+        self._root = root
+        self._bytes = raw
+        self._raw = None
+
+    def __peek(self):
+        # The scapy packet for read only access. It could be shared with
+        # other copies so it must not be modified.
+        if self._raw is not None:
+            self.__dissect()
+
+        return self._root
 
-        self.l4_src = None
-        self.l4_dst = None
-        self.l4_ack = 0
-        self.l4_seq = 0
-        self.l4_flags = 0
-        self.l4_proto = 0
-        self.l4_len = 0
+    def __unshare(self, duplicate=True):
+        cow = self._cow
 
-        self.payload_len = 0
+        if cow is None:
+            return
 
-        self.inject = ''
-        self.inject_len = 0
-        self.inj_delta = 0
+        self._cow = None
 
-        self.data = ''
-        self.data_len = 0
+        # The last holder of the shared packet could keep it
+        if cow[0] > 1:
+            cow[0] -= 1
 
-        self.session = None
-        self.context = None
+            if duplicate:
+                self._root = self._root.copy()
+
+    def get_root(self):
+        # The layers could be modified by the caller
+        self.__unshare()
+        return self.__peek()
+
+    def set_root(self, value):
+        self.invalidate()
+        self.__unshare(False)
+        self._raw = None
+        self._root = value
+
+    root = property(get_root, set_root, doc="The scapy packet (dissected on"
+                                            " the first access in lazy mode)")
 
     def set_data_len(self, length):
         """
         This is used from the injection engine to set the correct payload
         string to transport protocols like TCP or UDP
         """
+        self.invalidate()
         value = self.data[:length]
 
         if self.l4_proto == NL_TYPE_TCP:
@@ -88,10 +336,10 @@ class MetaPacket(object):
         return MetaPacket(self.root / other.root, cfields)
 
     def hashret(self):
-        return self.root.hashret()
+        return self.__peek().hashret()
 
     def answers(self, other):
-        return self.root.answers(other.root)
+        return self.__peek().answers(other.root)
 
     @classmethod
     def new(cls, proto_name):
@@ -122,6 +370,8 @@ class MetaPacket(object):
             return None
 
     def insert(self, proto, layer):
+        self.invalidate()
+
         if layer == -1:
             # Append
             packet = self.root / proto.root
@@ -162,6 +412,7 @@ class MetaPacket(object):
         return False
 
     def remove(self, rproto):
+        self.invalidate()
         first = None
         last = self.root
 
@@ -184,36 +435,60 @@ class MetaPacket(object):
         return False
 
     def get_size(self):
-        return len(str(self.root))
+        return len(self.get_raw())
+
+    def get_display(self):
+        """
+        @return a tuple (source, dest, protocol, summary) with the strings
+                shown in the packet list. They are computed only once until
+                the packet is modified (see invalidate).
+        """
+
+        if self._display is None:
+            self._display = (self.__get_address('src'),
+                             self.__get_address('dst'),
+                             self.__get_protocol_str(),
+                             self.__peek().summary())
+
+        return self._display
 
     def summary(self):
-        return self.root.summary()
+        return self.get_display()[3]
 
     def get_datetime(self):
-        return datetime.fromtimestamp(self.root.time)
+        return datetime.fromtimestamp(self.get_rawtime())
 
     def get_rawtime(self):
-        return self.root.time
+        if self._raw is not None:
+            return self._rawtime
 
-    def get_time(self):
-        #self.root.time
-        return self.root.sprintf("%.time%")
+        return self.__peek().time
 
-    def get_source(self):
-        ip = self.root.sprintf("{IP:%IP.src%}")
-        hw = self.root.sprintf("{Ether:%Ether.src%}")
+    def get_iface(self):
+        return self.iface or ''
 
-        if ip:
-            return ip
+    def get_time(self):
+        if self._raw is not None:
+            # Same format of %.time% in Packet.sprintf
+            ts = self._rawtime
+            return time.strftime("%H:%M:%S.%%06i", time.localtime(ts)) % \
+                   int((ts - int(ts)) * 1000000)
 
-        if hw:
-            return hw
+        return self.__peek().sprintf("%.time%")
 
-        return "N/A"
+    def get_source(self):
+        return self.get_display()[0]
 
     def get_dest(self):
-        ip = self.root.sprintf("{IP:%IP.dst%}")
-        hw = self.root.sprintf("{Ether:%Ether.dst%}")
+        return self.get_display()[1]
+
+    def get_protocol_str(self):
+        return self.get_display()[2]
+
+    def __get_address(self, name):
+        root = self.__peek()
+        ip = root.sprintf("{IP:%%IP.%s%%}" % name)
+        hw = root.sprintf("{Ether:%%Ether.%s%%}" % name)
 
         if ip:
             return ip
@@ -223,8 +498,8 @@ class MetaPacket(object):
 
         return "N/A"
 
-    def get_protocol_str(self):
-        proto = self.root
+    def __get_protocol_str(self):
+        proto = self.__peek()
 
         while isinstance(proto, Packet):
             if isinstance(proto.payload, NoPayload) or \
@@ -250,7 +525,15 @@ class MetaPacket(object):
         return lst
 
     def get_protocol_bounds(self, proto_inst):
-        "@return a tuple (start, len)"
+        """
+        @return a tuple (start, end) with the byte offsets of proto_inst
+
+        >>> mpkt = MetaPacket(Ether() / IP() / TCP() / 'data')
+        >>> mpkt.get_protocol_bounds(mpkt.root[TCP])
+        (34, 54)
+        >>> mpkt.get_protocol_bounds(mpkt.root[Raw])
+        (54, 58)
+        """
 
         start = 0
         proto = self.root
@@ -274,6 +557,8 @@ class MetaPacket(object):
         @return True if reset is ok or False
         """
 
+        self.invalidate()
+
         protocol_found = False
         current = (startproto is not None) and (startproto) or (self.root)
 
@@ -321,16 +606,23 @@ class MetaPacket(object):
         return False
 
     def haslayer(self, layer):
-        return bool(self.root.haslayer(layer))
+        return bool(self.__peek().haslayer(layer))
 
     def getlayer(self, layer):
         return self.root.getlayer(layer)
 
     def get_raw(self):
-        return str(self.root)
+        "@return the packet bytes (built only once until the next change)"
+        if self._raw is not None:
+            return self._raw
+
+        if self._bytes is None:
+            self._bytes = str(self.__peek())
+
+        return self._bytes
 
     def get_raw_layer(self, layer):
-        return str(self.getlayer(layer))
+        return str(self.__peek().getlayer(layer))
 
     def rebuild_from_raw_payload(self, newpayload):
         log.debug('Rebuilding packet starting from %s' % \
@@ -346,22 +638,109 @@ class MetaPacket(object):
 
     # standard functions
     def get_datalink(self):
-        if isinstance(self.root, Ether):
+        if self._raw is not None:
+            cls = self._rawcls
+        else:
+            cls = self.__peek().__class__
+
+        if issubclass(cls, Ether):
             return IL_TYPE_ETH
-        if isinstance(self.root, RadioTap):
+        if issubclass(cls, RadioTap):
             return IL_TYPE_WIFI
         return None
 
+    def get_record(self):
+        """
+        @return a picklable tuple (raw, timestamp, datalink class) to pass
+                the packet to another process. new_from_raw(*record) gives
+                back the packet (without cfields and audit state).
+        """
+
+        if self._raw is not None:
+            return self._raw, self._rawtime, self._rawcls
+
+        root = self.__peek()
+        return self.get_raw(), root.time, root.__class__
+
+    def get_flow(self):
+        """
+        @return a tuple (protocol, endpoint, endpoint) that is the same for
+                the packets of a connection in both directions, or None for
+                the non IP packets. An endpoint is an (address, port) tuple.
+                The ports of the IP fragments are not used so that all the
+                fragments of a datagram have the same flow.
+
+        >>> req = MetaPacket(Ether() / IP(src='1.1.1.1', dst='2.2.2.2') / \
+                             TCP(sport=1024, dport=80))
+        >>> rep = MetaPacket(Ether() / IP(src='2.2.2.2', dst='1.1.1.1') / \
+                             TCP(sport=80, dport=1024))
+        >>> req.get_flow()
+        (6, ('1.1.1.1', 1024), ('2.2.2.2', 80))
+        >>> rep.get_flow() == req.get_flow()
+        True
+        """
+
+        l3 = l4 = None
+
+        if self._raw is not None and issubclass(self._rawcls, Ether):
+            headers = decode_headers(self._raw) or {}
+
+            for cls in FLOW_LAYERS:
+                if cls in headers:
+                    l3 = headers[cls][1]
+                    break
+
+            for cls in (TCP, UDP):
+                if cls in headers:
+                    l4 = headers[cls][1]
+                    break
+        else:
+            root = self.__peek()
+
+            for cls in FLOW_LAYERS:
+                layer = root.getlayer(cls)
+
+                if layer is not None:
+                    l3 = {}
+
+                    for name in ('src', 'dst', 'proto', 'nh', 'flags', 'frag'):
+                        value = getattr(layer, name, None)
+
+                        if value is not None:
+                            l3[name] = value
+                    break
+
+            for cls in (TCP, UDP):
+                layer = root.getlayer(cls)
+
+                if layer is not None:
+                    l4 = {'sport' : layer.sport, 'dport' : layer.dport}
+                    break
+
+        if l3 is None:
+            return None
+
+        proto = l3.get('proto', l3.get('nh'))
+        src, dst = (l3['src'], 0), (l3['dst'], 0)
+
+        if l4 is not None and \
+           not (int(l3.get('flags', 0)) & 1 or l3.get('frag', 0)):
+            src, dst = (l3['src'], l4['sport']), (l3['dst'], l4['dport'])
+
+        return proto, min(src, dst), max(src, dst)
+
     def reset_field(self, fieldname):
+        self.invalidate()
+
         try:
-            ret = fieldname.split('.')
-            layer = self.root.getlayer(global_trans[ret[0]][0])
+            fpath = compile_field(fieldname)
+            layer = self.root.getlayer(fpath.layer)
 
             if not layer:
                 return None
 
-            if len(ret) > 1:
-                delattr(layer, ret[1])
+            if fpath.names:
+                delattr(layer, fpath.names[0])
             else:
                 log.error('Cannot reset an entire protocol')
 
@@ -371,8 +750,10 @@ class MetaPacket(object):
             log.error(generate_traceback())
 
     def set_fields(self, proto, dict):
+        self.invalidate()
+
         try:
-            layer = self.root.getlayer(global_trans[proto][0])
+            layer = self.root.getlayer(compile_field(proto).layer)
 
             if not layer:
                 return None
@@ -392,20 +773,24 @@ class MetaPacket(object):
         if isinstance(value, MetaPacket):
             value = value.root
 
+        self.invalidate()
+
         try:
-            ret = fieldname.split('.')
-            layer = self.root.getlayer(global_trans[ret[0]][0])
+            fpath = compile_field(fieldname)
+            layer = self.root.getlayer(fpath.layer)
 
             if not layer:
                 return None
 
-            if len(ret) == 2:
-                setattr(layer, ret[1], value)
-            elif len(ret) == 3:
-                val = getattr(layer, ret[1])
+            names = fpath.names
+
+            if len(names) == 1:
+                setattr(layer, names[0], value)
+            elif len(names) == 2:
+                val = getattr(layer, names[0])
 
                 if val is not None:
-                    setattr(val, ret[2], value)
+                    setattr(val, names[1], value)
                 else:
                     raise Exception('Middle value is None')
             else:
@@ -416,9 +801,32 @@ class MetaPacket(object):
                       (fieldname, repr(value)))
             log.error(generate_traceback())
 
+    def __wrap(self, layer):
+        # The layers shared with other copies (see copy) must not be
+        # modified through the returned packet
+        if self._cow is not None:
+            layer = layer.copy()
+
+        return MetaPacket(layer)
+
     def get_fields(self, proto, tup):
+        """
+        @return a list with the values of the tup fields of proto. Values
+                that are scapy packets are returned as MetaPacket (a copy
+                if the layers are shared with other copies of this packet)
+        """
         try:
-            layer = self.root.getlayer(global_trans[proto][0])
+            fpath = compile_field(proto)
+
+            if self._audit is not None and self._audit.headers:
+                fields = self._audit.headers.get(fpath.layer, (None, {}))[1]
+
+                try:
+                    return [fields[key] for key in tup]
+                except KeyError:
+                    pass
+
+            layer = self.__peek().getlayer(fpath.layer)
 
             if not layer:
                 return (None, ) * len(tup)
@@ -429,7 +837,7 @@ class MetaPacket(object):
                 value = getattr(layer, key)
 
                 if isinstance(value, Packet):
-                    value = MetaPacket(value)
+                    value = self.__wrap(value)
 
                 out.append(value)
 
@@ -442,20 +850,33 @@ class MetaPacket(object):
 
     def get_field(self, fieldname, default=None):
         try:
-            ret = fieldname.split('.')
-            layer = self.root.getlayer(global_trans[ret[0]][0])
+            fpath = FIELD_PATHS.get(fieldname) or compile_field(fieldname)
+            names = fpath.names
+
+            if self._audit is not None and self._audit.headers and \
+               len(names) < 2:
+                entry = self._audit.headers.get(fpath.layer)
+
+                if entry is not None:
+                    if not names:
+                        if entry[0] is not None:
+                            return entry[0]
+                    elif names[0] in entry[1]:
+                        return entry[1][names[0]]
+
+            layer = self.__peek().getlayer(fpath.layer)
 
             if not layer:
                 return default
 
-            if len(ret) > 1:
-                val = getattr(layer, ret[1])
+            if names:
+                val = getattr(layer, names[0])
 
-                if len(ret) == 3 and val:
-                    val = getattr(val, ret[2])
+                if len(names) == 2 and val:
+                    val = getattr(val, names[1])
 
                 if isinstance(val, Packet):
-                    return MetaPacket(val)
+                    return self.__wrap(val)
 
                 if val is None:
                     return default
@@ -469,40 +890,49 @@ class MetaPacket(object):
             return default
 
     def copy(self, full=False):
-        if self.root:
-            cpy = MetaPacket(self.root.copy(),
-                             self.cfields.copy())
-        if full:
-            cpy.l2_proto = self.l2_proto
-            cpy.l2_src = self.l2_src
-            cpy.l2_dst = self.l2_dst
-            cpy.l2_len = self.l2_len
-
-            cpy.l3_src = self.l3_src
-            cpy.l3_dst = self.l3_dst
-            cpy.l3_proto = self.l3_proto
-            cpy.l3_len = self.l3_len
-
-            cpy.l4_src = self.l4_src
-            cpy.l4_dst = self.l4_dst
-            cpy.l4_ack = self.l4_ack
-            cpy.l4_seq = self.l4_seq
-            cpy.l4_flags = self.l4_flags
-            cpy.l4_proto = self.l4_proto
-            cpy.l4_len = self.l4_len
-
-            cpy.payload_len = self.payload_len
-
-            cpy.inject = self.inject
-            cpy.inject_len = self.inject_len
-            cpy.inj_delta = self.inj_delta
-
-            cpy.data = self.data
-            cpy.data_len = self.data_len
+        """
+        @param full True to copy also the decoders state
+        @return a copy of the packet sharing the scapy layers until one of
+                the two packets is modified
+
+        >>> mpkt = MetaPacket(Ether() / IP(ttl=1))
+        >>> cpy = mpkt.copy()
+        >>> cpy._root is mpkt._root
+        True
+        >>> cpy.set_field('ip.ttl', 2)
+        >>> mpkt.get_field('ip.ttl'), cpy.get_field('ip.ttl')
+        (1, 2)
+        """
+
+        cfields = self._cfields and self._cfields.copy()
+
+        if self._raw is not None:
+            cpy = MetaPacket.new_from_raw(self._raw, self._rawtime,
+                                          self._rawcls, cfields)
+            cpy.iface = self.iface
+        elif self._root is not None:
+            # Copy on write: the layers are duplicated only when one of
+            # the two packets is going to be modified (see get_root)
+            if self._cow is None:
+                self._cow = [1]
+
+            self._cow[0] += 1
+
+            cpy = MetaPacket(self._root, cfields)
+            cpy._cow = self._cow
+            cpy._bytes = self._bytes
+            cpy._display = self._display
+            cpy.iface = self.iface
+        if full and self._audit is not None:
+            # The session and the context are not copied
+            cpy._audit = self._audit.copy()
+            cpy._audit.session = None
+            cpy._audit.context = None
 
         return cpy
 
     def add_to(self, aft_proto, mpkt):
+        self.invalidate()
         self.root[global_trans[aft_proto][0]].payload = mpkt.root
 
     # Custom fields
@@ -515,3 +945,63 @@ class MetaPacket(object):
 
     def unset_cfield(self, name):
         del self.cfields[name]
+
+for name, default in AUDIT_ATTRIBUTES:
+    setattr(MetaPacket, name, audit_attribute(name, default))
+
+del name, default
+
+###############################################################################
+# Memory footprint
+###############################################################################
+
+# Max bytes of bookkeeping for every captured packet (64 bit)
+FOOTPRINT_TARGET = 160
+
+def get_footprint(mpkt):
+    """
+    @return the bytes used by mpkt for its bookkeeping (the raw bytes and
+            the scapy packet are not counted)
+    """
+
+    size = sys.getsizeof(mpkt)
+
+    if mpkt._cfields is not None:
+        size += sys.getsizeof(mpkt._cfields)
+
+    if mpkt._audit is not None:
+        size += sys.getsizeof(mpkt._audit)
+
+    if mpkt._display is not None:
+        size += sys.getsizeof(mpkt._display)
+
+    return size
+
+def measure_footprint(count=10000):
+    """
+    A simple benchmark creating count lazy packets like a sniff session
+    does without audits.
+
+    >>> measure_footprint() <= FOOTPRINT_TARGET
+    True
+
+    The decoders state is allocated only when used:
+
+    >>> mpkt = MetaPacket.new_from_raw('\\x00' * 60, 0)
+    >>> mpkt.l3_src, mpkt.has_audit_state()
+    (None, False)
+    >>> mpkt.l3_src = '10.0.0.1'
+    >>> mpkt.l3_src, mpkt.has_audit_state()
+    ('10.0.0.1', True)
+
+    @return the average bytes per packet
+    """
+
+    raw = '\x00' * 60
+    packets = [MetaPacket.new_from_raw(raw, idx) for idx in xrange(count)]
+
+    return sum([get_footprint(mpkt) for mpkt in packets]) / float(count)
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
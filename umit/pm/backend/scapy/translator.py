@@ -38,6 +38,9 @@ global_trans = {
     'raw' : (Raw, None),
 }
 
+if "IPv6" in globals():
+    global_trans['ipv6'] = (IPv6, None)
+
 if "SMBHeader" in globals():
     global_trans_smb = {
         'nbt' : (NBTSession, None),
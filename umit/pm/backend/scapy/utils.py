@@ -20,15 +20,22 @@
 
 import os
 import sys
+import gzip
+import time
+import bisect
+import array
+import struct
 import traceback
 
 import tempfile
 import subprocess
 
 from datetime import datetime
+from collections import deque
 from threading import Thread, Lock, Condition
 
 from umit.pm.core.logger import log
+from umit.pm.core.netconst import IL_TYPE_ETH, NL_TYPE_TCP, NL_TYPE_UDP
 from umit.pm.core.atoms import Node, ThreadPool, Interruptable, \
                           with_decorator, defaultdict
 
@@ -36,10 +43,27 @@ from umit.pm.manager.preferencemanager import Prefs
 
 from umit.pm.backend import VirtualIFace
 from umit.pm.backend.scapy.wrapper import *
-from umit.pm.backend.scapy.packet import MetaPacket
+from umit.pm.backend.scapy.packet import MetaPacket, compile_field
+from umit.pm.backend.scapy.headers import decode_headers
+from umit.pm.backend.scapy.capture import L2MmapListenSocket, \
+                                         FanoutCapture, RawPrefilter, \
+                                         mmap_listen, recv_batch, \
+                                         get_fanout_state, set_fanout_state, \
+                                         get_kernel_stats, StreamMerger, \
+                                         has_raw_recv
 
 import select
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
 if not WINDOWS:
     import fcntl
 else:
@@ -55,7 +79,7 @@ else:
 ###############################################################################
 
 def run_helper(helper_type, iface, filter=None, stop_count=0, stop_time=0, \
-               stop_size=0):
+               stop_size=0, stream=None):
     """
     Start an helper process for capturing
     @param helper is integer (0 to use tcpdump, 1 to use pcapdump)
@@ -64,10 +88,17 @@ def run_helper(helper_type, iface, filter=None, stop_count=0, stop_time=0, \
     @param stop_count stop process after n packets (tcpdump/dumpcap)
     @param stop_time stop process after n secs (dumpcap only)
     @param stop_size stop process after n bytes (dumpcap only)
-    @return a tuple (Popen object, outfile path)
+    @param stream True to read the pcap stream from the stdout of the helper
+                  instead of using a temporary file. None to use the
+                  backend.system.helper.stream preference
+    @return a tuple (Popen object, outfile path). outfile is None if the
+            helper is streaming over its stdout (see bind_reader)
     @see subprocess module for more information
     """
 
+    if stream is None:
+        stream = Prefs()['backend.system.helper.stream'].value
+
     if WINDOWS:
         log.debug('Ok we\'re in windows. Extracting idx from %s' % iface)
 
@@ -83,7 +114,10 @@ def run_helper(helper_type, iface, filter=None, stop_count=0, stop_time=0, \
         if stop_count:
             helper += "-c %d " % stop_count
 
-        helper += " -vU -i%s -w%s"
+        if stream:
+            helper += " -U -i%s -w%s"
+        else:
+            helper += " -vU -i%s -w%s"
 
         if filter:
             helper += " " + filter
@@ -102,6 +136,10 @@ def run_helper(helper_type, iface, filter=None, stop_count=0, stop_time=0, \
         if stop_size:
             helper += "-a filesize:%d " % stop_size / 1024
 
+        # Force libpcap format when writing on stdout
+        if stream:
+            helper += " -P"
+
         helper += " -i%s -w%s"
 
         if filter:
@@ -109,6 +147,23 @@ def run_helper(helper_type, iface, filter=None, stop_count=0, stop_time=0, \
 
         log.debug("I'm using dumpcap helper to capture packets")
 
+    if stream:
+        outfile = None
+
+        # Nobody reads the stderr in streaming mode so redirect it to avoid
+        # a full pipe that could block the helper.
+        process = subprocess.Popen(helper % (iface, '-'), shell=(not WINDOWS),
+                                   close_fds=(not WINDOWS),
+                                   stdout=subprocess.PIPE,
+                                   stderr=open(os.devnull, 'w'))
+
+        log.debug("Process spawned as `%s` with pid %d" % \
+                  ((helper % (iface, '-'), process.pid)))
+        log.debug("Helper started on interface %s. Streaming to stdout" % \
+                  iface)
+
+        return process, outfile
+
     outfile = tempfile.mktemp('.pcap', 'PM-')
 
     process = subprocess.Popen(helper % (iface, outfile), shell=(not WINDOWS),
@@ -166,12 +221,20 @@ def bind_reader(process, outfile, ts=0.5):
     This is generator returning None if the file is not ready, and a tuple
     (reader, file_size, position_callable) when it is.
 
+    If outfile is None the helper is streaming over its stdout and a
+    PcapStream is returned as reader (file_size is 0 in that case).
+
     @param process the process that generated the outfile or None
     @param outfile the file to poll
     @param ts the time to sleep while if object is not ready
     @return
     """
 
+    if outfile is None:
+        reader = bind_stream(process)
+        yield reader, 0, reader.tell
+        return
+
     if process:
         # 20 is the minimum header length for a pcap file
         while process.poll() is None and \
@@ -239,6 +302,202 @@ def get_n_packets(process):
     except:
         return -3
 
+class PcapStream(object):
+    """
+    An incremental pcap parser working on a pipe (like the stdout of an
+    helper started with run_helper in streaming mode).
+
+    Unlike PcapReader there is no need to poll a file on the disk: records
+    are parsed as soon as they are available on the pipe.
+    """
+
+    def __init__(self, fobj):
+        """
+        @param fobj a file object to read from (must have fileno)
+        """
+        self.fobj = fobj
+        self.fd = fobj.fileno()
+
+        self.buffer = ''
+        self.offset = 0
+        self.position = 0
+
+        self.eof = False
+        self.endian = None
+        self.linktype = None
+        self.LLcls = None
+        self.nsec = False
+
+        # A RawPrefilter applied before dissecting the packets
+        self.prefilter = None
+
+    def fileno(self):
+        return self.fd
+
+    def tell(self):
+        "@return the number of bytes consumed so far"
+        return self.position
+
+    def close(self):
+        self.fobj.close()
+
+    def __fill(self, timeout=None):
+        """
+        Read the bytes available on the pipe.
+
+        @param timeout max seconds to wait for data or None to block
+        @return False on timeout or EOF
+        """
+
+        if self.eof:
+            return False
+
+        if timeout is not None and not WINDOWS:
+            inp, out, err = select.select([self.fd], [], [], timeout)
+
+            if not inp:
+                return False
+
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError:
+            data = ''
+
+        if not data:
+            log.debug('EOF reached on the pcap stream')
+            self.eof = True
+            return False
+
+        self.buffer = self.buffer[self.offset:] + data
+        self.offset = 0
+
+        return True
+
+    def __consume(self, size, timeout=None):
+        while len(self.buffer) - self.offset < size:
+            if not self.__fill(timeout):
+                return None
+
+        data = self.buffer[self.offset:self.offset + size]
+        self.offset += size
+        self.position += size
+
+        return data
+
+    def read_header(self, timeout=None):
+        """
+        Parse the pcap global header.
+
+        @param timeout max seconds to wait for data or None to block
+        @return True if the header has been parsed
+        """
+
+        if self.linktype is not None:
+            return True
+
+        hdr = self.__consume(24, timeout)
+
+        if hdr is None:
+            return False
+
+        magic = hdr[:4]
+
+        if magic == "\xa1\xb2\xc3\xd4":
+            self.endian = ">"
+        elif magic == "\xd4\xc3\xb2\xa1":
+            self.endian = "<"
+        elif magic == "\xa1\xb2\x3c\x4d":
+            self.endian, self.nsec = ">", True
+        elif magic == "\x4d\x3c\xb2\xa1":
+            self.endian, self.nsec = "<", True
+        else:
+            raise Exception('Not a pcap capture stream (bad magic)')
+
+        vermaj, vermin, tz, sig, snaplen, linktype = \
+                struct.unpack(self.endian + "HHIIII", hdr[4:])
+
+        self.linktype = linktype
+
+        try:
+            self.LLcls = conf.l2types[linktype]
+        except KeyError:
+            log.warning('Unknown linktype %d. Using Raw' % linktype)
+            self.LLcls = Raw
+
+        return True
+
+    def read_raw(self, timeout=None):
+        """
+        @param timeout max seconds to wait for data or None to block
+        @return a tuple (raw bytes, timestamp) or None on EOF/timeout
+        """
+
+        if not self.read_header(timeout):
+            return None
+
+        hdr = self.__consume(16, timeout)
+
+        if hdr is None:
+            return None
+
+        sec, usec, caplen, wirelen = struct.unpack(self.endian + "IIII", hdr)
+        raw = self.__consume(caplen)
+
+        if raw is None:
+            return None
+
+        if self.nsec:
+            return raw, sec + 0.000000001 * usec
+
+        return raw, sec + 0.000001 * usec
+
+    def read_packet(self, timeout=None):
+        """
+        @param timeout max seconds to wait for data or None to block
+        @return a dissected packet or None on EOF/timeout
+        """
+
+        while True:
+            rec = self.read_raw(timeout)
+
+            if rec is None:
+                return None
+
+            raw, ts = rec
+
+            if not self.prefilter or self.prefilter(raw):
+                break
+
+        try:
+            pkt = self.LLcls(raw)
+        except:
+            pkt = Raw(raw)
+
+        pkt.time = ts
+        return pkt
+
+def bind_stream(process):
+    """
+    Create a PcapStream to handle the stdout of a process created by
+    run_helper in streaming mode. Blocks until the pcap header is read.
+
+    @param process the process helper created with run_helper
+    @return a PcapStream instance
+    """
+
+    reader = PcapStream(process.stdout)
+
+    if not reader.read_header():
+        process.poll()
+
+        raise Exception(
+                'Helper process died unexpectly with %s as returncode' % \
+                process.returncode)
+
+    log.debug("Pcap stream ready (linktype %d)" % reader.linktype)
+
+    return reader
+
 def get_iface_from_ip(metapacket):
     if metapacket.haslayer(IP):
         iff, a, gw = conf.route.route(metapacket.getlayer(IP).dst)
@@ -269,11 +528,263 @@ def get_socket_for(metapacket, want_layer_2=False, iff=None):
 
     return sock
 
+###############################################################################
+# Packet table
+###############################################################################
+
+class PacketTable(object):
+    """
+    A columnar table holding the fixed width metadata of a list of packets.
+    The row idx describes the packet idx of the list. Columns are NumPy
+    arrays if NumPy is available (array.array otherwise) so sorting and
+    selections are vectorised operations.
+
+    The flow column is a small integer shared by the packets of the same
+    connection (both directions).
+    """
+
+    COLUMNS = (
+        ('time', 'd'), ('size', 'I'), ('l3_proto', 'H'), ('l4_proto', 'B'),
+        ('src', 'I'), ('dst', 'I'), ('sport', 'H'), ('dport', 'H'),
+        ('flow', 'i'),
+    )
+
+    def __init__(self, capacity=4096):
+        """
+        @param capacity the initial number of rows allocated (NumPy only)
+        """
+        self.count = 0
+        self.flows = {}
+        self.columns = {}
+
+        for name, code in self.COLUMNS:
+            if numpy is not None:
+                self.columns[name] = numpy.zeros(capacity, dtype=code)
+            else:
+                self.columns[name] = array.array(code)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, name):
+        "@return the column name (a NumPy array or an array.array)"
+        return self.columns[name][:self.count]
+
+    def __grow(self):
+        for name, column in self.columns.items():
+            new = numpy.zeros(max(len(column) * 2, 1), dtype=column.dtype)
+            new[:len(column)] = column
+            self.columns[name] = new
+
+    def get_row(self, mpkt):
+        """
+        @return a tuple with the values of the columns for mpkt. The packets
+                not yet dissected are not dissected here.
+        """
+
+        src = dst = 0
+        sport = dport = None
+
+        if not mpkt.is_dissected() and mpkt.get_datalink() == IL_TYPE_ETH:
+            headers = decode_headers(mpkt.get_raw()) or {}
+
+            def get_fields(proto, names):
+                layer = compile_field(proto).layer
+                fields = headers.get(layer, (None, {}))[1]
+                return [fields.get(name) for name in names]
+        else:
+            get_fields = mpkt.get_fields
+
+        hwsrc, hwdst, l3 = get_fields('eth', ('src', 'dst', 'type'))
+        psrc, pdst, l4 = get_fields('ip', ('src', 'dst', 'proto'))
+
+        if psrc is None:
+            psrc, pdst = get_fields('arp', ('psrc', 'pdst'))
+
+        if l4 == NL_TYPE_TCP:
+            sport, dport = get_fields('tcp', ('sport', 'dport'))
+        elif l4 == NL_TYPE_UDP:
+            sport, dport = get_fields('udp', ('sport', 'dport'))
+
+        l3, l4 = l3 or 0, l4 or 0
+        sport, dport = sport or 0, dport or 0
+
+        if psrc is not None:
+            src = struct.unpack('!I', socket.inet_aton(psrc))[0]
+            dst = struct.unpack('!I', socket.inet_aton(pdst))[0]
+
+            a, b = (src, sport), (dst, dport)
+            key = (l3, l4, min(a, b), max(a, b))
+        elif hwsrc is not None:
+            key = (l3, min(hwsrc, hwdst), max(hwsrc, hwdst))
+        else:
+            key = (None, mpkt.hashret())
+
+        flow = self.flows.setdefault(key, len(self.flows))
+
+        return (mpkt.get_rawtime(), mpkt.get_size(), l3, l4, src, dst,
+                sport, dport, flow)
+
+    def append(self, mpkt):
+        row = self.get_row(mpkt)
+
+        if numpy is not None:
+            if self.count == len(self.columns['time']):
+                self.__grow()
+
+            for (name, code), value in zip(self.COLUMNS, row):
+                self.columns[name][self.count] = value
+        else:
+            for (name, code), value in zip(self.COLUMNS, row):
+                self.columns[name].append(value)
+
+        # Readers see the row only once it is complete
+        self.count += 1
+
+    def extend(self, mpkts):
+        for mpkt in mpkts:
+            self.append(mpkt)
+
+    def select(self, **values):
+        """
+        @param values column=value pairs that the rows must match
+        @return the indexes of the matching rows
+
+        >>> table = PacketTable()
+        >>> table.extend([MetaPacket(Ether() / IP() / TCP(dport=dport)) \
+                          for dport in (22, 80, 22)])
+        >>> table.extend([MetaPacket(Ether() / IP() / ICMP()),
+        ...               MetaPacket(Ether() / ARP(psrc='1.1.1.1'))])
+        >>> list(table.select(dport=22))
+        [0, 2]
+        >>> list(table.select(l4_proto=1))
+        [3]
+        >>> list(table.select(src=0x01010101, sport=0))
+        [4]
+        """
+
+        if numpy is not None:
+            mask = numpy.ones(self.count, dtype=bool)
+
+            for name, value in values.items():
+                mask &= (self[name] == value)
+
+            return numpy.nonzero(mask)[0]
+
+        columns = [(self.columns[name], value) \
+                   for name, value in values.items()]
+
+        return [idx for idx in xrange(self.count) \
+                if not [1 for column, value in columns \
+                        if column[idx] != value]]
+
+    def select_time(self, start=None, stop=None):
+        "@return the indexes of the rows with start <= time < stop"
+
+        times = self['time']
+
+        if numpy is not None:
+            mask = numpy.ones(self.count, dtype=bool)
+
+            if start is not None:
+                mask &= (times >= start)
+            if stop is not None:
+                mask &= (times < stop)
+
+            return numpy.nonzero(mask)[0]
+
+        return [idx for idx, ts in enumerate(times) \
+                if (start is None or ts >= start) and \
+                   (stop is None or ts < stop)]
+
+    def sort(self, name, reverse=False):
+        "@return the indexes of the rows sorted by the column name (stable)"
+
+        if numpy is not None:
+            order = numpy.argsort(self[name], kind='mergesort')
+        else:
+            column = self.columns[name]
+            order = sorted(xrange(self.count), key=column.__getitem__)
+
+        if reverse:
+            return order[::-1]
+
+        return order
+
+    def group_flows(self):
+        """
+        @return a list of lists of indexes, one for every flow, ordered by
+                the first packet of the flow
+        """
+
+        flows = self['flow']
+
+        if numpy is not None and self.count:
+            order = numpy.argsort(flows, kind='mergesort')
+            bounds = numpy.nonzero(numpy.diff(flows[order]))[0] + 1
+            groups = numpy.split(order, bounds)
+            groups.sort(key=lambda group: group[0])
+
+            return [group.tolist() for group in groups]
+
+        groups = {}
+
+        for idx, flow in enumerate(flows):
+            groups.setdefault(flow, []).append(idx)
+
+        return sorted(groups.values())
+
+    def get_statistics(self):
+        """
+        @return a dict with the number of packets (count), the total bytes
+                (bytes), the capture interval (start, stop) and the number
+                of packets for every L4 protocol (protocols)
+        """
+
+        if not self.count:
+            return {'count' : 0, 'bytes' : 0, 'start' : None, 'stop' : None,
+                    'protocols' : {}}
+
+        times = self['time']
+        protos = self['l4_proto']
+
+        if numpy is not None:
+            counts = numpy.bincount(protos)
+            protocols = dict([(int(proto), int(counts[proto])) \
+                              for proto in numpy.nonzero(counts)[0]])
+
+            return {'count' : self.count, 'bytes' : int(self['size'].sum()),
+                    'start' : float(times.min()), 'stop' : float(times.max()),
+                    'protocols' : protocols}
+
+        protocols = defaultdict(int)
+
+        for proto in protos:
+            protocols[proto] += 1
+
+        return {'count' : self.count, 'bytes' : sum(self['size']),
+                'start' : min(times), 'stop' : max(times),
+                'protocols' : dict(protocols)}
+
 ###############################################################################
 # Analyze functions
 ###############################################################################
 
-def analyze_connections(pktlist, strict=False):
+def analyze_connections(pktlist, strict=False, table=None):
+    """
+    Group the packets by connection.
+
+    @param pktlist a list of MetaPacket
+    @param strict True to use answers() to match the packets
+    @param table a PacketTable describing pktlist. If given (and strict is
+                 False) the packets are grouped with the flow column
+    @return a list of tuples (first packet, list of the other packets)
+    """
+
+    if table is not None and not strict and len(table) == len(pktlist):
+        return [(pktlist[group[0]], [pktlist[idx] for idx in group[1:]]) \
+                for group in table.group_flows()]
+
     # Doesn't work with strict = True :(
     # but without strict is also more speedy so :)
 
@@ -361,10 +872,14 @@ def reset_routes(to=None):
 def find_all_devs(capmethod=0):
     """
     @param capmethod 0 for standard method, 1 for virtual interface,
-                     2 for tcpdump/windump, 3 for dumpcap helper.
+                     2 for tcpdump/windump, 3 for dumpcap helper, 4 for
+                     PACKET_MMAP ring (Linux only, falls back to standard).
     @return a list containing VirtualIFace objects
     """
 
+    if capmethod == 4 and not getattr(socket, 'AF_PACKET', None):
+        log.debug('PACKET_MMAP not available. Standard method will be used')
+
     if capmethod == 1:
         # This is virtual interface so the list will contain a dummy
         # VirtualIFace entry
@@ -440,6 +955,768 @@ def find_all_devs(capmethod=0):
 
         return ret
 
+class PacketRing(object):
+    """
+    A list-like container used by SniffContext in ring buffer mode.
+
+    Only the newest packets are kept in memory (bounded by max_packets and/or
+    max_bytes). Older packets are streamed into rotating pcap files (like the
+    -b option of dumpcap) and paged back on demand when accessed by index.
+
+    Indexes are absolute: the first packet ever appended is always at index
+    0 unless its spill file has been deleted because of spill_files.
+    """
+
+    def __init__(self, max_packets=0, max_bytes=0, spill_size=0, \
+                 spill_time=0, spill_files=0):
+        """
+        @param max_packets max number of packets to keep in memory (0 no limit)
+        @param max_bytes max number of bytes to keep in memory (0 no limit)
+        @param spill_size rotate the spill file after n bytes (0 no rotation)
+        @param spill_time rotate the spill file after n secs (0 no rotation)
+        @param spill_files max number of spill files to keep on disk. The
+                           oldest ones are deleted (0 to keep all of them)
+        """
+
+        self.max_packets = max_packets
+        self.max_bytes = max_bytes
+        self.spill_size = spill_size
+        self.spill_time = spill_time
+        self.spill_files = spill_files
+
+        self.lock = Lock()
+
+        self.window = deque()
+        self.sizes = deque()
+        self.window_bytes = 0
+
+        # Absolute index of window[0] and number of packets lost because
+        # their spill file was deleted
+        self.first = 0
+        self.lost = 0
+
+        # A list of [path, first_idx, count] for every spill file
+        self.spills = []
+
+        self.writer = None
+        self.writer_size = 0
+        self.writer_time = 0
+
+        # The last spill file paged in as (path, count) tuple
+        self.cache_key = None
+        self.cache = []
+
+    def __len__(self):
+        return self.first + len(self.window)
+
+    def __iter__(self):
+        for idx in xrange(self.lost, len(self)):
+            try:
+                yield self[idx]
+            except IndexError:
+                continue
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            return self.get_range(max(start, self.lost), stop, step)
+
+        self.lock.acquire()
+
+        try:
+            if idx < 0:
+                idx += self.first + len(self.window)
+
+            if idx >= self.first:
+                return self.window[idx - self.first]
+
+            return self.__page_in(idx)
+        finally:
+            self.lock.release()
+
+    def get_range(self, start, stop, step=1):
+        """
+        @return a list containing the packets between start and stop. The
+                packets no longer available (spill file deleted) are
+                skipped so the list could be shorter than expected
+        """
+        ret = []
+
+        for idx in xrange(start, stop, step):
+            try:
+                ret.append(self[idx])
+            except IndexError:
+                continue
+
+        return ret
+
+    def get_spill_files(self):
+        "@return a list of (path, first_idx, count) for the spill files"
+        return [tuple(spill) for spill in self.spills]
+
+    def append(self, mpkt):
+        self.lock.acquire()
+
+        try:
+            size = 0
+
+            if self.max_bytes:
+                size = mpkt.get_size()
+
+            self.window.append(mpkt)
+            self.sizes.append(size)
+            self.window_bytes += size
+
+            while self.window and \
+                  (self.max_packets and len(self.window) > self.max_packets or \
+                   self.max_bytes and self.window_bytes > self.max_bytes):
+
+                self.__spill(self.window.popleft())
+                self.window_bytes -= self.sizes.popleft()
+                self.first += 1
+        finally:
+            self.lock.release()
+
+    def close(self):
+        """
+        Close the current spill file and remove all the spill files from
+        the disk.
+        """
+        self.lock.acquire()
+
+        try:
+            if self.writer:
+                self.writer.close()
+                self.writer = None
+
+            for path, first_idx, count in self.spills:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+            self.spills = []
+            self.cache_key = None
+            self.cache = []
+        finally:
+            self.lock.release()
+
+    def __rotate(self):
+        if self.writer:
+            self.writer.close()
+
+        path = tempfile.mktemp('.pcap', 'PM-ring-')
+
+        log.debug('Spilling old packets to %s' % path)
+
+        self.writer = PcapWriter(path)
+        self.writer_size = 0
+        self.writer_time = time.time()
+        self.spills.append([path, self.first, 0])
+
+        if self.spill_files and len(self.spills) > self.spill_files:
+            path, first_idx, count = self.spills.pop(0)
+            self.lost = first_idx + count
+
+            log.debug('Removing the oldest spill file %s (%d packets lost)' % \
+                      (path, count))
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def __spill(self, mpkt):
+        if not self.writer or \
+           self.spill_size and self.writer_size >= self.spill_size or \
+           self.spill_time and \
+           time.time() - self.writer_time >= self.spill_time:
+
+            self.__rotate()
+
+        raw = mpkt.get_raw()
+
+        write_metapacket(self.writer, mpkt)
+        self.writer_size += len(raw) + 16
+        self.spills[-1][2] += 1
+
+    def __page_in(self, idx):
+        for path, first_idx, count in self.spills:
+            if idx < first_idx or idx >= first_idx + count:
+                continue
+
+            if self.cache_key != (path, count):
+                if self.writer and path == self.spills[-1][0]:
+                    self.writer.flush()
+
+                log.debug('Paging in packets from %s' % path)
+
+                # The packets are dissected only when drawn or selected
+                pcap = LazyPcap(path)
+
+                try:
+                    self.cache = [MetaPacket.new_from_raw(raw, ts, pcap.LLcls)
+                                  for raw, ts in pcap.read_records(24, count)]
+                finally:
+                    pcap.close()
+
+                self.cache_key = (path, count)
+
+            return self.cache[idx - first_idx]
+
+        raise IndexError('packet %d is not available anymore' % idx)
+
+###############################################################################
+# Record only mode
+###############################################################################
+
+PCAP_RECORD = struct.Struct("IIII")
+
+def write_metapacket(writer, mpkt):
+    """
+    Append mpkt to a scapy PcapWriter. Unlike writer.write() the bytes of
+    the packet are taken from get_raw() so a captured or already built
+    packet is not built again.
+
+    @param writer a PcapWriter instance
+    @param mpkt a MetaPacket
+    """
+
+    if not writer.header_present:
+        writer._write_header(mpkt.root)
+
+    raw = mpkt.get_raw()
+    ts = mpkt.get_rawtime()
+    sec = int(ts)
+
+    writer.f.write(struct.pack(writer.endian + "IIII", sec,
+                               int((ts - sec) * 1000000), len(raw), len(raw)))
+    writer.f.write(raw)
+
+class PcapRecorder(object):
+    """
+    Write raw frames to a pcap (or pcap.gz) file without dissecting them.
+
+    Records are collected in memory and written with a single write() call
+    once bufsize bytes are pending. A sparse index (packet number, offset,
+    timestamp) is kept every index_step packets and saved next to the
+    capture file (see INDEX_SUFFIX) to open it lazily with LazyPcap.
+    """
+
+    INDEX_SUFFIX = '.idx'
+
+    def __init__(self, path, linktype=1, snaplen=65535, bufsize=1 << 20, \
+                 index_step=1024):
+        """
+        @param path the file to write (gzip compressed if ends with .gz)
+        @param linktype the datalink type of the frames
+        @param snaplen the max number of bytes saved for every frame
+        @param bufsize the number of bytes buffered before writing
+        @param index_step add an index entry every index_step packets
+        @raise IOError if the file could not be opened
+        """
+
+        self.path = path
+        self.linktype = linktype
+        self.snaplen = snaplen
+        self.bufsize = bufsize
+        self.index_step = index_step
+
+        if path.endswith('.gz'):
+            # Compression is the bottleneck here so use the fastest level
+            self.fobj = gzip.open(path, 'wb', 1)
+        else:
+            self.fobj = open(path, 'wb')
+
+        self.chunks = []
+        self.buffered = 0
+
+        # Offsets are relative to the uncompressed stream
+        self.offset = 24
+        self.count = 0
+        self.size = 0
+
+        self.index = []
+
+        self.fobj.write(struct.pack("IHHIIII", 0xa1b2c3d4, 2, 4, 0, 0,
+                                    snaplen, linktype))
+
+    def write(self, raw, ts):
+        """
+        Add a raw frame
+        @param raw the bytes of the frame
+        @param ts the timestamp of the frame
+        """
+
+        if self.count % self.index_step == 0:
+            self.index.append((self.count, self.offset, ts))
+
+        wirelen = len(raw)
+
+        if wirelen > self.snaplen:
+            raw = raw[:self.snaplen]
+
+        sec = int(ts)
+        caplen = len(raw)
+
+        self.chunks.append(PCAP_RECORD.pack(sec, int((ts - sec) * 1000000),
+                                            caplen, wirelen))
+        self.chunks.append(raw)
+
+        self.count += 1
+        self.size += wirelen
+        self.offset += 16 + caplen
+        self.buffered += 16 + caplen
+
+        if self.buffered >= self.bufsize:
+            self.flush()
+
+    def flush(self):
+        "Write the pending records"
+
+        if self.chunks:
+            self.fobj.write(''.join(self.chunks))
+            self.chunks = []
+            self.buffered = 0
+
+        self.fobj.flush()
+
+    def close(self):
+        "Flush the pending records and save the index"
+
+        if not self.fobj:
+            return
+
+        self.flush()
+        self.fobj.close()
+        self.fobj = None
+
+        try:
+            save_pcap_index(self.path + self.INDEX_SUFFIX, self.count,
+                            self.linktype, self.index)
+        except IOError, err:
+            log.warning('Unable to save the index of %s (%s)' % \
+                        (self.path, str(err)))
+
+def save_pcap_index(path, count, linktype, index):
+    """
+    Save a sparse index of a pcap file
+    @param path the index file
+    @param count the total number of packets
+    @param linktype the datalink type
+    @param index a list of (packet number, offset, timestamp) tuples
+    """
+
+    fobj = open(path, 'w')
+
+    try:
+        fobj.write('%d %d\n' % (count, linktype))
+
+        for idx, offset, ts in index:
+            fobj.write('%d %d %.6f\n' % (idx, offset, ts))
+    finally:
+        fobj.close()
+
+def load_pcap_index(path):
+    """
+    Load an index saved with save_pcap_index
+    @return a tuple (count, linktype, index) or None
+    """
+
+    try:
+        fobj = open(path, 'r')
+    except IOError:
+        return None
+
+    try:
+        try:
+            count, linktype = map(int, fobj.readline().split())
+            index = []
+
+            for line in fobj:
+                idx, offset, ts = line.split()
+                index.append((int(idx), int(offset), float(ts)))
+
+            return count, linktype, index
+        except ValueError:
+            log.warning('Corrupted pcap index %s' % path)
+            return None
+    finally:
+        fobj.close()
+
+class LazyPcap(object):
+    """
+    A read-only list-like view of a pcap (or pcap.gz) file. Packets are
+    read and dissected only when accessed. The sparse index written by
+    PcapRecorder is used to seek near the requested packet. Without an
+    index the file headers are scanned once (without dissecting).
+    """
+
+    def __init__(self, path):
+        """
+        @param path the pcap file
+        @raise IOError if the file could not be read
+        """
+
+        self.path = path
+        self.lock = Lock()
+
+        fobj = open(path, 'rb')
+
+        if fobj.read(2) == '\x1f\x8b':
+            fobj.close()
+            fobj = gzip.open(path, 'rb')
+        else:
+            fobj.seek(0)
+
+        self.fobj = fobj
+
+        magic = fobj.read(4)
+
+        if magic == "\xa1\xb2\xc3\xd4":
+            self.endian, self.nsec = ">", False
+        elif magic == "\xd4\xc3\xb2\xa1":
+            self.endian, self.nsec = "<", False
+        elif magic == "\xa1\xb2\x3c\x4d":
+            self.endian, self.nsec = ">", True
+        elif magic == "\x4d\x3c\xb2\xa1":
+            self.endian, self.nsec = "<", True
+        else:
+            fobj.close()
+            raise IOError(-1, 'Not a pcap file (bad magic)')
+
+        vermaj, vermin, tz, sig, snaplen, self.linktype = \
+                struct.unpack(self.endian + "HHIIII", fobj.read(20))
+
+        try:
+            self.LLcls = conf.l2types[self.linktype]
+        except KeyError:
+            log.warning('Unknown linktype %d. Using Raw' % self.linktype)
+            self.LLcls = Raw
+
+        self.record = struct.Struct(self.endian + "IIII")
+
+        # Number of the next packet and its offset
+        self.cursor = (0, 24)
+
+        ret = load_pcap_index(path + PcapRecorder.INDEX_SUFFIX)
+
+        if ret:
+            self.count, linktype, self.index = ret
+        else:
+            self.count, self.index = None, []
+
+        self.keys = [entry[0] for entry in self.index]
+
+    def close(self):
+        self.fobj.close()
+
+    def __len__(self):
+        if self.count is None:
+            self.build_index()
+
+        return self.count
+
+    def build_index(self, step=1024):
+        """
+        Scan the record headers and rebuild the sparse index with an entry
+        (number, offset, seconds) every step packets.
+        """
+
+        self.lock.acquire()
+
+        try:
+            self.__build_index(step)
+        finally:
+            self.lock.release()
+
+    def __build_index(self, step):
+        log.debug('Building the index of %s' % self.path)
+
+        self.fobj.seek(24)
+
+        idx, offset = 0, 24
+        self.index = []
+
+        while True:
+            hdr = self.fobj.read(16)
+
+            if len(hdr) < 16:
+                break
+
+            sec, usec, caplen, wirelen = self.record.unpack(hdr)
+
+            if idx % step == 0:
+                self.index.append((idx, offset, sec))
+
+            self.fobj.seek(caplen, 1)
+
+            idx += 1
+            offset += 16 + caplen
+
+        self.count = idx
+        self.keys = [entry[0] for entry in self.index]
+        self.cursor = (0, 24)
+        self.fobj.seek(24)
+
+    def __seek(self, idx):
+        if self.cursor[0] == idx:
+            return
+
+        pos = bisect.bisect_right(self.keys, idx) - 1
+
+        if pos >= 0 and \
+           not (self.cursor[0] < idx and self.keys[pos] <= self.cursor[0]):
+            first, offset = self.index[pos][:2]
+            self.fobj.seek(offset)
+        elif self.cursor[0] < idx:
+            first = self.cursor[0]
+        else:
+            first = 0
+            self.fobj.seek(24)
+
+        while first < idx:
+            hdr = self.fobj.read(16)
+
+            if len(hdr) < 16:
+                raise IndexError('packet %d is not in %s' % (idx, self.path))
+
+            self.fobj.seek(self.record.unpack(hdr)[2], 1)
+            first += 1
+
+        self.cursor = (idx, self.fobj.tell())
+
+    def __read_record(self):
+        hdr = self.fobj.read(16)
+
+        if len(hdr) < 16:
+            return None
+
+        sec, usec, caplen, wirelen = self.record.unpack(hdr)
+        raw = self.fobj.read(caplen)
+
+        if self.nsec:
+            ts = sec + 0.000000001 * usec
+        else:
+            ts = sec + 0.000001 * usec
+
+        return raw, ts
+
+    def __read(self):
+        ret = self.__read_record()
+
+        if ret is None:
+            return None
+
+        raw, ts = ret
+        self.cursor = (self.cursor[0] + 1, self.cursor[1] + 16 + len(raw))
+
+        return MetaPacket.new_from_raw(raw, ts, self.LLcls)
+
+    def read_records(self, offset, count):
+        """
+        Read the records without dissecting them.
+
+        @param offset the file offset of the first record (see index)
+        @param count the number of records to read
+        @return a list of at most count (raw, timestamp) tuples
+        """
+
+        records = []
+
+        self.lock.acquire()
+
+        try:
+            self.fobj.seek(offset)
+
+            while len(records) < count:
+                ret = self.__read_record()
+
+                if ret is None:
+                    break
+
+                records.append(ret)
+
+            # Leave the file where __seek expects it
+            self.fobj.seek(self.cursor[1])
+        finally:
+            self.lock.release()
+
+        return records
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in xrange(*idx.indices(len(self)))]
+
+        if idx < 0:
+            idx += len(self)
+
+        if idx < 0:
+            raise IndexError('packet index out of range')
+
+        self.lock.acquire()
+
+        try:
+            self.__seek(idx)
+            mpkt = self.__read()
+        finally:
+            self.lock.release()
+
+        if mpkt is None:
+            raise IndexError('packet index out of range')
+
+        return mpkt
+
+    def __iter__(self):
+        idx = 0
+
+        while True:
+            try:
+                yield self[idx]
+            except IndexError:
+                break
+
+            idx += 1
+
+###############################################################################
+# Bulk decoding
+###############################################################################
+
+def decode_range(args):
+    """
+    Worker procedure of bulk_decode. It's a module level function because it
+    has to be pickled by multiprocessing.
+
+    @param args a tuple (path, offset, count)
+    @return a list of (raw, timestamp, display) tuples where display is the
+            tuple returned by MetaPacket.get_display()
+    """
+
+    path, offset, count = args
+    pcap = LazyPcap(path)
+
+    try:
+        records = []
+
+        for raw, ts in pcap.read_records(offset, count):
+            mpkt = MetaPacket.new_from_raw(raw, ts, pcap.LLcls)
+            records.append((raw, ts, mpkt.get_display()))
+
+        return records
+    finally:
+        pcap.close()
+
+def bulk_decode(path, workers=None, chunk=8192, callback=None):
+    """
+    Dissect a pcap file with a pool of worker processes. The file is split
+    in ranges of chunk records that are dissected by the workers. Only the
+    raw bytes, the timestamp and the display strings come back so the
+    returned packets are lazy but the packet list doesn't need to dissect
+    them to be drawn. The order is the same of the file.
+
+    @param path the pcap file
+    @param workers the number of processes (None for one per cpu). With 1
+                   the ranges are decoded in this process
+    @param chunk the number of records of every range
+    @param callback called as callback(decoded, total) after every range
+    @return a tuple (list of MetaPacket, linktype)
+    @raise IOError if the file could not be read
+
+    The result is the same of the serial PcapReader loop:
+
+    >>> import glob
+    >>> tests = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    ...                      '..', '..', '..', '..', 'audits', 'pcap-tests')
+    >>> [os.path.basename(path)
+    ...  for path in sorted(glob.glob(os.path.join(tests, '*.pcap')))
+    ...  if check_bulk_decode(path, 2, 16)]
+    []
+    """
+
+    pcap = LazyPcap(path)
+
+    try:
+        pcap.build_index(chunk)
+        count, linktype, LLcls = pcap.count, pcap.linktype, pcap.LLcls
+
+        bounds = [entry[:2] for entry in pcap.index] + [(count, None)]
+        tasks = [(path, offset, bounds[pos + 1][0] - idx) \
+                 for pos, (idx, offset) in enumerate(bounds[:-1])]
+    finally:
+        pcap.close()
+
+    if workers is None:
+        workers = multiprocessing and multiprocessing.cpu_count() or 1
+
+    pool = None
+
+    if multiprocessing and workers > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(workers, len(tasks)))
+        results = pool.imap(decode_range, tasks)
+    else:
+        results = (decode_range(task) for task in tasks)
+
+    packets = []
+
+    try:
+        for records in results:
+            for raw, ts, display in records:
+                packets.append(MetaPacket.new_from_raw(raw, ts, LLcls,
+                                                       display=display))
+
+            if callback:
+                callback(len(packets), count)
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+
+    return packets, linktype
+
+def check_bulk_decode(path, workers=2, chunk=1024):
+    """
+    Compare bulk_decode with the serial PcapReader loop of StaticContext.
+
+    @return a list of strings describing the mismatches
+    """
+
+    errors = []
+    packets = bulk_decode(path, workers, chunk)[0]
+
+    reader = PcapReader(path)
+
+    try:
+        idx = 0
+
+        while True:
+            p = reader.read_packet()
+
+            if p is None:
+                break
+
+            if idx >= len(packets):
+                errors.append('%d: missing' % idx)
+                break
+
+            mpkt = MetaPacket(PacketList([p])[0])
+
+            if mpkt.get_time() != packets[idx].get_time():
+                errors.append('%d: time %s instead of %s' % \
+                              (idx, packets[idx].get_time(), mpkt.get_time()))
+
+            if mpkt.get_display() != packets[idx].get_display():
+                errors.append('%d: %r instead of %r' % \
+                      (idx, packets[idx].get_display(), mpkt.get_display()))
+
+            idx += 1
+    finally:
+        reader.close()
+
+    if len(packets) > idx:
+        errors.append('%d: %d packets more' % (idx, len(packets) - idx))
+
+    return errors
+
 ###############################################################################
 # Send Context functions
 ###############################################################################
@@ -623,10 +1900,18 @@ class SendReceiveConsumer(Interruptable):
             packet_hash = packet.hashret()
 
             while self.running:
-                while report_idx < reported_packets:
-                    report_idx = get_n_packets(self.process)
+                if self.outfile is None:
+                    # Streaming helper. Use a short timeout to periodically
+                    # check the running flag.
+                    r = reader.read_packet(1.0)
 
-                r = reader.read_packet()
+                    if r is None and reader.eof:
+                        break
+                else:
+                    while report_idx < reported_packets:
+                        report_idx = get_n_packets(self.process)
+
+                    r = reader.read_packet()
 
                 try:
                     # The helper capture packets at L2 so we need to drop the
@@ -997,10 +2282,23 @@ class SequenceConsumer(Interruptable):
                     log.debug("Timeout here!")
                     break
 
-            while report_idx < reported_packets:
-                report_idx = get_n_packets(self.process)
+            if outfile is None:
+                # Streaming helper. Use a short timeout to periodically
+                # check the running flag and the requested timeout.
+                wait = 1.0
+
+                if self.timeout is not None:
+                    wait = min(remain, wait)
+
+                r = reader.read_packet(wait)
 
-            r = reader.read_packet()
+                if r is None and reader.eof:
+                    break
+            else:
+                while report_idx < reported_packets:
+                    report_idx = get_n_packets(self.process)
+
+                r = reader.read_packet()
 
             try:
                 # The helper capture packets at L2 so we need to drop the
@@ -1341,3 +2639,7 @@ def execute_sequence(sequence, count, inter, iface, strict, capmethod, \
     consumer.start()
 
     return consumer
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -98,8 +98,22 @@ def load_scapy_protocols():
 
     return ret
 
+def index_protocols(protos):
+    """
+    @return a dict mapping both the name and the class name of the protocols
+            to the classes. On clashes the first protocol wins.
+    """
+    index = {}
+
+    for proto in protos:
+        index.setdefault(proto.name, proto)
+        index.setdefault(proto.__name__, proto)
+
+    return index
+
 # We use this global variable to track protocols
 gprotos = load_scapy_protocols()
+gprotos_index = index_protocols(gprotos)
 
 log.debug("%d protocols registered." % len(gprotos))
 
@@ -120,14 +134,11 @@ def get_proto_name(proto_inst):
     return get_proto_class_name(proto_inst)
 
 def get_proto(proto_name):
-    for proto in gprotos:
-        if proto.name == proto_name:
-            return proto
-        if proto.__name__ == proto_name:
-            return proto
-
-    print "Protocol named %s not found." % proto_name
-    return None
+    try:
+        return gprotos_index[proto_name]
+    except KeyError:
+        print "Protocol named %s not found." % proto_name
+        return None
 
 def get_proto_layer(proto):
     return getattr(proto, '_pm_layer', None)
@@ -146,12 +157,10 @@ def get_proto_fields(proto_inst):
 
 def get_proto_size(proto_inst):
     """@return the size of the entire protocol in bits"""
-    size = 0
+    if not isinstance(proto_inst, Packet):
+        return 0
 
-    for field in get_proto_fields(proto_inst):
-        size += get_field_size(proto_inst, field)
-
-    return size
+    return get_proto_layout(proto_inst).get_size(proto_inst)
 
 def get_proto_field(proto_inst, name):
     for f in get_proto_fields(proto_inst):
@@ -227,18 +236,15 @@ def get_field_offset(packet, proto, field):
     child = packet.root
 
     while not isinstance(child, NoPayload) and proto != child:
-        for f in child.fields_desc:
-            bits += get_field_size(child, f)
-
+        bits += get_proto_size(child)
         child = child.payload
 
-    for f in child.fields_desc:
-        if field == f:
-            return bits
+    offset = get_proto_layout(child).get_offset(child, field)
 
-        bits += get_field_size(child, f)
+    if offset is None:
+        raise Exception('Field or protocol is not present in the packet')
 
-    raise Exception('Field or protocol is not present in the packet')
+    return bits + offset
 
 def get_field_enumeration_s2i(field):
     return field.s2i.items()
@@ -258,6 +264,89 @@ def is_field_autofilled(field):
 def is_default_field(proto_inst, field):
     return get_field_value(proto_inst, field) == field.default
 
+###############################################################################
+# Field layouts
+###############################################################################
+
+class FieldLayout(object):
+    """
+    The fields_desc of a protocol class with the sizes known in advance.
+    Only the size of the variable length fields (StrField) is computed on
+    the protocol instance.
+    """
+
+    __slots__ = ('desc', 'size', 'variable', 'offsets')
+
+    def __init__(self, desc):
+        self.desc = desc
+
+        # Bits of the fixed size fields and the variable length fields
+        self.size = 0
+        self.variable = []
+
+        # id(field) -> (fixed bits before, number of variable fields before)
+        self.offsets = {}
+
+        for field in desc:
+            self.offsets.setdefault(id(field), (self.size, len(self.variable)))
+
+            if isinstance(field, StrField):
+                self.variable.append(field)
+                continue
+
+            try:
+                self.size += get_field_size(None, field)
+            except AttributeError:
+                self.variable.append(field)
+
+    def get_size(self, proto):
+        """@return the size of proto in bits"""
+        bits = self.size
+
+        for field in self.variable:
+            bits += get_field_size(proto, field)
+
+        return bits
+
+    def get_offset(self, proto, field):
+        """@return the offset in bits of field inside proto or None"""
+        try:
+            bits, count = self.offsets[id(field)]
+        except KeyError:
+            return None
+
+        for var in self.variable[:count]:
+            bits += get_field_size(proto, var)
+
+        return bits
+
+# protocol class -> FieldLayout
+_layouts = {}
+
+def get_proto_layout(proto):
+    """
+    @param proto a protocol class or instance
+    @return the FieldLayout of proto (cached per class)
+    """
+    if isinstance(proto, type):
+        cls = proto
+    else:
+        cls = proto.__class__
+
+    desc = proto.fields_desc
+    layout = _layouts.get(cls, None)
+
+    if layout is not None and layout.desc is desc:
+        return layout
+
+    layout = FieldLayout(desc)
+
+    # Instances with their own fields_desc are not cached
+    if desc is cls.fields_desc:
+        _layouts[cls] = layout
+
+    return layout
+
 ###############################################################################
 # Flag fields functions
 ###############################################################################
@@ -25,6 +25,7 @@ program
 
 import sys
 import copy
+import time
 import Queue
 import threading
 
@@ -474,6 +475,70 @@ class Singleton(object):
             cls.__init__ = nothing
         return Singleton.instances[cls]
 
+class RateMeter(object):
+    """
+    Track packets/s and bytes/s over a sliding window of n seconds
+    """
+
+    def __init__(self, window=5):
+        """
+        @param window the size of the window in seconds
+        """
+        self.window = window
+        self.lock = threading.Lock()
+
+        # A list of [second, packets, bytes] slots
+        self.slots = []
+
+    def __trim(self, now):
+        limit = now - self.window
+
+        while self.slots and self.slots[0][0] <= limit:
+            del self.slots[0]
+
+    def update(self, packets=1, size=0, now=None):
+        """
+        Account packets and size bytes
+        @param now the current time or None to use time.time()
+        """
+        now = int(now or time.time())
+
+        self.lock.acquire()
+
+        try:
+            if self.slots and self.slots[-1][0] == now:
+                self.slots[-1][1] += packets
+                self.slots[-1][2] += size
+            else:
+                self.slots.append([now, packets, size])
+                self.__trim(now)
+        finally:
+            self.lock.release()
+
+    def get_rates(self, now=None):
+        """
+        @param now the current time or None to use time.time()
+        @return a tuple (packets/s, bytes/s)
+        """
+        now = int(now or time.time())
+
+        self.lock.acquire()
+
+        try:
+            self.__trim(now)
+
+            packets = sum([slot[1] for slot in self.slots])
+            size = sum([slot[2] for slot in self.slots])
+        finally:
+            self.lock.release()
+
+        return (float(packets) / self.window, float(size) / self.window)
+
+    def reset(self):
+        self.lock.acquire()
+        self.slots = []
+        self.lock.release()
+
 class HTMLStripper(HTMLParser):
     def __init__(self):
         self.reset()
@@ -489,4 +554,5 @@ def strip_tags(x):
     return s.get_stripped_data()
 
 __all__ = ['strip_tags', 'Singleton', 'Interruptable', 'ThreadPool', 'Node', \
-           'generate_traceback', 'with_decorator', 'defaultdict', 'odict']
+           'generate_traceback', 'with_decorator', 'defaultdict', 'odict', \
+           'RateMeter']
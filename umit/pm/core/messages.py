@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2009 Adriano Monteiro Marques
+#
+# Author: Francesco Piccinno <stack.box@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+"""
+Bus for the messages sent to the user by the audits.
+
+AuditManager.user_msg() posts UserMessage records to a MessageBus. Posting
+is cheap and thread safe: records are rate limited per facility, stored in
+a bounded queue and handed in batches to the sinks when flush() is called
+(on a timer by the GUI, after every post for the headless sinks).
+
+A sink is a callable accepting a list of UserMessage records.
+
+>>> out = []
+>>> bus = MessageBus(maxlen=3, rate=1, burst=2)
+>>> bus.add_sink(out.extend)
+>>> ret = [bus.post(UserMessage('msg %d' % i, 4, 'ftp')) for i in xrange(5)]
+>>> ret
+[True, True, False, False, False]
+>>> bus.rate = 0
+>>> ret = [bus.post(UserMessage('msg %d' % i)) for i in xrange(5)]
+>>> bus.flush()
+5
+>>> for record in out: print record
+notice msg 2
+notice msg 3
+notice msg 4
+ftp.warn 3 messages suppressed
+warn 4 messages dropped (queue full)
+>>> bus.flush()
+0
+"""
+
+import sys
+import time
+
+from threading import Lock
+from collections import deque
+
+try:
+    import json
+except ImportError:
+    try:
+        import simplejson as json
+    except ImportError:
+        json = None
+
+SEVERITIES = ('emerg', 'alert', 'crit', 'err', 'warn', 'notice', 'info',
+              'debug', 'none')
+
+class UserMessage(object):
+    __slots__ = ('time', 'severity', 'facility', 'msg')
+
+    def __init__(self, msg, severity=5, facility=None, ts=None):
+        """
+        @param msg the message to show to the user
+        @param severity an int (see AuditManager.user_msg)
+        @param facility a str representing a facility or None
+        @param ts the timestamp of the message (now if None)
+        """
+        self.msg = msg
+        self.severity = severity
+        self.facility = facility
+        self.time = ts or time.time()
+
+    def get_severity_name(self):
+        return SEVERITIES[self.severity]
+
+    def format(self):
+        """
+        @return the message in the 'facility.severity msg' form
+        """
+        if self.facility:
+            return '%s.%s %s' % (self.facility, SEVERITIES[self.severity],
+                                 self.msg)
+
+        return '%s %s' % (SEVERITIES[self.severity], self.msg)
+
+    def to_dict(self):
+        return {'time' : self.time, 'severity' : SEVERITIES[self.severity],
+                'facility' : self.facility, 'msg' : self.msg}
+
+    __str__ = format
+
+class MessageBus(object):
+    def __init__(self, maxlen=1024, rate=0, burst=100):
+        """
+        @param maxlen the maximum number of records waiting for a flush().
+                      The oldest are dropped when the queue is full
+        @param rate the number of records per second allowed for every
+                    facility or 0 for no limit
+        @param burst the number of records a facility could send at once
+        """
+        self.maxlen = maxlen
+        self.rate = rate
+        self.burst = burst
+
+        # If True every post() is followed by a flush()
+        self.synchronous = False
+
+        self.queue = deque()
+        self.sinks = []
+        self.lock = Lock()
+
+        # facility -> [tokens, last refill, suppressed records]
+        self.buckets = {}
+        self.dropped = 0
+
+    def set_limits(self, maxlen, rate, burst):
+        self.maxlen, self.rate, self.burst = maxlen, rate, burst
+
+    def add_sink(self, sink):
+        """
+        @param sink a callable accepting a list of UserMessage
+        """
+        if sink not in self.sinks:
+            self.sinks.append(sink)
+
+    def remove_sink(self, sink):
+        if sink in self.sinks:
+            self.sinks.remove(sink)
+
+    def post(self, record):
+        """
+        Queue a record for the next flush()
+        @param record a UserMessage
+        @return False if the record was suppressed by the rate limit
+        """
+        self.lock.acquire()
+
+        try:
+            if self.rate > 0 and not self.__consume(record):
+                return False
+
+            if len(self.queue) >= self.maxlen:
+                self.queue.popleft()
+                self.dropped += 1
+
+            self.queue.append(record)
+        finally:
+            self.lock.release()
+
+        if self.synchronous:
+            self.flush()
+
+        return True
+
+    def __consume(self, record):
+        now = record.time
+
+        try:
+            bucket = self.buckets[record.facility]
+        except KeyError:
+            bucket = self.buckets[record.facility] = [self.burst, now, 0]
+
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+
+        if tokens < 1:
+            bucket[0] = tokens
+            bucket[2] += 1
+            return False
+
+        bucket[0] = tokens - 1
+        return True
+
+    def flush(self):
+        """
+        Deliver the queued records to the sinks followed by a summary of
+        the records suppressed since the last flush()
+        @return the number of records delivered
+        """
+        self.lock.acquire()
+
+        try:
+            records = list(self.queue)
+            self.queue.clear()
+
+            for facility, bucket in self.buckets.items():
+                if bucket[2]:
+                    records.append(UserMessage('%d messages suppressed' % \
+                                               bucket[2], 4, facility))
+                    bucket[2] = 0
+
+            if self.dropped:
+                records.append(UserMessage('%d messages dropped (queue full)' \
+                                           % self.dropped, 4))
+                self.dropped = 0
+        finally:
+            self.lock.release()
+
+        if records:
+            for sink in self.sinks:
+                sink(records)
+
+        return len(records)
+
+###############################################################################
+# Sinks
+###############################################################################
+
+class StreamSink(object):
+    "Write the records in the 'facility.severity msg' form to a file object"
+
+    def __init__(self, out=sys.stdout):
+        self.out = out
+
+    def __call__(self, records):
+        for record in records:
+            print >> self.out, record.format()
+
+class JSONLinesSink(object):
+    "Write a JSON object for every record to a file, one per line"
+
+    def __init__(self, fname, mode='a'):
+        if json is None:
+            raise ImportError('json module is required')
+
+        self.out = open(fname, mode)
+
+    def __call__(self, records):
+        for record in records:
+            self.out.write(json.dumps(record.to_dict()) + '\n')
+
+        self.out.flush()
+
+    def close(self):
+        self.out.close()
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
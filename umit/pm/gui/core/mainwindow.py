@@ -65,6 +65,7 @@ from umit.pm.gui.tabs.statustab import StatusTab
 from umit.pm.gui.tabs.consoletab import ConsoleTab
 from umit.pm.gui.tabs.propertytab import PropertyTab
 from umit.pm.gui.tabs.hostlisttab import HostListTab
+from umit.pm.gui.tabs.auditperftab import AuditPerformanceTab
 from umit.pm.gui.tabs.operationstab import FileOperation
 from umit.pm.gui.tabs.protocolselectortab import ProtocolSelectorTab
 from umit.pm.gui.tabs.operationstab import OperationsTab, SniffOperation, \
@@ -596,6 +597,8 @@ class MainWindow(gtk.Window):
                           Prefs()['gui.views.console_tab'].value)
         self.register_tab(HostListTab(),
                           Prefs()['gui.views.hostlist_tab'].value)
+        self.register_tab(AuditPerformanceTab(),
+                          Prefs()['gui.views.audit_performance_tab'].value)
 
         self.add(self.vbox)
 
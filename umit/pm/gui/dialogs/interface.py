@@ -42,7 +42,7 @@ class CaptureOptions(gtk.Expander):
         self.set_border_width(4)
         self.set_label_widget(self.new_label(_('<b>Options</b>')))
 
-        tbl = gtk.Table(8, 4, False)
+        tbl = gtk.Table(15, 4, False)
         tbl.set_border_width(4)
         tbl.set_col_spacings(4)
 
@@ -70,6 +70,27 @@ class CaptureOptions(gtk.Expander):
         tbl.attach(self.new_label(_('Stop after:')),
                    0, 1, 7, 8, yoptions=gtk.SHRINK)
 
+        tbl.attach(self.new_label(_('Ring buffer:')),
+                   0, 1, 8, 9, yoptions=gtk.SHRINK)
+
+        tbl.attach(self.new_label(_('Ring buffer:')),
+                   0, 1, 9, 10, yoptions=gtk.SHRINK)
+
+        tbl.attach(self.new_label(_('Rotate spill file:')),
+                   0, 1, 10, 11, yoptions=gtk.SHRINK)
+
+        tbl.attach(self.new_label(_('Rotate spill file:')),
+                   0, 1, 11, 12, yoptions=gtk.SHRINK)
+
+        tbl.attach(self.new_label(_('Keep spill files:')),
+                   0, 1, 12, 13, yoptions=gtk.SHRINK)
+
+        tbl.attach(self.new_label(_('Capture workers:')),
+                   0, 1, 13, 14, yoptions=gtk.SHRINK)
+
+        tbl.attach(self.new_label(_('Raw prefilter:')),
+                   0, 1, 14, 15, yoptions=gtk.SHRINK)
+
         self.filter = gtk.Entry()
 
         btn = gtk.Button()
@@ -103,6 +124,7 @@ class CaptureOptions(gtk.Expander):
         self.method.append_text(_('Virtual interface'))
         self.method.append_text(_('tcpdump helper'))
         self.method.append_text(_('dumpcap helper'))
+        self.method.append_text(_('Native (PACKET_MMAP ring)'))
 
         self.method.set_active(0)
 
@@ -139,6 +161,62 @@ class CaptureOptions(gtk.Expander):
         tbl.attach(self.stop_time, 1, 2, 7, 8)
         tbl.attach(self.stop_time_combo, 2, 3, 7, 8, yoptions=gtk.SHRINK)
 
+        self.ring_count, ring_count_lbl = \
+            self.new_combo(0, maxint, [_("packet(s)")])
+
+        self.ring_size, self.ring_size_combo = \
+            self.new_combo(0, 1024, [_("KB"), _("MB"), _("GB")])
+
+        self.spill_size, self.spill_size_combo = \
+            self.new_combo(0, 1024, [_("KB"), _("MB"), _("GB")])
+
+        self.spill_time, self.spill_time_combo = \
+            self.new_combo(0, maxint,
+                           [_("second(s)"), _("minute(s)"), _("hour(s)")])
+
+        self.spill_files, spill_files_lbl = \
+            self.new_combo(0, maxint, [_("file(s)")])
+
+        tbl.attach(self.ring_count, 1, 2, 8, 9)
+        tbl.attach(ring_count_lbl, 2, 3, 8, 9, yoptions=gtk.SHRINK)
+
+        tbl.attach(self.ring_size, 1, 2, 9, 10)
+        tbl.attach(self.ring_size_combo, 2, 3, 9, 10, yoptions=gtk.SHRINK)
+
+        tbl.attach(self.spill_size, 1, 2, 10, 11)
+        tbl.attach(self.spill_size_combo, 2, 3, 10, 11, yoptions=gtk.SHRINK)
+
+        tbl.attach(self.spill_time, 1, 2, 11, 12)
+        tbl.attach(self.spill_time_combo, 2, 3, 11, 12, yoptions=gtk.SHRINK)
+
+        tbl.attach(self.spill_files, 1, 2, 12, 13)
+        tbl.attach(spill_files_lbl, 2, 3, 12, 13, yoptions=gtk.SHRINK)
+
+        self.workers, workers_lbl = \
+            self.new_combo(0, 64, [_("process(es)")])
+
+        self.workers.set_tooltip_markup(_('Spread the capture over n '
+            'processes using PACKET_FANOUT (native methods on Linux only)'))
+
+        tbl.attach(self.workers, 1, 2, 13, 14)
+        tbl.attach(workers_lbl, 2, 3, 13, 14, yoptions=gtk.SHRINK)
+
+        self.prefilter = gtk.Entry()
+
+        btn = gtk.Button()
+        btn.add(gtk.image_new_from_stock(gtk.STOCK_INFO, gtk.ICON_SIZE_BUTTON))
+        btn.set_relief(gtk.RELIEF_NONE)
+        btn.set_tooltip_markup(_('Comma separated list of '
+            '<tt>offset:size[&amp;mask]=value</tt> predicates checked on the '
+            'raw bytes before decoding. Use | for alternatives.\nFor example '
+            '<tt>12:2=0x0800,23:1=6</tt> to select TCP over IPv4'))
+
+        hbox = gtk.HBox(0, False)
+        hbox.pack_start(btn, False, False)
+
+        tbl.attach(self.prefilter, 1, 2, 14, 15, yoptions=gtk.SHRINK)
+        tbl.attach(hbox, 2, 3, 14, 15, yoptions=gtk.SHRINK)
+
         self.res_mac = gtk.CheckButton(_('Enable MAC name resolution'))
         self.res_name = gtk.CheckButton(_('Enable network name resolution'))
         self.res_transport = gtk.CheckButton(_('Enable transport name ' \
@@ -153,6 +231,11 @@ class CaptureOptions(gtk.Expander):
 
         self.audits = gtk.CheckButton(_('Enable audits'))
 
+        self.record = gtk.CheckButton(_('Record only to capture file'))
+        self.record.set_tooltip_markup(_('Write the raw frames to the capture '
+            'file without decoding them. The file could be opened when the '
+            'capture is finished (native methods only)'))
+
         tbl.attach(self.gui_real, 3, 4, 0, 1)
         tbl.attach(self.gui_scroll, 3, 4, 1, 2)
 
@@ -164,6 +247,7 @@ class CaptureOptions(gtk.Expander):
 
         tbl.attach(self.background, 3, 4, 6, 7)
         tbl.attach(self.audits, 3, 4, 7, 8)
+        tbl.attach(self.record, 3, 4, 8, 9)
 
         # Setting the default values
         self.res_mac.set_active(True)
@@ -278,6 +362,21 @@ class CaptureOptions(gtk.Expander):
 
         ssize = ssize * factor
 
+        ringcount = self.ring_count.get_value_as_int()
+
+        ringsize = self.ring_size.get_value_as_int()
+        ringsize = ringsize * self.__get_size_factor(self.ring_size_combo)
+
+        spillsize = self.spill_size.get_value_as_int()
+        spillsize = spillsize * self.__get_size_factor(self.spill_size_combo)
+
+        spilltime = self.spill_time.get_value_as_int()
+        spilltime = spilltime * self.__get_time_factor(self.spill_time_combo)
+
+        spillfiles = self.spill_files.get_value_as_int()
+        workers = self.workers.get_value_as_int()
+        prefilter = self.prefilter.get_text() or None
+
         real = self.gui_scroll.get_active()
         scroll = self.gui_scroll.get_active()
         resmac = self.res_mac.get_active()
@@ -286,6 +385,7 @@ class CaptureOptions(gtk.Expander):
         promisc = self.net_promisc.get_active()
         background = self.background.get_active()
         audits = self.audits.get_active()
+        record = self.record.get_active()
 
         dct = {
             'filter'       : filter,
@@ -304,10 +404,24 @@ class CaptureOptions(gtk.Expander):
             'promisc'      : promisc,
             'background'   : background,
             'audits'      : audits,
+            'ringcount'    : ringcount,
+            'ringsize'     : ringsize,
+            'spillsize'    : spillsize,
+            'spilltime'    : spilltime,
+            'workers'      : workers,
+            'prefilter'    : prefilter,
+            'spillfiles'   : spillfiles,
+            'record'       : record,
         }
 
         return dct
 
+    def __get_size_factor(self, combo):
+        return 1024 ** (combo.get_active() + 1)
+
+    def __get_time_factor(self, combo):
+        return 60 ** combo.get_active()
+
 class InterfaceList(gtk.VBox):
     def __init__(self):
         super(InterfaceList, self).__init__(False, 2)
@@ -345,6 +459,9 @@ class InterfaceList(gtk.VBox):
 
         self.tree.set_rules_hint(True)
 
+        # More interfaces could be captured in the same context
+        self.tree.get_selection().set_mode(gtk.SELECTION_MULTIPLE)
+
         sw = gtk.ScrolledWindow()
 
         sw.set_border_width(4)
@@ -356,13 +473,18 @@ class InterfaceList(gtk.VBox):
         self.pack_start(self.frame)
 
     def get_selected(self):
-        model, iter = self.tree.get_selection().get_selected()
+        model, paths = self.tree.get_selection().get_selected_rows()
 
-        if not iter:
+        if not paths:
             return
 
         # The first column is the name
-        return model.get_value(iter, 1)
+        ifaces = [model[path][1] for path in paths]
+
+        if len(ifaces) == 1:
+            return ifaces[0]
+
+        return ifaces
 
 class InterfaceDialog(gtk.Dialog):
     def __init__(self, parent):
@@ -403,7 +525,7 @@ class InterfaceDialog(gtk.Dialog):
 
         method = Prefs()['backend.system.sniff.capmethod'].value
 
-        if method < 0 and method > 3:
+        if method < 0 or method > 4:
             Prefs()['backend.system.sniff.capmethod'] = 0
             method = 0
 
@@ -416,7 +538,10 @@ class InterfaceDialog(gtk.Dialog):
         self.if_list.set_size_request(600, 200)
 
     def get_selected(self):
-        "@return the selected interface for sniffing or None"
+        """
+        @return the selected interface for sniffing, a list of interfaces if
+                more are selected or None
+        """
         return self.if_list.get_selected()
 
     def get_options(self):
@@ -424,7 +549,7 @@ class InterfaceDialog(gtk.Dialog):
         return self.options.get_options()
 
     def __on_selection_changed(self, selection, btn):
-        if selection.get_selected()[1]:
+        if selection.count_selected_rows():
             btn.set_sensitive(True)
         else:
             btn.set_sensitive(False)
@@ -474,3 +599,20 @@ class InterfaceDialog(gtk.Dialog):
                 d.run()
                 d.hide()
                 d.destroy()
+
+            elif opts['record'] and not opts['capfile']:
+                log.debug('Record only mode selected but the file entry is '
+                          'empty. Stopping response emission')
+
+                self.stop_emission('response')
+
+                d = HIGAlertDialog(self, gtk.DIALOG_DESTROY_WITH_PARENT | \
+                                         gtk.DIALOG_MODAL, gtk.MESSAGE_ERROR,
+                                   message_format=_("Some options are missing"),
+                                   secondary_text=_("You've selected record "
+                                                    "only mode. You need to "
+                                                    "specify a capture file "
+                                                    "to write to"))
+                d.run()
+                d.hide()
+                d.destroy()
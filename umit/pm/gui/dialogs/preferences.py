@@ -291,7 +291,10 @@ class ViewsPage(Page):
                 gtk.CheckButton(_('Payload Hack tab'))),
 
            ('gui.views.console_tab', None,
-                gtk.CheckButton(_('Python shell')))
+                gtk.CheckButton(_('Python shell'))),
+
+           ('gui.views.audit_performance_tab', None,
+                gtk.CheckButton(_('Audit performance')))
         ))
         ]
 
@@ -304,12 +307,20 @@ class BackendPage(Page):
         ('backend.system', _('Backend system:'), new_combo(('UMPA', 'Scapy'))),
 
         ('Scapy',
-          (('backend.scapy.interface', _('Default interface'), gtk.Entry()),)),
+          (('backend.scapy.interface', _('Default interface'), gtk.Entry()),
+           ('backend.system.sniff.lazy', None,
+            gtk.CheckButton(_('Dissect sniffed packets on demand'))),
+           ('backend.system.sniff.precompute', None,
+            gtk.CheckButton(_('Prepare the packet list while sniffing'))),
+           ('backend.system.static.workers',
+            _('Processes loading big files (0 for one per CPU)'),
+            gtk.SpinButton(gtk.Adjustment(0, 0, 64, 1, 1))),)),
 
         ('Capture methods',
           (
            ('backend.system.sniff.capmethod', _('Capture method for sniffing:'),
-            new_combo_enumerator(('Native', 'Virtual','TCPDump', 'Dumpcap'))),
+            new_combo_enumerator(('Native', 'Virtual','TCPDump', 'Dumpcap',
+                                  'Native (mmap)'))),
 
            ('backend.system.sendreceive.capmethod',
             _('Capture method for SendReceive:'),
@@ -321,7 +332,8 @@ class BackendPage(Page):
 
            ('backend.system.audit.capmethod',
             _('Capture method for Audit:'),
-            new_combo_enumerator(('Native', 'TCPDump', 'Dumpcap'))),
+            new_combo_enumerator(('Native', 'TCPDump', 'Dumpcap',
+                                  'Native (mmap)'))),
           )
         ),
 
@@ -331,6 +343,11 @@ class BackendPage(Page):
             gtk.CheckButton(_('Enable passive audits on sniff'))),
            ('backend.system.static.audits', None,
             gtk.CheckButton(_('Enable passive audits on loaded files'))),
+           ('backend.system.audit.fastdecode', None,
+            gtk.CheckButton(_('Decode the common headers without scapy'))),
+           ('backend.system.audit.workers',
+            _('Processes running the passive audits'),
+            gtk.SpinButton(gtk.Adjustment(1, 1, 64, 1, 1))),
           )
         ),
 
@@ -338,6 +355,8 @@ class BackendPage(Page):
           (
            ('backend.tcpdump', _('tcpdump path:'), gtk.Entry()),
            ('backend.dumpcap', _('dumpcap path:'), gtk.Entry()),
+           ('backend.system.helper.stream', None,
+            gtk.CheckButton(_('Stream packets from the helper stdout'))),
           )
         ),
 
@@ -746,6 +746,7 @@ class SequencePage(Perspective):
             self.filter_store.foreach(emit_row_changed)
 
             backend.set_field_value(layer, field, val)
+            packet.invalidate()
 
     def __update_combo(self):
         lst = []
@@ -93,6 +93,11 @@ class SniffPage(Perspective):
         self.connect('realize', self.__on_realize)
 
         self.timeout_id = None
+
+        # Absolute index of the first packet shown in the list (ring mode)
+        self.first_shown = 0
+        self.paged_back = False
+
         self.reload()
 
     def __on_realize(self, window):
@@ -105,19 +110,25 @@ class SniffPage(Perspective):
         stocks = (
             gtk.STOCK_REFRESH,
             gtk.STOCK_MEDIA_STOP,
-            gtk.STOCK_NETWORK
+            gtk.STOCK_NETWORK,
+            gtk.STOCK_GOTO_TOP,
+            gtk.STOCK_GOTO_BOTTOM
         )
 
         callbacks = (
             self.__on_restart,
             self.__on_stop,
-            self.__on_reorder
+            self.__on_reorder,
+            self.__on_page_back,
+            self.__on_follow
         )
 
         tooltips = (
             _('Restart capturing'),
             _('Stop capturing'),
-            _('Reorder flow')
+            _('Reorder flow'),
+            _('Show older spilled packets'),
+            _('Follow the capture')
         )
 
         for tooltip, stock, callback in zip(tooltips, stocks, callbacks):
@@ -202,9 +213,13 @@ class SniffPage(Perspective):
 
     def __cell_data_number(self, col, cell, model, iter):
         packet = model.get_value(iter, 0)
+        path = model.get_path(iter)
+        offset = (self.active_model is self.list_store) and \
+                 self.first_shown or 0
+
         cell.set_property('text', "%s)" % ".".join(
-            [str(i + 1) \
-                for i in model.get_path(iter)]
+            [str(path[0] + offset + 1)] + \
+            [str(i + 1) for i in path[1:]]
         ))
         cell.set_property('cell-background-gdk', self.__get_color(packet))
 
@@ -270,6 +285,9 @@ class SniffPage(Perspective):
         if isinstance(self.session.context, SniffContext):
             self.session.context.check_finished()
 
+        # Collected before get_data to report the display backlog
+        stats = self.session.context.format_statistics()
+
         self.tree.freeze_child_notify()
 
         for packet in self.session.context.get_data():
@@ -278,11 +296,12 @@ class SniffPage(Perspective):
             #while gtk.events_pending():
             #    gtk.main_iteration_do()
 
+        self.__trim_ring()
         self.tree.thaw_child_notify()
 
         # TODO: better handle the situation.
         if getattr(self.session.context, 'auto_scroll', True) and \
-           len(self.active_model) > 0:
+           not self.paged_back and len(self.active_model) > 0:
             self.tree.scroll_to_cell(len(self.active_model) - 1)
 
         alive = self.session.context.is_alive()
@@ -291,15 +310,47 @@ class SniffPage(Perspective):
             self.statusbar.label = "<b>%s</b>" % self.session.context.summary
             self.statusbar.image = gtk.STOCK_INFO
             self.statusbar.show()
+        elif stats:
+            self.statusbar.label = "<b>%s</b> %s" % \
+                                   (self.session.context.summary, stats)
+            self.statusbar.image = gtk.STOCK_INFO
+            self.statusbar.show()
 
         return alive
 
+    def __get_ring(self):
+        ring = getattr(backend, 'PacketRing', None)
+        data = self.session.context.get_all_data()
+
+        if ring and isinstance(data, ring):
+            return data
+
+        return None
+
+    def __trim_ring(self):
+        """
+        In ring buffer mode drop the rows of the packets already spilled to
+        disk unless the user is browsing older packets.
+        """
+
+        ring = self.__get_ring()
+
+        if not ring or self.paged_back:
+            return
+
+        while self.first_shown < ring.first and len(self.list_store) > 0:
+            self.list_store.remove(self.list_store.get_iter_first())
+            self.first_shown += 1
+
     # Public functions
 
     def clear(self):
         self.tree_store.clear()
         self.list_store.clear()
 
+        self.first_shown = 0
+        self.paged_back = False
+
         # Maybe we have to switch back to list store mode?
 
     def redraw(self, packet=None):
@@ -440,7 +491,8 @@ class SniffPage(Perspective):
         else:
             return
 
-        tree = backend.analyze_connections(packets)
+        tree = backend.analyze_connections(packets, table=getattr(
+                                           self.session.context, 'table', None))
 
         if tree:
             self.tree_store.clear()
@@ -482,14 +534,11 @@ class SniffPage(Perspective):
         if not packet:
             return False
 
+        # Source, destination, protocol and summary are cached
         strs = (
             str(model.get_path(iter)[0] + 1),
             packet.get_time(),
-            packet.get_source(),
-            packet.get_dest(),
-            packet.get_protocol_str(),
-            packet.summary()
-        )
+        ) + packet.get_display()
 
         # TODO: implement a search engine like num: summary: ?
 
@@ -499,6 +548,54 @@ class SniffPage(Perspective):
 
         return False
 
+    def __on_page_back(self, action):
+        ring = self.__get_ring()
+
+        if not ring:
+            return
+
+        if self.first_shown <= ring.lost:
+            self.statusbar.label = _('<b>No older packets available</b>')
+            self.statusbar.start_animation(True)
+            return
+
+        start = max(ring.lost, self.first_shown - (ring.max_packets or 1000))
+        packets = ring.get_range(start, self.first_shown)
+
+        # The packets of a spill file deleted meanwhile are skipped
+        if not packets:
+            self.statusbar.label = _('<b>No older packets available</b>')
+            self.statusbar.start_animation(True)
+            return
+
+        start = self.first_shown - len(packets)
+
+        for packet in reversed(packets):
+            self.list_store.prepend([packet])
+
+        self.statusbar.label = \
+            _('<b>Showing packets from %d (paged back from disk)</b>') % \
+            (start + 1)
+        self.statusbar.start_animation(True)
+
+        # Stop trimming otherwise the older packets will be dropped again
+        # until the user goes back to the live end (see __on_follow)
+        self.first_shown = start
+        self.paged_back = True
+
+        if len(self.active_model) > 0:
+            self.tree.scroll_to_cell(0)
+
+    def __on_follow(self, action):
+        if not self.paged_back:
+            return
+
+        self.paged_back = False
+        self.__trim_ring()
+
+        if len(self.active_model) > 0:
+            self.tree.scroll_to_cell(len(self.active_model) - 1)
+
     def __on_stop(self, action):
         self.session.context.stop()
     def __on_restart(self, action):
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2009 Adriano Monteiro Marques
+#
+# Author: Francesco Piccinno <stack.box@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+import gtk
+import gobject
+
+from umit.pm.core.i18n import _
+from umit.pm.gui.core.views import UmitView
+from umit.pm.gui.tabs.hostlisttab import new_button
+from umit.pm.manager.auditmanager import AuditManager
+
+class AuditPerformanceTab(UmitView):
+    """
+    AuditPerformanceTab shows the time spent by every decoder, dissector
+    and hook callback of the audits (see AuditManager.get_stats)
+    """
+
+    name = 'AuditPerformanceTab'
+    label_text = _('Audit performance')
+    tab_position = gtk.POS_BOTTOM
+    icon_name = gtk.STOCK_EXECUTE
+
+    # (title, type, format) of the columns
+    columns = (
+        (_('Kind'), str, None),
+        (_('Where'), str, None),
+        (_('Callback'), str, None),
+        (_('Calls'), int, None),
+        (_('Total ms'), float, '%.3f'),
+        (_('Avg us'), float, '%.1f'),
+        (_('Max us'), float, '%.1f'),
+        (_('Errors'), int, None),
+    )
+
+    def create_ui(self):
+        self._main_widget.set_border_width(4)
+        self._main_widget.set_spacing(2)
+
+        sw = gtk.ScrolledWindow()
+        sw.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
+        sw.set_shadow_type(gtk.SHADOW_ETCHED_IN)
+
+        self.store = gtk.ListStore(*[col[1] for col in self.columns])
+        self.tree = gtk.TreeView(self.store)
+
+        for idx, (title, type, fmt) in enumerate(self.columns):
+            rend = gtk.CellRendererText()
+            col = gtk.TreeViewColumn(title, rend, text=idx)
+
+            if fmt:
+                col.set_cell_data_func(rend, self.__format_cell, (idx, fmt))
+
+            col.set_sort_column_id(idx)
+            col.set_resizable(True)
+            self.tree.append_column(col)
+
+        self.store.set_sort_column_id(4, gtk.SORT_DESCENDING)
+
+        self.tree.set_rules_hint(True)
+        self.tree.set_search_column(2)
+        self.tree.set_enable_search(True)
+
+        sw.add(self.tree)
+        self._main_widget.pack_start(sw)
+
+        bb = gtk.HButtonBox()
+        bb.set_layout(gtk.BUTTONBOX_END)
+
+        self.btn_enable = gtk.CheckButton(_('Collect statistics'))
+        self.btn_enable.set_active(AuditManager().global_conf['profile'])
+        self.btn_enable.connect('toggled', self.__on_enable)
+
+        self.btn_reset = new_button(gtk.STOCK_CLEAR, _('Reset the counters'))
+        self.btn_reset.connect('clicked', self.__on_reset)
+
+        self.btn_refresh = new_button(gtk.STOCK_REFRESH, _('Refresh the list'))
+        self.btn_refresh.connect('clicked', self.__on_refresh)
+
+        bb.pack_start(self.btn_enable, False, False)
+        bb.pack_end(self.btn_reset, False, False)
+        bb.pack_end(self.btn_refresh, False, False)
+
+        self._main_widget.pack_end(bb, False, False)
+        self._main_widget.show_all()
+
+        self.timeout_id = None
+
+        if self.btn_enable.get_active():
+            self.__start_refresh()
+
+    def __format_cell(self, col, cell, model, iter, (idx, fmt)):
+        cell.set_property('text', fmt % model.get_value(iter, idx))
+
+    def __start_refresh(self):
+        if self.timeout_id is None:
+            self.timeout_id = gobject.timeout_add(2000, self.__on_timeout)
+
+    def __on_timeout(self):
+        self.populate()
+
+        if not self.btn_enable.get_active():
+            self.timeout_id = None
+            return False
+
+        return True
+
+    def __on_enable(self, button):
+        AuditManager().set_profiling(button.get_active())
+
+        if button.get_active():
+            self.__start_refresh()
+
+    def __on_reset(self, button):
+        AuditManager().reset_stats()
+        self.populate()
+
+    def __on_refresh(self, button):
+        self.populate()
+
+    def populate(self):
+        "Refresh the store with the current statistics"
+
+        self.store.clear()
+
+        for kind, where, name, calls, total, maxtime, errors in \
+            AuditManager().get_stats():
+
+            self.store.append([kind, where, name, calls, total * 1000.0,
+                               calls and total * 1000000.0 / calls or 0.0,
+                               maxtime * 1000000.0, errors])
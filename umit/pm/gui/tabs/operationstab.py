@@ -34,6 +34,7 @@ from umit.pm.gui.core.views import UmitView
 from umit.pm.gui.core.icons import get_pixbuf
 
 from umit.pm.manager.preferencemanager import Prefs
+from umit.pm.manager.auditmanager import new_audit_dispatcher, IL_TYPE_ETH
 
 class Operation(object):
     """
@@ -177,7 +178,20 @@ class FileOperation(Operation):
 
             self.summary = _('Unable to recognize file type.')
         else:
-            self.start_async_thread((ctx, ))
+            self.start_async_thread((ctx, self.__create_dispatcher(ctx)))
+
+    def __create_dispatcher(self, ctx):
+        # The audit workers can't be forked by the loading thread
+        if ctx is backend.SequenceContext or \
+           not Prefs()['backend.system.static.audits'].value:
+            return None
+
+        dispatcher = new_audit_dispatcher(IL_TYPE_ETH,
+                            Prefs()['backend.system.audit.fastdecode'].value,
+                            Prefs()['backend.system.audit.workers'].value)
+        dispatcher.start()
+
+        return dispatcher
 
     @trace
     def start_async_thread(self, udata):
@@ -224,30 +238,43 @@ class FileOperation(Operation):
         return False
 
     @trace
-    def _thread_main(self, udata=None):
+    def _thread_main(self, udata=None, dispatcher=None):
         if self.type == FileOperation.TYPE_LOAD:
             ctx = udata
             rctx = None
 
             log.debug('Loading file as %s' % str(ctx))
 
-            if ctx is backend.SequenceContext:
-                rctx = backend.SequenceContext(self.file)
+            # The dispatcher was started by the main thread: once it's
+            # passed to load() the context stops it, otherwise we do.
+            try:
+                if ctx is backend.SequenceContext:
+                    rctx = backend.SequenceContext(self.file)
 
-            elif ctx is backend.SniffContext or \
-                 ctx is backend.StaticContext:
+                elif ctx is backend.SniffContext or \
+                     ctx is backend.StaticContext:
 
-                rctx = backend.StaticContext(self.file, self.file,
+                    rctx = backend.StaticContext(self.file, self.file,
                                  Prefs()['backend.system.static.audits'].value)
 
-            if rctx is not None:
-                # Let's update our operation directly from load
-                if rctx.load(operation=self) == True:
-                    # Now let's add a callback to when
-                    gobject.idle_add(self.__on_idle, (ctx, rctx))
-                else:
-                    log.error('Error while loading context on %s.' % self.file)
-                    self.state = self.NOT_RUNNING
+                if rctx is not None:
+                    # Let's update our operation directly from load
+                    if dispatcher:
+                        loader, dispatcher = dispatcher, None
+                        ret = rctx.load(operation=self, dispatcher=loader)
+                    else:
+                        ret = rctx.load(operation=self)
+
+                    if ret == True:
+                        # Now let's add a callback to when
+                        gobject.idle_add(self.__on_idle, (ctx, rctx))
+                    else:
+                        log.error('Error while loading context on %s.' % \
+                                  self.file)
+                        self.state = self.NOT_RUNNING
+            finally:
+                if dispatcher:
+                    dispatcher.stop()
         else:
             log.debug('Saving %s to %s' % (self.ctx, self.ctx.cap_file))
 
@@ -350,16 +377,21 @@ class SniffOperation(backend.SniffContext, Operation):
     def __init__(self, iface, filter=None, minsize=0, maxsize=0, capfile=None, \
                  scount=0, stime=0, ssize=0, real=True, scroll=True, \
                  resmac=True, resname=False, restransport=True, promisc=True, \
-                 background=False, capmethod=0, audits=True):
+                 background=False, capmethod=0, audits=True, ringcount=0, \
+                 ringsize=0, spillsize=0, spilltime=0, spillfiles=0, \
+                 workers=0, prefilter=None, record=False):
 
         Operation.__init__(self)
         backend.SniffContext.__init__(self, iface, filter, minsize, maxsize,
                                       capfile, scount, stime, ssize, real,
                                       scroll, resmac, resname, restransport,
                                       promisc, background, capmethod, audits,
-                                      self.__recv_callback, None)
+                                      self.__recv_callback, None, ringcount,
+                                      ringsize, spillsize, spilltime,
+                                      spillfiles, workers, prefilter, record)
 
-        if not self.background:
+        # In record only mode there are no packets to show while sniffing
+        if not self.background and not self.record:
             self.session = ServiceBus().call('pm.sessions',
                                              'create_sniff_session', self)
         else:
@@ -379,10 +411,28 @@ class SniffOperation(backend.SniffContext, Operation):
         return ret
 
     def activate(self):
+        if self.record:
+            # Open the recorded file (lazily) once the capture is finished
+            if self.state != backend.SniffContext.RUNNING:
+                PMApp().main_window.open_generic_file_async(self.cap_file)
+
+            return
+
         if not self.session:
             self.session = ServiceBus().call('pm.sessions',
                                              'create_sniff_session', self)
 
+    def get_summary(self):
+        summary = backend.SniffContext.get_summary(self)
+
+        if self.state == backend.SniffContext.RUNNING:
+            stats = self.format_statistics()
+
+            if stats:
+                summary = '%s (%s)' % (summary, stats)
+
+        return summary
+
     def __recv_callback(self, packet, udata):
         if not self.SKIP_UPDATE:
             self.notify_parent()
@@ -431,7 +481,7 @@ class AuditOperation(backend.AuditContext, Operation):
     def __init__(self, dev1, dev2, bpf_filter, skipfwd, unoffensive):
         capmethod = Prefs()['backend.system.audit.capmethod'].value
 
-        if capmethod < 0 or capmethod > 2:
+        if capmethod < 0 or capmethod > 3:
             Prefs()['backend.system.sendreceive.capmethod'].value = 0
             capmethod = 0
 
@@ -441,6 +491,17 @@ class AuditOperation(backend.AuditContext, Operation):
         self.session = ServiceBus().call('pm.sessions', 'create_audit_session',
                                          self)
 
+    def get_summary(self):
+        summary = backend.AuditContext.get_summary(self)
+
+        if self.state == backend.AuditContext.RUNNING:
+            stats = self.format_statistics()
+
+            if stats:
+                summary = '%s (%s)' % (summary, stats)
+
+        return summary
+
 class OperationTree(gtk.TreeView):
     def __init__(self):
         self.store = gtk.ListStore(object)
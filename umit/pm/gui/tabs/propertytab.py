@@ -153,6 +153,11 @@ class PropertyTab(UmitView):
         # The tree argument is the PropertyGridTree object
 
         page = ServiceBus().call('pm.sessions', 'get_current_session')
+        packet, proto, field = self.grid.tree.get_selected_field()
+
+        # The field was changed directly on the protocol
+        if packet is not None:
+            packet.invalidate()
 
         # FIXME: check if the packet page object is avaiable
         # within this session or use isinstance(SessionPage, SequencePage)
@@ -160,8 +165,6 @@ class PropertyTab(UmitView):
             # No reload to avoid repopulating
             page.packet_page.redraw_hexview()
 
-            packet, proto, field = self.grid.tree.get_selected_field()
-
             if packet in self.notify:
                 for cb in self.notify[packet]:
                     cb(packet, proto, field, True)
@@ -19,11 +19,13 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
 
 import pango
+import gobject
 import gtk
 import os
 
 from umit.pm.core.i18n import _
 from umit.pm.core.const import PM_VERSION
+from umit.pm.manager.auditmanager import AuditManager
 from umit.pm.manager.preferencemanager import Prefs
 
 from umit.pm.gui.core.views import UmitView
@@ -150,3 +152,22 @@ class StatusTab(UmitView):
 
         self._main_widget.add(self.status)
         self._main_widget.show_all()
+
+        # The audits could send a lot of messages from other threads so they
+        # are queued by the MessageBus and shown here in batches
+        bus = AuditManager().msgbus
+        bus.add_sink(self.__on_messages)
+        self.timeout_id = gobject.timeout_add(200, self.__on_flush, bus)
+
+    def __on_flush(self, bus):
+        bus.flush()
+        return True
+
+    def __on_messages(self, records):
+        for record in records:
+            if record.severity <= 3:
+                self.status.error(record.format())
+            elif record.severity == 4:
+                self.status.warning(record.format())
+            else:
+                self.status.info(record.format())
@@ -23,8 +23,12 @@ Audit manager module
 """
 
 import sys
+import time
 import os.path
+import threading
 
+from Queue import Empty
+from logging import DEBUG
 from xml.sax import handler, make_parser
 from xml.sax.saxutils import XMLGenerator
 from xml.sax.xmlreader import AttributesImpl
@@ -32,6 +36,7 @@ from xml.sax.xmlreader import AttributesImpl
 from umit.pm.core.i18n import _
 from umit.pm.core.logger import log
 from umit.pm.core.bus import ServiceBus
+from umit.pm.core.messages import MessageBus, UserMessage
 from umit.pm.core.auditutils import AuditOperation
 from umit.pm.manager.sessionmanager import ConnectionManager
 from umit.pm.core.atoms import Singleton, defaultdict, generate_traceback
@@ -39,6 +44,11 @@ from umit.pm.core.const import PM_TYPE_STR, PM_TYPE_INT, PM_TYPE_INSTANCE,\
                                PM_HOME
 from umit.pm.core.netconst import *
 
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
 ###############################################################################
 # Decorators
 ###############################################################################
@@ -50,6 +60,56 @@ def coroutine(func):
         return cr
     return start
 
+###############################################################################
+# Profiling
+###############################################################################
+
+class CallbackStats(object):
+    "Counters of a decoder or hook callback (times are in seconds)"
+
+    __slots__ = ('calls', 'total', 'max', 'errors')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+
+def get_callback_name(callback):
+    "@return a readable name for a decoder or hook callback"
+    name = getattr(callback, '__name__', None) or repr(callback)
+    owner = getattr(callback, 'im_class', None)
+
+    if owner is not None:
+        name = '%s.%s' % (owner.__name__, name)
+
+    return name
+
+def profile_callback(callback, stats):
+    """
+    @return a function calling callback and updating the CallbackStats
+            stats with the wall time spent and the exceptions raised
+    """
+
+    def wrapper(*args, **kwargs):
+        start = time.time()
+
+        try:
+            return callback(*args, **kwargs)
+        except:
+            stats.errors += 1
+            raise
+        finally:
+            elapsed = time.time() - start
+
+            stats.calls += 1
+            stats.total += elapsed
+
+            if elapsed > stats.max:
+                stats.max = elapsed
+
+    return wrapper
+
 ###############################################################################
 # Configurations
 ###############################################################################
@@ -250,7 +310,6 @@ class AuditManager(Singleton):
     It's a singleton class that is used to dispatch packets.
     """
     def __init__(self):
-        self._output = None
         # It seems that specifying {} * n doesn't create a new object
         # but instead only create a new pointer to the same object.
         # Here we need separated dict so we should declare them all
@@ -266,12 +325,42 @@ class AuditManager(Singleton):
         }
         self._configurations = {}
 
+        # Lookup tables built from _decoders and _hooks by compile_tables()
+        self._compiled = None
+        self._generation = 0
+
+        # (kind, where, callback name) -> CallbackStats
+        self._stats = {}
+
+        # Plugins requiring the audits in this process (see require_serial)
+        self._serial = []
+
+        # flow key -> (generation, ports with a dissector). When _flows is
+        # full it becomes _flows_old and the previous _flows_old is dropped
+        # so at most global.flow_cache flows are remembered (see
+        # classify_flow)
+        self._flows = {}
+        self._flows_old = {}
+
         self.load_configurations()
 
         self._global_conf = self.register_configuration('global', {
             'debug' : [False, 'Turn out debugging'],
+            'profile' : [False, 'Collect time statistics for every decoder '
+                         'and hook callback'],
+            'msg_queue' : [1024, 'Maximum number of user messages waiting to '
+                           'be shown'],
+            'msg_rate' : [20, 'Maximum number of user messages per second '
+                          'for every facility (0 for no limit)'],
+            'msg_burst' : [100, 'Number of user messages a facility could '
+                           'send at once before being rate limited'],
+            'flow_cache' : [65536, 'Maximum number of flows whose dissectors '
+                            'are remembered'],
         })
 
+        # Sinks are added by the StatusTab or by the audittester
+        self._msgbus = MessageBus()
+
         self._global_cfields = self.register_configuration('global.cfields', {
             'username' : [PM_TYPE_STR, 'Account username'],
             'password' : [PM_TYPE_STR, 'Account password'],
@@ -286,6 +375,161 @@ class AuditManager(Singleton):
 
         self.add_decoder(APP_LAYER, PL_DEFAULT, self.__run_dissectors)
 
+    def invalidate_tables(self):
+        """
+        Force the lookup tables to be rebuilt before dispatching the next
+        packet. Called by every method changing decoders or hooks.
+        """
+        self._generation += 1
+        self._compiled = None
+
+    def compile_tables(self):
+        """
+        Build the lookup tables used to dispatch the packets: one dict per
+        level mapping the type to a (decoder, pre hooks, post hooks) tuple
+        and a dict mapping the hook points to tuples of callbacks. They are
+        rebuilt only when decoders or hooks change, that is when a plugin
+        is loaded or unloaded, or when profiling is switched (see
+        set_profiling). With profiling enabled every callback is wrapped
+        to update its statistics.
+
+        @return a tuple (decoders tables, hooks table)
+        """
+        generation = self._generation
+
+        if self._global_conf['profile']:
+            wrap = self.__profile
+        else:
+            wrap = lambda callback, kind, where: callback
+
+        decoders = []
+
+        for idx, level in enumerate(self._decoders):
+            table = {}
+
+            for type, (decoder, pre, post) in level.items():
+                if not (decoder or pre or post):
+                    continue
+
+                where = 'level %d type %s' % (idx, type)
+
+                if decoder:
+                    decoder = wrap(decoder, 'decoder', where)
+
+                table[type] = (decoder,
+                    tuple([wrap(hook, 'pre hook', where) for hook in pre]),
+                    tuple([wrap(hook, 'post hook', where) for hook in post]))
+
+            decoders.append(table)
+
+        hooks = {}
+
+        for name, callbacks in self._hooks.items():
+            hooks[name] = tuple([wrap(callback, 'hook', name) \
+                                 for callback in callbacks])
+
+        compiled = (tuple(decoders), hooks)
+
+        # Don't cache tables already outdated by another thread
+        if generation == self._generation:
+            self._compiled = compiled
+
+        return compiled
+
+    def __profile(self, callback, kind, where):
+        key = (kind, where, get_callback_name(callback))
+
+        try:
+            stats = self._stats[key]
+        except KeyError:
+            stats = self._stats[key] = CallbackStats()
+
+        return profile_callback(callback, stats)
+
+    # Sharding stuff
+
+    def require_serial(self, owner):
+        """
+        Run the passive audits in this process as long as owner is
+        registered. Used by the plugins building in their hooks a state read
+        by other parts of the program (a service, a view): it would be lost
+        in the ShardedAuditDispatcher workers.
+
+        @param owner the plugin instance
+        """
+        if owner not in self._serial:
+            self._serial.append(owner)
+
+    def release_serial(self, owner):
+        if owner in self._serial:
+            self._serial.remove(owner)
+
+    def is_serial_required(self):
+        "@return True if some plugin called require_serial"
+        return bool(self._serial)
+
+    # Profiling stuff
+
+    def set_profiling(self, enabled):
+        """
+        Enable or disable the collection of the callbacks statistics
+        @param enabled a bool
+        """
+        self._global_conf['profile'] = enabled
+        self.invalidate_tables()
+
+    def get_stats(self):
+        """
+        @return a list of (kind, where, name, calls, total, max, errors)
+                tuples, one for every profiled callback, sorted by total
+                time. kind is 'decoder', 'pre hook', 'post hook' or 'hook'
+                and where is the level and type of the decoder or the name
+                of the hook point. Times are in seconds.
+        """
+        ret = [key + (stats.calls, stats.total, stats.max, stats.errors) \
+               for key, stats in self._stats.items()]
+        ret.sort(key=lambda row: row[4], reverse=True)
+
+        return ret
+
+    def reset_stats(self):
+        for stats in self._stats.values():
+            stats.__init__()
+
+    def merge_stats(self, rows):
+        """
+        Add the statistics collected by another process
+        @param rows a list returned by get_stats()
+        """
+        for row in rows:
+            try:
+                stats = self._stats[row[:3]]
+            except KeyError:
+                stats = self._stats[row[:3]] = CallbackStats()
+
+            calls, total, maxtime, errors = row[3:]
+
+            stats.calls += calls
+            stats.total += total
+            stats.max = max(stats.max, maxtime)
+            stats.errors += errors
+
+    def dump_stats(self, out=sys.stdout):
+        """
+        Write a table with the statistics of get_stats() to out
+        @param out a file object
+        """
+        out.write('%-9s %-22s %-36s %8s %10s %10s %10s %6s\n' % \
+                  ('kind', 'where', 'callback', 'calls', 'total ms',
+                   'avg us', 'max us', 'errors'))
+
+        for kind, where, name, calls, total, maxtime, errors in \
+            self.get_stats():
+            out.write('%-9s %-22s %-36s %8d %10.3f %10.1f %10.1f %6d\n' % \
+                      (kind, where, name, calls, total * 1000.0,
+                       calls and total * 1000000.0 / calls or 0.0,
+                       maxtime * 1000000.0, errors))
+
     def __run_dissectors(self, mpkt):
         if mpkt.flags & MPKT_DONT_DISSECT:
             return
@@ -306,8 +550,14 @@ class AuditManager(Singleton):
             ret = None
 
         if ret is not None:
-            self.run_decoder(ret, mpkt.l4_src, mpkt)
-            self.run_decoder(ret, mpkt.l4_dst, mpkt)
+            # Most of the flows have no dissector at all
+            ports = self.classify_flow(ret, mpkt)
+
+            if ports:
+                if mpkt.l4_src in ports:
+                    self.run_decoder(ret, mpkt.l4_src, mpkt)
+                if mpkt.l4_dst in ports:
+                    self.run_decoder(ret, mpkt.l4_dst, mpkt)
 
         self.run_hook_point('pm::decoded', mpkt)
 
@@ -324,6 +574,62 @@ class AuditManager(Singleton):
 
         self.run_hook_point('pm::filter', mpkt)
 
+    def classify_flow(self, layer, mpkt):
+        """
+        Look up the dissectors for the flow of mpkt. The result is computed
+        on the first packet of the flow and remembered until a dissector is
+        added or removed (see invalidate_tables), the TCP connection is
+        closed or the flow is pushed out by global.flow_cache newer flows.
+
+        The key is the one of MetaPacket.get_flow() built from the decoders
+        attributes, so the headers are not decoded again.
+
+        @param layer APP_LAYER_TCP or APP_LAYER_UDP
+        @param mpkt a MetaPacket with the l3 and l4 attributes set
+        @return a tuple with the ports of the flow having a dissector
+        """
+        src = (mpkt.l3_src, mpkt.l4_src)
+        dst = (mpkt.l3_dst, mpkt.l4_dst)
+
+        # The same key for both directions
+        if src < dst:
+            key = (layer, src, dst)
+        else:
+            key = (layer, dst, src)
+
+        flows = self._flows
+        entry = flows.get(key)
+
+        if entry is None or entry[0] != self._generation:
+            entry = self._flows_old.pop(key, None)
+
+            if entry is None or entry[0] != self._generation:
+                table = (self._compiled or self.compile_tables())[0][layer]
+                entry = (self._generation,
+                         tuple([port for port in set((src[1], dst[1])) \
+                                if port in table]))
+
+            flows[key] = entry
+
+            if len(flows) * 2 >= self._global_conf['flow_cache']:
+                self._flows_old = flows
+                self._flows = {}
+
+        if layer == APP_LAYER_TCP and mpkt.l4_flags & (TH_FIN | TH_RST):
+            self.forget_flow(key)
+
+        return entry[1]
+
+    def forget_flow(self, key):
+        "Remove the flow key from the cache of classify_flow"
+        self._flows.pop(key, None)
+        self._flows_old.pop(key, None)
+
+    def purge_flows(self):
+        "Forget the dissectors of all the flows"
+        self._flows = {}
+        self._flows_old = {}
+
     # Configurations stuff
 
     def load_configurations(self):
@@ -384,23 +690,15 @@ class AuditManager(Singleton):
                         8 for none
         @param facility a str representing a facility
         """
-        trans = ('emerg', 'alert', 'crit', 'err', 'warn', 'notice', 'info',
-                 'debug', 'none')
-
-        if facility:
-            out = '%s.%s %s' % (facility, trans[severity], msg)
-        else:
-            out = '%s %s' % (trans[severity], msg)
+        record = UserMessage(msg, severity, facility)
+        conf = self._global_conf
 
-        if self._global_conf['debug']:
-            print out
+        if conf['debug']:
+            print record.format()
         else:
-            if not self._output:
-                import umit.pm.gui.core.app
-                tab = umit.pm.gui.core.app.PMApp().\
-                      main_window.get_tab('StatusTab')
-                self._output = tab.status
-            self._output.info(out)
+            self._msgbus.set_limits(conf['msg_queue'], conf['msg_rate'],
+                                    conf['msg_burst'])
+            self._msgbus.post(record)
 
     ############################################################################
     # General hooks
@@ -416,11 +714,13 @@ class AuditManager(Singleton):
             return False
 
         self._hooks[name] = []
+        self.invalidate_tables()
         return True
 
     def deregister_hook_point(self, name):
         try:
             del self._hooks[name]
+            self.invalidate_tables()
             return True
         except:
             return False
@@ -431,6 +731,7 @@ class AuditManager(Singleton):
                 self._hooks[name].append(callback)
             else:
                 self._hooks[name].insert(to, callback)
+            self.invalidate_tables()
             return True
         except:
             return False
@@ -438,18 +739,24 @@ class AuditManager(Singleton):
     def remove_from_hook_point(self, name, callback):
         try:
             self._hooks[name].remove(callback)
+            self.invalidate_tables()
             return True
         except:
             return False
 
     def run_hook_point(self, name, *args, **kwargs):
-        idx = 0
-        log.debug('Starting hook cascade for %s' % name)
-        while name in self._hooks and idx < len(self._hooks[name]):
-            callback = self._hooks[name][idx]
-            log.debug('Callback %d is %s' % (idx, callback))
-            callback(*args, **kwargs)
-            idx += 1
+        decoders, hooks = self._compiled or self.compile_tables()
+
+        # Checked at every call since the log level could change at runtime
+        if log.isEnabledFor(DEBUG):
+            log.debug('Starting hook cascade for %s' % name)
+
+            for idx, callback in enumerate(hooks.get(name, ())):
+                log.debug('Callback %d is %s' % (idx, callback))
+                callback(*args, **kwargs)
+        else:
+            for callback in hooks.get(name, ()):
+                callback(*args, **kwargs)
 
     ############################################################################
     # Injectors
@@ -498,6 +805,7 @@ class AuditManager(Singleton):
         log.debug("Registering dissector %s for level %s with type %s" % \
                   (decoder, level, type))
         self._decoders[level][type] = (decoder, [], [])
+        self.invalidate_tables()
 
     def remove_decoder(self, level, type, decoder, force=True):
         """
@@ -515,6 +823,7 @@ class AuditManager(Singleton):
                 return False
 
         del self._decoders[level][type]
+        self.invalidate_tables()
         return True
 
     def add_decoder_hook(self, level, type, decoder_hook, post=0):
@@ -522,12 +831,14 @@ class AuditManager(Singleton):
             self._decoders[level][type] = (None, [], [])
 
         self._decoders[level][type][post + 1].append(decoder_hook)
+        self.invalidate_tables()
 
     def remove_decoder_hook(self, level, type, decoder_hook, post=0):
         if type not in self._decoders[level]:
             return False
 
         self._decoders[level][type][post + 1].remove(decoder_hook)
+        self.invalidate_tables()
         return True
 
     def get_decoder(self, level, type):
@@ -539,12 +850,13 @@ class AuditManager(Singleton):
             return None, None, None
 
     def run_decoder(self, level, type, metapkt):
+        decoders = (self._compiled or self.compile_tables())[0]
+
         ret = None
         while level is not None and type is not None:
-            decoder, pre, post = self.get_decoder(level, type)
-
-
-            if not decoder and not pre and not post:
+            try:
+                decoder, pre, post = decoders[level][type]
+            except KeyError:
                 return
 
             #log.debug("Running decoder %s" % decoder)
@@ -583,11 +895,13 @@ class AuditManager(Singleton):
     # Properties
 
     def get_global_conf(self): return self._global_conf
+    def get_msgbus(self): return self._msgbus
 
     global_conf = property(get_global_conf)
+    msgbus = property(get_msgbus)
 
 class AuditDispatcher(object):
-    def __init__(self, datalink=IL_TYPE_ETH, context=None):
+    def __init__(self, datalink=IL_TYPE_ETH, context=None, fastdecode=False):
         """
         Create an audit manager to use in conjunction with a PacketProducer
         that feeds the instance with feed() method @see AuditManager.feed.
@@ -595,10 +909,13 @@ class AuditDispatcher(object):
         @param datalink the datalink to be used. As default we use IL_TYPE_ETH.
                         For more information on that @see pcap_datalink manpage
         @param context an AuditContext or None
+        @param fastdecode True to decode the common headers of the packets not
+                          yet dissected without passing from the backend
         """
 
         self._datalink = datalink
         self._context = context
+        self.fastdecode = fastdecode
         self._conn_manager = ConnectionManager()
         self._main_decoder = AuditManager().get_decoder(LINK_LAYER,
                                                         self._datalink)
@@ -615,43 +932,19 @@ class AuditDispatcher(object):
         if not mpkt:# or not self._main_decoder:
             return
 
+        # The decoders state is allocated only for audited packets
+        mpkt.init_audit_state(self.fastdecode)
+
         manager = AuditManager()
         manager.run_hook_point('pm::received', mpkt)
 
         if not self._context:
             manager.run_decoder(LINK_LAYER, self.datalink, mpkt)
+            mpkt.headers = None
             return
 
-        # Same code of run_decoder.
-        # Only executed when there's a context so we can have more granularity
-        # over various callbacks
-
-        level = LINK_LAYER
-        type = self.datalink
         mpkt.context = self._context
-
-        while level is not None and type is not None:
-            decoder, pre, post = manager.get_decoder(level, type)
-
-            if not decoder and not pre and not post:
-                break
-
-            #log.debug("Running decoder %s" % decoder)
-
-            for pre_hook in pre:
-                pre_hook(mpkt)
-
-            if decoder:
-                ret = decoder(mpkt)
-
-            for post_hook in post:
-                post_hook(mpkt)
-
-            if decoder and isinstance(ret, tuple):
-                # Infinite loop over there :)
-                level, type = ret
-            else:
-                break
+        manager.run_decoder(LINK_LAYER, self.datalink, mpkt)
 
         if not mpkt.flags & MPKT_FORWARDED:
             self._conn_manager.parse(mpkt)
@@ -661,17 +954,304 @@ class AuditDispatcher(object):
                 self._context.forward(mpkt)
 
         mpkt.context = None
+        mpkt.headers = None
         mpkt.data = ''
 
 
+    def start(self):
+        "Nothing to start (see ShardedAuditDispatcher.start)"
+        pass
+
+    def flush(self):
+        "Nothing to wait for (see ShardedAuditDispatcher.flush)"
+        pass
+
+    def stop(self):
+        pass
+
     def get_main_decoder(self): return self._main_decoder
     def set_main_decoder(self, dec): self._main_decoder = dec
 
     def get_datalink(self): return self._datalink
+    def set_datalink(self, datalink):
+        self._datalink = datalink
+        self._main_decoder = AuditManager().get_decoder(LINK_LAYER, datalink)
+
     def get_connection_manager(self): return self._conn_manager
 
     main_decoder = property(get_main_decoder, set_main_decoder)
-    datalink = property(get_datalink)
+    datalink = property(get_datalink, set_datalink)
+
+class ShardedAuditDispatcher(object):
+    """
+    A passive AuditDispatcher spreading the packets over worker processes
+    by flow (see MetaPacket.get_flow). The packets of a connection, in both
+    directions, always go to the same worker so the session state
+    (SessionManager, ConnectionManager, reassembly) is kept local to it.
+
+    The workers are forked by start(), that has to be called from the main
+    thread before the capture threads are created and after the plugins
+    registered their decoders and hooks. Every worker feeds its own
+    AuditDispatcher with packets rebuilt from the raw bytes. The messages
+    of user_msg, the flags, the cfields and the decoders attributes are
+    sent back and merged in the parent in the same order of feed(), so
+    the output is the same of the serial dispatcher. The connection
+    manager of the parent is updated with the merged packets.
+
+    Any other state built by the hooks stays in the workers, so the
+    plugins exposing it call AuditManager.require_serial() and
+    new_audit_dispatcher() doesn't shard while they are loaded.
+
+    Packets are sent in batches: flush() waits for all the packets fed so
+    far.
+    """
+
+    def __init__(self, datalink=IL_TYPE_ETH, workers=2, fastdecode=False,
+                 batch=128):
+        """
+        @param datalink the datalink of the packets
+        @param workers the number of worker processes
+        @param fastdecode passed to the AuditDispatcher of the workers
+        @param batch the number of packets sent at once
+        """
+
+        self._datalink = datalink
+        self._conn_manager = ConnectionManager()
+
+        self.workers = workers
+        self.fastdecode = fastdecode
+        self.batch = batch
+
+        self.procs = []
+        self.inputs = []
+        self.output = None
+
+        # Records not yet sent to every worker
+        self.pending = []
+        self.last = 0
+
+        # Sequence number of the next packet fed and of the next to merge
+        self.seq = 0
+        self.next = 0
+
+        # seq -> packet waiting for its results, seq -> results
+        self.inflight = {}
+        self.done = {}
+
+    def start(self):
+        "Fork the worker processes (see the class documentation)"
+
+        if self.procs:
+            return
+
+        if not multiprocessing:
+            raise Exception('multiprocessing module is not available')
+
+        self.output = multiprocessing.Queue()
+
+        for idx in xrange(self.workers):
+            queue = multiprocessing.Queue()
+            proc = multiprocessing.Process(target=self.__worker,
+                                           args=(queue, ),
+                                           name='AuditWorker-%d' % idx)
+            proc.daemon = True
+            proc.start()
+
+            self.inputs.append(queue)
+            self.procs.append(proc)
+            self.pending.append([])
+
+            log.debug('Audit worker %d spawned with pid %d' % (idx, proc.pid))
+
+        self.last = time.time()
+
+    def stop(self):
+        "Merge the pending packets and terminate the workers"
+
+        if not self.procs:
+            return
+
+        self.flush()
+
+        for queue in self.inputs:
+            queue.put(None)
+
+        # Every worker sends back its callbacks statistics before exiting
+        for proc in self.procs:
+            try:
+                AuditManager().merge_stats(self.output.get(True, 5.0))
+            except Empty:
+                pass
+
+        for proc in self.procs:
+            proc.join()
+
+        self.procs, self.inputs, self.pending = [], [], []
+        self.output = None
+
+    def feed(self, mpkt, *args):
+        """
+        Send mpkt to the worker of its flow. The results are merged later
+        by feed() or flush().
+
+        @param mpkt a MetaPacket object or None
+        """
+        if not mpkt:
+            return
+
+        if not self.procs:
+            raise Exception('The audit workers are not running')
+
+        flow = mpkt.get_flow()
+
+        if flow is None:
+            shard = 0
+        else:
+            shard = hash(flow) % self.workers
+
+        self.inflight[self.seq] = mpkt
+        self.pending[shard].append((self.seq, mpkt.get_record(), mpkt.flags))
+        self.seq += 1
+
+        # Partial batches are sent too or the merge of the other workers
+        # results would be stuck waiting for them
+        if self.seq % self.batch == 0 or time.time() - self.last >= 0.1:
+            self.__send()
+
+        self.__merge(False)
+
+    def flush(self):
+        "Wait for the results of all the packets fed so far"
+
+        if not self.procs:
+            return
+
+        self.__send()
+        self.__merge(True)
+
+    def __send(self):
+        for idx, queue in enumerate(self.inputs):
+            # The queue pickles the list later in another thread
+            if self.pending[idx]:
+                queue.put((self._datalink, self.pending[idx]))
+                self.pending[idx] = []
+
+        self.last = time.time()
+
+    def __merge(self, wait):
+        import umit.pm.backend
+
+        manager = AuditManager()
+
+        while True:
+            while self.next in self.done:
+                msgs, state = self.done.pop(self.next)
+                mpkt = self.inflight.pop(self.next)
+                self.next += 1
+
+                umit.pm.backend.set_fanout_state(mpkt, state)
+                self._conn_manager.parse(mpkt)
+
+                for msg in msgs:
+                    manager.user_msg(*msg)
+
+            if self.next == self.seq:
+                return
+
+            try:
+                results = self.output.get(wait, 1.0)
+            except Empty:
+                if not wait:
+                    return
+
+                if all([proc.is_alive() for proc in self.procs]):
+                    continue
+
+                log.error('An audit worker exited. Dropping %d packets' % \
+                          (self.seq - self.next))
+
+                self.inflight.clear()
+                self.done.clear()
+                self.next = self.seq
+                return
+
+            for seq, msgs, state in results:
+                self.done[seq] = (msgs, state)
+
+    def __worker(self, queue):
+        import umit.pm.backend
+
+        messages = []
+
+        def user_msg(msg, severity=5, facility=None):
+            messages.append((msg, severity, facility))
+
+        # The output and the statistics are merged by the parent process
+        manager = AuditManager()
+        manager.user_msg = user_msg
+        manager.reset_stats()
+
+        dispatcher = AuditDispatcher(self._datalink,
+                                     fastdecode=self.fastdecode)
+
+        while True:
+            item = queue.get()
+
+            if item is None:
+                self.output.put(manager.get_stats())
+                break
+
+            # The datalink could be set after the fork
+            datalink, records = item
+
+            if datalink != dispatcher.datalink:
+                dispatcher.datalink = datalink
+
+            results = []
+
+            for seq, record, flags in records:
+                mpkt = umit.pm.backend.MetaPacket.new_from_raw(*record)
+                mpkt.flags = flags
+
+                try:
+                    dispatcher.feed(mpkt)
+                except Exception, err:
+                    log.error('Error while auditing a packet')
+                    log.error(generate_traceback())
+
+                results.append((seq, messages[:],
+                                umit.pm.backend.get_fanout_state(mpkt)))
+                del messages[:]
+
+            self.output.put(results)
+
+    def get_datalink(self): return self._datalink
+    def set_datalink(self, datalink): self._datalink = datalink
+    def get_connection_manager(self): return self._conn_manager
+
+    datalink = property(get_datalink, set_datalink)
+
+def new_audit_dispatcher(datalink=IL_TYPE_ETH, fastdecode=False, workers=1):
+    """
+    The caller has to call start() on the returned dispatcher before
+    feeding it.
+
+    @param workers the number of worker processes. With less than 2 workers
+                   the audits are run by the calling thread. The audits are
+                   run by the calling thread also if some plugin requires
+                   it (see AuditManager.require_serial) or if the caller is
+                   not the main thread, where forking is not safe.
+    @return an AuditDispatcher or a ShardedAuditDispatcher
+    """
+    if workers > 1 and multiprocessing:
+        if AuditManager().is_serial_required():
+            log.info('Some plugin requires the audits to be run serially')
+        elif threading.currentThread().getName() != 'MainThread':
+            log.info('Not forking the audit workers from a thread')
+        else:
+            return ShardedAuditDispatcher(datalink, workers, fastdecode)
+
+    return AuditDispatcher(datalink, fastdecode=fastdecode)
 
 ###############################################################################
 # Plugin related classes
@@ -894,22 +1474,41 @@ class AuditTester(object):
         test.start() # Threaded
         test.join()
     """
-    def __init__(self, pcapfile, datalink=IL_TYPE_ETH):
+    def __init__(self, pcapfile, datalink=IL_TYPE_ETH, fastdecode=False,
+                 workers=1):
         """
         Launch an audit manager against a pcap file using the selected backend
+
+        @param fastdecode True to feed the dispatcher with packets not yet
+                          dissected and use the fast header decoder
+        @param workers the number of processes running the audits
         """
         import umit.pm.backend
 
-        self.dispatcher = AuditDispatcher(datalink)
+        self.dispatcher = new_audit_dispatcher(datalink, fastdecode, workers)
+
+        if fastdecode:
+            callback = self.feed_raw
+        else:
+            callback = self.dispatcher.feed
+
         self.ctx = umit.pm.backend.SniffContext(None, capfile=pcapfile, capmethod=1,
-                                                callback=self.dispatcher.feed,
+                                                callback=callback,
                                                 audits=False)
 
+    def feed_raw(self, mpkt, udata=None):
+        import umit.pm.backend
+
+        self.dispatcher.feed(umit.pm.backend.MetaPacket.new_from_raw(
+            mpkt.get_raw(), mpkt.get_rawtime(), mpkt.root.__class__))
+
     def start(self):
         log.debug('Starting context for test')
+        self.dispatcher.start()
         self.ctx.start()
 
     def join(self):
         log.debug('Waiting for test thread termination')
         # We have to use that for the moment since join in SniffContext is dummy
         self.ctx.thread.join()
+        self.dispatcher.stop()
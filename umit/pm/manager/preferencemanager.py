@@ -214,6 +214,7 @@ class Prefs(Singleton):
         'gui.views.hack_tab' : False,
         'gui.views.console_tab' : False,
         'gui.views.hostlist_tab' : True,
+        'gui.views.audit_performance_tab' : False,
 
         'backend.system' : 'scapy',
 
@@ -224,10 +225,35 @@ class Prefs(Singleton):
         'backend.system.audit.capmethod' : 0,
 
         'backend.system.sniff.audits' : True,
+
+        # Max number of packet batches waiting to be decoded
+        'backend.system.sniff.decodequeue' : 1024,
+
+        # Keep the raw bytes of the sniffed packets and dissect on demand
+        'backend.system.sniff.lazy' : True,
+
+        # Build the packet list strings in the decode thread
+        'backend.system.sniff.precompute' : False,
         'backend.system.static.audits' : True,
 
+        # Processes used to load big files (0 for one per cpu, 1 to disable)
+        'backend.system.static.workers' : 0,
+
+        # Decode the common headers of the audited packets with struct.
+        # The audittester -c runs of the plugins check it against scapy.
+        'backend.system.audit.fastdecode' : True,
+
+        # Processes running the passive audits (1 to run them in the
+        # capture thread). Plugins keeping state for the rest of the program,
+        # like the profiler behind the Hosts view, force a single process
+        # (see AuditManager.require_serial).
+        'backend.system.audit.workers' : 1,
+
         'backend.scapy.interface' : '',
 
+        # Read the helper output from a pipe instead of a temporary file
+        'backend.system.helper.stream' : True,
+
         'backend.tcpdump' : '/usr/sbin/tcpdump',
         'backend.dumpcap' : '/usr/bin/dumpcap',
 
@@ -24,6 +24,8 @@ Session manager module.
 
 import time
 
+from logging import DEBUG
+
 from umit.pm.core.logger import log
 from umit.pm.core.atoms import Singleton, defaultdict
 from umit.pm.core.netconst import *
@@ -225,7 +227,6 @@ class ConnectionManager(object):
         if not mpkt.l4_src or not mpkt.l4_dst:
             return
 
-        log.debug("Parsing new mpkt")
         hv, conn = self.search(mpkt)
 
         if conn:
@@ -249,14 +250,16 @@ class ConnectionManager(object):
     def add(self, mpkt, hv):
         conn = Connection(mpkt)
 
-        log.debug("Adding new connection %s" % conn)
+        if log.isEnabledFor(DEBUG):
+            log.debug("Adding new connection %s" % conn)
 
         self.connections[hv].append(conn)
         self.update(conn, mpkt)
         self.conn_list.append(conn)
 
     def update(self, conn, mpkt):
-        log.debug("Updating connection %s" % conn)
+        if log.isEnabledFor(DEBUG):
+            log.debug("Updating connection %s" % conn)
 
         conn.ts = time.time()
 